@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 合成工单数据生成：按DataChecker的表映射同时写入SQLite（MySQL替身）与内存ES，并按比例注入差异
+
+import json
+import random
+import sqlite3
+import string
+from datetime import datetime, timedelta
+
+# 注入的差异类型
+DRIFT_KINDS = ('main_field', 'nested_field', 'missing_nested', 'operating_field', 'missing_doc')
+
+# 取值为0/1的标志字段
+FLAG_FIELDS = {'Deleted', 'IsUrgent', 'IsCustomer', 'IsEnabled'}
+
+# 取值范围很小的状态类字段，聚合对账按这些字段分组
+ENUM_FIELDS = {
+    'WorkStatus': tuple(range(1, 9)),
+    'AppCode': ('app', 'wx', 'web', 'api'),
+}
+
+def is_time_field(field):
+    return field.endswith('At') or field.endswith('Time') or field == 'LastUpdateTimeStamp'
+
+def is_int_field(field):
+    return field.endswith('Id') or field in FLAG_FIELDS
+
+class DataGenerator:
+    """按表映射生成合成工单
+    
+    每个工单在主表一行，每张子表fanout行，tb_operatinginfo表fanout行；客户特殊配置按客户生成。
+    字符串字段从预生成的值池中随机选取，长度为field_size。
+    """
+    
+    def __init__(self, checker, orders=10000, fanout=2, field_size=16, drift_rate=0.01,
+                 customers=200, configs_per_customer=3, seed=1):
+        self.checker = checker
+        self.orders = orders
+        self.fanout = fanout
+        self.field_size = field_size
+        self.drift_rate = drift_rate
+        self.customers = max(1, customers)
+        self.configs_per_customer = configs_per_customer
+        self.rng = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+        self.date_fields = set(checker.DATE_FIELDS)
+        self.json_fields = set(checker.json_fields)
+        letters = string.ascii_letters + string.digits
+        self.pool = [''.join(self.rng.choices(letters, k=field_size)) for _ in range(1024)]
+        self.next_row_id = 1
+        # 注入了差异的工单ID -> 差异类型
+        self.drifted = {}
+    
+    def value(self, field):
+        """生成一个MySQL侧的字段值"""
+        if field in FLAG_FIELDS:
+            return 0 if field == 'Deleted' else self.rng.randint(0, 1)
+        if field in ENUM_FIELDS:
+            return self.rng.choice(ENUM_FIELDS[field])
+        if field in self.json_fields:
+            return json.dumps({
+                'code': self.rng.choice(self.pool),
+                'amount': self.rng.randint(1, 100000) / 100,
+                'items': [{'sku': self.rng.choice(self.pool), 'qty': self.rng.randint(1, 5)}
+                          for _ in range(self.rng.randint(1, 4))],
+            })
+        if is_time_field(field):
+            return self.now - timedelta(seconds=self.rng.randint(60, 60 * 86400))
+        if is_int_field(field):
+            return self.rng.randint(1, 1000000)
+        return self.rng.choice(self.pool)
+    
+    def es_value(self, field, value):
+        """MySQL值在ES中的表示：映射中的日期字段为ISO格式，其他时间字段与MySQL文本一致，
+        JSON字段键顺序和空白与MySQL不同（结构相同）"""
+        if field in self.json_fields:
+            return json.dumps(json.loads(value), sort_keys=True, indent=1)
+        if isinstance(value, datetime):
+            if field in self.date_fields:
+                return value.strftime('%Y-%m-%dT%H:%M:%S')
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value
+    
+    def row(self, fields, **fixed):
+        """生成一行数据，返回 (MySQL行, ES文档)"""
+        mysql_row = {field: self.value(field) for field in fields}
+        mysql_row['Id'] = self.next_row_id
+        self.next_row_id += 1
+        mysql_row.update(fixed)
+        return mysql_row, {field: self.es_value(field, value) for field, value in mysql_row.items()}
+    
+    def create_schema(self, db):
+        """按表映射建表，并为工单键字段建索引"""
+        checker = self.checker
+        db.execute("CREATE TABLE tb_workorder (Id INTEGER PRIMARY KEY, Deleted INTEGER, CreatedAt TEXT)")
+        db.execute("CREATE INDEX idx_workorder_created ON tb_workorder (CreatedAt)")
+        tables = list(checker.table_mappings.items()) + list(checker.special_tables.items())
+        for table_name, mapping in tables:
+            columns = [f"{field} INTEGER PRIMARY KEY" if field == 'Id' else field for field, _ in mapping['fields']]
+            db.execute(f"CREATE TABLE {table_name} ({', '.join(columns)})")
+            if mapping.get('es_path') != "":
+                db.execute(f"CREATE INDEX idx_{table_name}_{mapping['id_field']} ON {table_name} ({mapping['id_field']})")
+            for field, _ in mapping['fields']:
+                if field in ('UpdatedAt', 'InsertTime'):
+                    db.execute(f"CREATE INDEX idx_{table_name}_{field} ON {table_name} ({field})")
+    
+    def insert(self, db, table_name, rows):
+        if not rows:
+            return
+        columns = list(rows[0])
+        db.executemany(
+            f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+            [[to_text(row[column]) for column in columns] for row in rows]
+        )
+    
+    def generate(self, db_path, es):
+        """生成数据写入SQLite文件和FakeElasticsearch"""
+        checker = self.checker
+        main_table = checker.get_main_table()
+        main_fields = [field for field, _ in checker.table_mappings[main_table]['fields']]
+        child_tables = [(table_name, mapping) for table_name, mapping in checker.table_mappings.items()
+                        if mapping['es_path'] != ""]
+        operating = checker.special_tables['tb_operatinginfo']
+        custconfig = checker.special_tables['basic_custspecialconfig']
+        
+        db = sqlite3.connect(db_path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=OFF")
+        self.create_schema(db)
+        
+        # 客户特殊配置
+        config_rows = []
+        for customer_id in range(1, self.customers + 1):
+            for _ in range(self.configs_per_customer):
+                mysql_row, doc = self.row([field for field, _ in custconfig['fields']], CustomerId=customer_id)
+                config_rows.append(mysql_row)
+                es.put(custconfig['es_index'], doc['Id'], doc)
+        self.insert(db, 'basic_custspecialconfig', config_rows)
+        
+        pending = {'tb_workorder': [], main_table: [], 'tb_operatinginfo': []}
+        for order_id in range(1, self.orders + 1):
+            main_row, doc = self.row(main_fields, Id=order_id, CustomerId=self.rng.randint(1, self.customers))
+            # Id由工单号决定，行Id计数器不受影响
+            self.next_row_id -= 1
+            pending['tb_workorder'].append({'Id': order_id, 'Deleted': 0, 'CreatedAt': main_row.get('CreatedAt')})
+            pending[main_table].append(main_row)
+            
+            for table_name, mapping in child_tables:
+                doc[mapping['es_path']] = []
+                for _ in range(self.fanout):
+                    child_row, child_doc = self.row([field for field, _ in mapping['fields']],
+                                                    **{mapping['id_field']: order_id})
+                    pending.setdefault(table_name, []).append(child_row)
+                    doc[mapping['es_path']].append(child_doc)
+            
+            operating_docs = []
+            for _ in range(self.fanout):
+                operating_row, operating_doc = self.row([field for field, _ in operating['fields']],
+                                                        WorkOrderId=order_id)
+                pending['tb_operatinginfo'].append(operating_row)
+                operating_docs.append(operating_doc)
+            
+            if self.rng.random() < self.drift_rate:
+                self.inject(order_id, doc, operating_docs, child_tables, main_fields)
+            
+            if self.drifted.get(order_id) != 'missing_doc':
+                es.put(checker.main_index_name, order_id, doc)
+            for operating_doc in operating_docs:
+                es.put(operating['es_index'], operating_doc['Id'], operating_doc)
+            
+            if order_id % 5000 == 0:
+                for table_name, rows in pending.items():
+                    self.insert(db, table_name, rows)
+                    rows.clear()
+        
+        for table_name, rows in pending.items():
+            self.insert(db, table_name, rows)
+        db.commit()
+        db.close()
+        return self.drifted
+    
+    def inject(self, order_id, doc, operating_docs, child_tables, main_fields):
+        """在ES侧注入一种差异"""
+        kind = self.rng.choice(DRIFT_KINDS)
+        if kind in ('nested_field', 'missing_nested') and not (child_tables and self.fanout):
+            kind = 'main_field'
+        if kind == 'operating_field' and not operating_docs:
+            kind = 'main_field'
+        
+        if kind == 'main_field':
+            field = self.rng.choice([field for field in main_fields if field not in ('Id', 'CustomerId')])
+            doc[field] = f"drift-{order_id}"
+        elif kind == 'nested_field':
+            _, mapping = self.rng.choice(child_tables)
+            item = self.rng.choice(doc[mapping['es_path']])
+            item[self.rng.choice([field for field in item if field not in ('Id', mapping['id_field'])])] = \
+                f"drift-{order_id}"
+        elif kind == 'missing_nested':
+            _, mapping = self.rng.choice(child_tables)
+            doc[mapping['es_path']].pop()
+        elif kind == 'operating_field':
+            item = self.rng.choice(operating_docs)
+            item['OperName'] = f"drift-{order_id}"
+        self.drifted[order_id] = kind
+
+def to_text(value):
+    """datetime按MySQL文本格式写入SQLite"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 进程内的ElasticSearch替身：只实现检查程序用到的REST接口，数据保存在内存中
+
+import json
+import threading
+import functools
+import itertools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+ES_VERSION = "7.17.0"
+
+@functools.lru_cache(maxsize=256)
+def compile_includes(includes):
+    """把点分路径列表编译为字段树，叶子为None"""
+    tree = {}
+    for path in includes:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is None:
+                break
+            node = child
+        else:
+            node[parts[-1]] = None
+    return tree
+
+def apply_includes(value, tree):
+    """按字段树过滤对象，数组中的每个对象分别处理"""
+    if isinstance(value, list):
+        return [apply_includes(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: value[key] if sub is None else apply_includes(value[key], sub)
+            for key, sub in tree.items() if key in value}
+
+def filter_source(source, includes):
+    """按_source包含字段列表过滤文档，为空时返回完整文档"""
+    if includes is None or includes is True:
+        return source
+    if includes is False:
+        return None
+    if isinstance(includes, dict):
+        includes = includes.get('includes')
+        if not includes:
+            return source
+    if isinstance(includes, str):
+        includes = [includes]
+    return apply_includes(source, compile_includes(tuple(includes)))
+
+def get_field(doc, field):
+    """取文档中点分路径的字段值（只取第一层数组的第一个值）"""
+    value = doc
+    for part in field.split('.'):
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def same_value(left, right):
+    """按ES的宽松规则比较查询值与字段值（数字与数字字符串相等）"""
+    if left is None or right is None:
+        return left is right
+    return left == right or str(left) == str(right)
+
+def in_range(value, bounds):
+    """判断字段值是否在range查询范围内"""
+    if value is None:
+        return False
+    for op, bound in bounds.items():
+        if op not in ('gt', 'gte', 'lt', 'lte'):
+            continue
+        left, right = value, bound
+        if isinstance(left, str) != isinstance(right, str):
+            left, right = str(left), str(right)
+        if (op == 'gt' and not left > right) or (op == 'gte' and not left >= right) \
+                or (op == 'lt' and not left < right) or (op == 'lte' and not left <= right):
+            return False
+    return True
+
+def matches(query, doc):
+    """判断文档是否满足查询（支持match_all/term/terms/range/exists/bool）"""
+    if not query or 'match_all' in query:
+        return True
+    if 'term' in query:
+        (field, value), = query['term'].items()
+        if isinstance(value, dict):
+            value = value.get('value')
+        return same_value(get_field(doc, field), value)
+    if 'terms' in query:
+        (field, values), = query['terms'].items()
+        field_value = get_field(doc, field)
+        return any(same_value(field_value, value) for value in values)
+    if 'range' in query:
+        (field, bounds), = query['range'].items()
+        return in_range(get_field(doc, field), bounds)
+    if 'exists' in query:
+        return get_field(doc, query['exists']['field']) is not None
+    if 'bool' in query:
+        clause = query['bool']
+        as_list = lambda value: value if isinstance(value, list) else [value]
+        if not all(matches(q, doc) for q in as_list(clause.get('must', [])) + as_list(clause.get('filter', []))):
+            return False
+        if any(matches(q, doc) for q in as_list(clause.get('must_not', []))):
+            return False
+        should = as_list(clause.get('should', []))
+        return not should or any(matches(q, doc) for q in should)
+    raise ValueError(f"不支持的查询: {list(query)}")
+
+def sort_spec(sort):
+    """把sort参数规范化为 [(字段, 是否倒序)]"""
+    spec = []
+    for item in sort or []:
+        if isinstance(item, str):
+            spec.append((item, False))
+            continue
+        (field, order), = item.items()
+        if isinstance(order, dict):
+            order = order.get('order', 'asc')
+        spec.append((field, order == 'desc'))
+    return spec
+
+def sort_key(value):
+    """排序键，缺失值排在最后"""
+    return (value is None, value if value is not None else 0)
+
+def aggregate(aggs, docs):
+    """计算聚合（支持min/max/sum/avg/value_count/cardinality/terms/histogram/composite及嵌套子聚合）"""
+    results = {}
+    for name, spec in (aggs or {}).items():
+        sub_aggs = spec.get('aggs') or spec.get('aggregations')
+        kind = next(key for key in spec if key not in ('aggs', 'aggregations'))
+        params = spec[kind]
+        
+        if kind in ('min', 'max', 'sum', 'avg', 'value_count', 'cardinality'):
+            values = [get_field(doc, params['field']) for doc in docs]
+            values = [value for value in values if value is not None]
+            if kind == 'value_count':
+                results[name] = {'value': len(values)}
+            elif kind == 'cardinality':
+                results[name] = {'value': len({str(value) for value in values})}
+            elif not values:
+                results[name] = {'value': 0 if kind == 'sum' else None}
+            elif kind == 'sum':
+                results[name] = {'value': float(sum(values))}
+            elif kind == 'avg':
+                results[name] = {'value': sum(values) / len(values)}
+            else:
+                value = min(values) if kind == 'min' else max(values)
+                # 日期字段的min/max返回毫秒时间戳和value_as_string，这里直接返回原字符串
+                results[name] = {'value': value}
+            continue
+        
+        if kind == 'terms':
+            groups = {}
+            for doc in docs:
+                value = get_field(doc, params['field'])
+                if value is None:
+                    value = params.get('missing')
+                if value is not None:
+                    groups.setdefault(value, []).append(doc)
+            ordered = sorted(groups.items(), key=lambda item: (-len(item[1]), str(item[0])))[:params.get('size', 10)]
+            results[name] = {'buckets': [
+                dict({'key': key, 'doc_count': len(group)}, **aggregate(sub_aggs, group)) for key, group in ordered
+            ]}
+            continue
+        
+        if kind == 'histogram':
+            interval = params['interval']
+            offset = params.get('offset', 0)
+            groups = {}
+            for doc in docs:
+                value = get_field(doc, params['field'])
+                if value is not None:
+                    key = (float(value) - offset) // interval * interval + offset
+                    groups.setdefault(key, []).append(doc)
+            results[name] = {'buckets': [
+                dict({'key': key, 'doc_count': len(group)}, **aggregate(sub_aggs, group))
+                for key, group in sorted(groups.items()) if len(group) >= params.get('min_doc_count', 0)
+            ]}
+            continue
+        
+        if kind == 'composite':
+            results[name] = composite(params, sub_aggs, docs)
+            continue
+        
+        raise ValueError(f"不支持的聚合: {kind}")
+    return results
+
+def composite_value(doc, source):
+    """composite聚合中一个来源的取值：terms取原值，按天的date_histogram取日期部分"""
+    (kind, params), = source.items()
+    value = get_field(doc, params['field'])
+    if value is None or kind == 'terms':
+        return value
+    if kind == 'date_histogram' and params.get('calendar_interval', params.get('fixed_interval')) in ('1d', 'day'):
+        return str(value)[:10]
+    raise ValueError(f"不支持的composite来源: {kind} {params}")
+
+def composite(params, sub_aggs, docs):
+    """composite聚合：按来源组合分组，按键升序（缺失值在前）用after翻页"""
+    names = [name for source in params['sources'] for name in source]
+    sources = [source[name] for source, name in zip(params['sources'], names)]
+    groups = {}
+    for doc in docs:
+        key = tuple(composite_value(doc, source) for source in sources)
+        if None in key and not all(next(iter(source.values())).get('missing_bucket')
+                                   for value, source in zip(key, sources) if value is None):
+            continue
+        groups.setdefault(key, []).append(doc)
+    
+    order = lambda key: tuple((value is not None, value if value is not None else 0) for value in key)
+    keys = sorted(groups, key=order)
+    if params.get('after'):
+        after = order(tuple(params['after'].get(name) for name in names))
+        keys = [key for key in keys if order(key) > after]
+    keys = keys[:params.get('size', 10)]
+    result = {'buckets': [
+        dict({'key': dict(zip(names, key)), 'doc_count': len(groups[key])}, **aggregate(sub_aggs, groups[key]))
+        for key in keys
+    ]}
+    if keys:
+        result['after_key'] = dict(zip(names, keys[-1]))
+    return result
+
+class FakeElasticsearch:
+    """内存中的索引数据与查询执行，可被多个HTTP处理线程同时读取"""
+    
+    def __init__(self):
+        self.indices = {}  # 索引名 -> {_id: _source}
+        self.field_indices = {}  # (索引名, 字段) -> {字段值字符串: [_id]}，用于term/terms查询
+        self.pits = {}  # PIT id -> 索引名
+        self.pit_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'searches': 0, 'docs_returned': 0, 'webhook_messages': 0}
+    
+    def put(self, index, doc_id, source):
+        """写入（覆盖）一个文档"""
+        self.indices.setdefault(index, {})[str(doc_id)] = source
+        self.drop_field_indices(index)
+    
+    def delete(self, index, doc_id):
+        """删除一个文档"""
+        self.indices.get(index, {}).pop(str(doc_id), None)
+        self.drop_field_indices(index)
+    
+    def drop_field_indices(self, index):
+        for key in [key for key in self.field_indices if key[0] == index]:
+            del self.field_indices[key]
+    
+    def field_index(self, index, field):
+        """按需建立字段值 -> _id 的倒排表"""
+        key = (index, field)
+        lookup = self.field_indices.get(key)
+        if lookup is None:
+            lookup = {}
+            for doc_id, source in self.indices.get(index, {}).items():
+                lookup.setdefault(str(get_field(source, field)), []).append(doc_id)
+            with self.lock:
+                self.field_indices[key] = lookup
+        return lookup
+    
+    def candidates(self, index, query):
+        """用term/terms条件从倒排表取候选文档，无法利用时返回全部文档"""
+        docs = self.indices.get(index, {})
+        clauses = [query or {}]
+        if query and 'bool' in query:
+            for name in ('filter', 'must'):
+                clause = query['bool'].get(name, [])
+                clauses.extend(clause if isinstance(clause, list) else [clause])
+        for clause in clauses:
+            if 'term' in clause:
+                (field, value), = clause['term'].items()
+                values = [value.get('value') if isinstance(value, dict) else value]
+            elif 'terms' in clause:
+                (field, values), = clause['terms'].items()
+            else:
+                continue
+            lookup = self.field_index(index, field)
+            doc_ids = []
+            for value in dict.fromkeys(str(value) for value in values):
+                doc_ids.extend(lookup.get(value, ()))
+            return [(doc_id, docs[doc_id]) for doc_id in doc_ids if doc_id in docs]
+        return list(docs.items())
+    
+    def count(self, index):
+        return len(self.indices.get(index, {}))
+    
+    def search(self, index, body, params=None):
+        """执行一次搜索请求"""
+        body = body or {}
+        params = params or {}
+        if 'pit' in body:
+            index = self.pits.get(body['pit']['id'])
+            if index is None:
+                raise KeyError('search_context_missing_exception')
+        
+        query = body.get('query')
+        docs = [(doc_id, source) for doc_id, source in self.candidates(index, query) if matches(query, source)]
+        
+        spec = sort_spec(body.get('sort'))
+        for field, descending in reversed(spec):
+            docs.sort(key=lambda item: sort_key(get_field(item[1], field)), reverse=descending)
+        if spec and body.get('search_after'):
+            after = [sort_key(value) for value in body['search_after']]
+            docs = [item for item in docs
+                    if self.after(item[1], spec, after)]
+        
+        start = int(body.get('from', params.get('from', 0)))
+        size = int(body.get('size', params.get('size', 10)))
+        includes = body.get('_source', params.get('_source_includes'))
+        if isinstance(includes, str) and includes not in ('true', 'false'):
+            includes = includes.split(',')
+        
+        hits = []
+        for doc_id, source in docs[start:start + size]:
+            hit = {'_index': index, '_type': '_doc', '_id': doc_id, '_score': None}
+            if includes is not False and includes != 'false':
+                hit['_source'] = filter_source(source, includes)
+            if spec:
+                hit['sort'] = [get_field(source, field) for field, _ in spec]
+            hits.append(hit)
+        
+        with self.lock:
+            self.stats['searches'] += 1
+            self.stats['docs_returned'] += len(hits)
+        
+        response = {
+            'took': 1,
+            'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0},
+            'hits': {'total': {'value': len(docs), 'relation': 'eq'}, 'max_score': None, 'hits': hits}
+        }
+        aggs = body.get('aggs') or body.get('aggregations')
+        if aggs:
+            response['aggregations'] = aggregate(aggs, [source for _, source in docs])
+        if 'pit' in body:
+            response['pit_id'] = body['pit']['id']
+        return response
+    
+    def after(self, source, spec, after):
+        """判断文档的排序值是否在search_after之后"""
+        for (field, descending), bound in zip(spec, after):
+            value = sort_key(get_field(source, field))
+            if value != bound:
+                return value < bound if descending else value > bound
+        return False
+    
+    def mget(self, index, ids, includes=None):
+        """按_id批量获取文档"""
+        docs = []
+        for doc_id in ids:
+            source = self.indices.get(index, {}).get(str(doc_id))
+            if source is None:
+                docs.append({'_index': index, '_type': '_doc', '_id': str(doc_id), 'found': False})
+                continue
+            docs.append({'_index': index, '_type': '_doc', '_id': str(doc_id), '_version': 1,
+                         '_seq_no': 0, '_primary_term': 1, 'found': True,
+                         '_source': filter_source(source, includes)})
+        with self.lock:
+            self.stats['docs_returned'] += len(docs)
+        return {'docs': docs}
+    
+    def open_pit(self, index):
+        pit_id = f"pit-{next(self.pit_ids)}"
+        self.pits[pit_id] = index
+        return {'id': pit_id}
+    
+    def close_pit(self, pit_id):
+        found = self.pits.pop(pit_id, None) is not None
+        return {'succeeded': found, 'num_freed': int(found)}
+    
+    def bulk(self, lines):
+        """执行_bulk请求（index/create/update的doc及doc_as_upsert/delete）"""
+        items = []
+        it = iter(lines)
+        for action_line in it:
+            (action, meta), = action_line.items()
+            index, doc_id = meta.get('_index'), str(meta.get('_id'))
+            if action == 'delete':
+                found = doc_id in self.indices.get(index, {})
+                self.delete(index, doc_id)
+                items.append({action: {'_index': index, '_id': doc_id, 'status': 200 if found else 404,
+                                       'result': 'deleted' if found else 'not_found'}})
+                continue
+            source = next(it)
+            if action == 'update':
+                current = self.indices.get(index, {}).get(doc_id)
+                if current is None and source.get('doc_as_upsert'):
+                    current = {}
+                if current is None:
+                    items.append({action: {'_index': index, '_id': doc_id, 'status': 404,
+                                           'error': {'type': 'document_missing_exception'}}})
+                    continue
+                source = dict(current, **source.get('doc', {}))
+            self.put(index, doc_id, source)
+            items.append({action: {'_index': index, '_id': doc_id, 'status': 200, 'result': 'updated'}})
+        return {'took': 1, 'errors': any(item_result.get('error') for item in items for item_result in item.values()),
+                'items': items}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """把REST请求分发到FakeElasticsearch"""
+    
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，不关闭Nagle算法时每个请求会多等一次延迟确认（约40ms）
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def send_json(self, status, payload, head_only=False):
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(0 if head_only else len(data)))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(data)
+    
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+    
+    def do_HEAD(self):
+        self.send_json(200, {}, head_only=True)
+    
+    def do_GET(self):
+        self.handle_request('GET')
+    
+    def do_POST(self):
+        self.handle_request('POST')
+    
+    def do_PUT(self):
+        self.handle_request('PUT')
+    
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+    
+    def handle_request(self, method):
+        store = self.server.store
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        raw = self.read_body()
+        with store.lock:
+            store.stats['requests'] += 1
+        
+        try:
+            if not parts:
+                self.send_json(200, {'name': 'fake-es', 'cluster_name': 'benchmark',
+                                     'version': {'number': ES_VERSION, 'build_flavor': 'default'},
+                                     'tagline': 'You Know, for Search'})
+                return
+            
+            if parts[:2] == ['cgi-bin', 'webhook']:
+                # 企业微信群机器人接口
+                with store.lock:
+                    store.stats['webhook_messages'] += 1
+                self.send_json(200, {'errcode': 0, 'errmsg': 'ok'})
+                return
+            
+            endpoint = parts[-1]
+            index = parts[0] if len(parts) > 1 else None
+            
+            if endpoint == '_msearch':
+                lines = [json.loads(line) for line in raw.decode('utf-8').splitlines() if line.strip()]
+                responses = []
+                for header, body in zip(lines[::2], lines[1::2]):
+                    try:
+                        responses.append(dict(store.search(header.get('index', index), body), status=200))
+                    except Exception as e:
+                        responses.append({'error': {'type': 'exception', 'reason': str(e)}, 'status': 400})
+                self.send_json(200, {'took': 1, 'responses': responses})
+                return
+            
+            if endpoint == '_bulk':
+                lines = [json.loads(line) for line in raw.decode('utf-8').splitlines() if line.strip()]
+                self.send_json(200, store.bulk(lines))
+                return
+            
+            body = json.loads(raw) if raw else {}
+            if endpoint == '_search':
+                self.send_json(200, store.search(index, body, params))
+            elif endpoint == '_mget':
+                includes = params.get('_source_includes')
+                self.send_json(200, store.mget(index, body.get('ids', []),
+                                               includes.split(',') if includes else None))
+            elif endpoint == '_pit' and method == 'DELETE':
+                self.send_json(200, store.close_pit(body.get('id')))
+            elif endpoint == '_pit':
+                self.send_json(200, store.open_pit(index))
+            elif endpoint == '_refresh':
+                self.send_json(200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+            else:
+                self.send_json(404, {'error': {'type': 'unsupported_endpoint', 'reason': url.path}, 'status': 404})
+        except Exception as e:
+            self.send_json(400, {'error': {'type': 'exception', 'reason': str(e)}, 'status': 400})
+
+class FakeElasticsearchServer:
+    """在后台线程中运行的ES替身HTTP服务"""
+    
+    def __init__(self, store=None, host='127.0.0.1', port=0):
+        self.store = store or FakeElasticsearch()
+        self.httpd = ThreadingHTTPServer((host, port), RequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = self.store
+        self.thread = None
+    
+    @property
+    def host(self):
+        return self.httpd.server_address[0]
+    
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-es", daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 基于SQLite的MySQL替身：提供与pymysql相同的connect/cursor接口，并改写检查程序用到的MySQL语法
+
+import re
+import math
+import zlib
+import random
+import sqlite3
+import hashlib
+from datetime import datetime
+
+# SQLite单条复合查询最多500个子查询，超出时拆分执行
+MAX_COMPOUND_SELECT = 400
+
+DATETIME_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+# 摘要查询中规范化字段值的列（v0、v1…），在MySQL中是DATE_FORMAT/CAST的文本结果，不还原为datetime
+TEXT_COLUMN_PATTERN = re.compile(r'^v\d+$')
+
+# MySQL语法 -> SQLite语法
+REWRITES = (
+    (re.compile(r"DATE_SUB\(NOW\(\), INTERVAL (%s|\d+) MONTH\)"),
+     r"datetime('now', 'localtime', '-' || \1 || ' months')"),
+    (re.compile(r"NOW\(\) - INTERVAL (%s|\d+) SECOND"), r"datetime('now', 'localtime', '-' || \1 || ' seconds')"),
+    (re.compile(r"NOW\(\)"), "datetime('now', 'localtime')"),
+    (re.compile(r"CHAR\((\d+) USING utf8mb4\)"), r"char(\1)"),
+)
+
+def translate(sql):
+    """把MySQL语句改写为SQLite可以执行的语句，占位符%s改为?"""
+    if sql.startswith('(SELECT'):
+        # SQLite不支持带括号的复合查询成员，改为子查询
+        sql = ' UNION ALL '.join(f"SELECT * FROM {part}" for part in sql.split(' UNION ALL '))
+    for pattern, replacement in REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql.replace('%s', '?').replace('%%', '%')
+
+def mysql_concat_ws(separator, *values):
+    """CONCAT_WS：跳过NULL"""
+    return separator.join(str(value) for value in values if value is not None)
+
+def mysql_date_format(value, fmt):
+    """DATE_FORMAT：只支持检查程序使用的 '%Y-%m-%d %H:%i:%s'"""
+    return None if value is None else str(value)[:19]
+
+def register_functions(db):
+    """注册检查程序SQL中用到的MySQL函数"""
+    db.create_function('RAND', 0, random.random)
+    db.create_function('CRC32', 1, lambda value: None if value is None else zlib.crc32(str(value).encode('utf-8')))
+    db.create_function('MD5', 1, lambda value: None if value is None else hashlib.md5(str(value).encode('utf-8')).hexdigest())
+    db.create_function('FLOOR', 1, lambda value: None if value is None else math.floor(value))
+    db.create_function('CONCAT_WS', -1, mysql_concat_ws)
+    db.create_function('DATE_FORMAT', 2, mysql_date_format)
+
+def to_python(value):
+    """把SQLite中以文本保存的时间还原为datetime，与pymysql返回的类型一致"""
+    if type(value) is str and len(value) == 19 and value[10] == ' ' and DATETIME_PATTERN.match(value):
+        return datetime.fromisoformat(value)
+    return value
+
+def to_sqlite(value):
+    """参数中的datetime按MySQL的文本格式传给SQLite"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+class FakeCursor:
+    """与pymysql.cursors.DictCursor行为一致的游标（流式游标同样全部缓存在SQLite游标中）"""
+    
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.position = 0
+        self.description = None
+        self.rowcount = -1
+    
+    def execute(self, sql, params=None):
+        params = tuple(to_sqlite(value) for value in (params or ()))
+        self.connection.stats['queries'] += 1
+        parts = sql.split(' UNION ALL ')
+        if sql.startswith('(SELECT') and len(parts) > MAX_COMPOUND_SELECT:
+            return self.execute_split(parts, params)
+        
+        cursor = self.connection.db.execute(translate(sql), params)
+        self.load(cursor)
+        return self.rowcount
+    
+    def execute_split(self, parts, params):
+        """把超出SQLite上限的UNION ALL拆成多条执行，结果依次拼接"""
+        rows = []
+        offset = 0
+        for start in range(0, len(parts), MAX_COMPOUND_SELECT):
+            group = parts[start:start + MAX_COMPOUND_SELECT]
+            count = sum(part.count('%s') for part in group)
+            cursor = self.connection.db.execute(translate(' UNION ALL '.join(group)), params[offset:offset + count])
+            offset += count
+            self.load(cursor)
+            rows.extend(self.rows)
+        self.rows = rows
+        self.rowcount = len(rows)
+        return self.rowcount
+    
+    def load(self, cursor):
+        self.description = cursor.description
+        if cursor.description is None:
+            self.rows = []
+            self.rowcount = cursor.rowcount
+        else:
+            names = [column[0] for column in cursor.description]
+            if any(TEXT_COLUMN_PATTERN.match(name) for name in names):
+                converters = [(lambda value: value) if TEXT_COLUMN_PATTERN.match(name) else to_python for name in names]
+                self.rows = [{name: convert(value) for name, convert, value in zip(names, converters, row)}
+                             for row in cursor.fetchall()]
+            else:
+                self.rows = [dict(zip(names, map(to_python, row))) for row in cursor.fetchall()]
+            self.rowcount = len(self.rows)
+        self.position = 0
+    
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, params)
+    
+    def fetchone(self):
+        if self.position >= len(self.rows):
+            return None
+        self.position += 1
+        return self.rows[self.position - 1]
+    
+    def fetchmany(self, size=1):
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+    
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+    
+    def __iter__(self):
+        return iter(self.fetchall())
+    
+    def close(self):
+        self.rows = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class FakeConnection:
+    """与pymysql连接接口一致的SQLite连接"""
+    
+    def __init__(self, path, stats):
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA case_sensitive_like=ON")
+        register_functions(self.db)
+        self.stats = stats
+        self.open = True
+    
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+    
+    def ping(self, reconnect=True):
+        if not self.open:
+            raise sqlite3.ProgrammingError("连接已关闭")
+    
+    def commit(self):
+        pass
+    
+    def rollback(self):
+        pass
+    
+    def close(self):
+        if self.open:
+            self.open = False
+            self.db.close()
+
+class FakeMySQL:
+    """SQLite数据库文件与连接工厂，connect可直接替换pymysql.connect"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.stats = {'connections': 0, 'queries': 0}
+    
+    def connect(self, **kwargs):
+        """忽略连接参数，打开同一个SQLite数据库文件"""
+        self.stats['connections'] += 1
+        return FakeConnection(self.path, self.stats)
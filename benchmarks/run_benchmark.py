@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""离线性能基准
+
+不需要网络和真实数据库：MySQL由SQLite替身代替（替换pymysql.connect），ElasticSearch由进程内的HTTP替身代替，
+企业微信webhook也指向该替身。先按表映射生成合成工单（可配置子表行数、字段长度和差异比例），
+再对每个场景（抽样策略 × 批大小 × 并发线程数 × 比较模式）执行若干次check_consistency，
+输出每秒检查工单数、各阶段每次调用耗时的p50/p99、峰值RSS，以及检出的差异工单数是否与注入的一致。
+另外单独测量逐单compare_data与按批compare_batch的比较吞吐。
+
+每个场景在fork出的子进程中执行（不支持fork的平台在当前进程执行），峰值RSS互不影响。
+
+用法示例：
+    python benchmarks/run_benchmark.py --orders 20000 --sample-size 2000 --workers 1,4 --strategies pk_seek,block
+    python benchmarks/run_benchmark.py --compare-modes full,digest --json bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import functools
+import itertools
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+from loguru import logger
+import db_connect
+import metrics
+from config import Settings, MySQLSettings, ElasticsearchSettings, WechatSettings, CheckSettings, MetricsSettings
+from data_checker import DataChecker
+from fake_es import FakeElasticsearchServer
+from fake_mysql import FakeMySQL
+from datagen import DataGenerator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    """当前进程的峰值RSS（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def percentile(values, pct):
+    """最近秩法百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class StageTimer:
+    """记录各阶段每次调用的耗时"""
+    
+    def __init__(self):
+        self.samples = {}
+    
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        return timed
+    
+    def summary(self):
+        return {
+            stage: {
+                'calls': len(values),
+                'total_ms': sum(values) * 1000,
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+            }
+            for stage, values in self.samples.items()
+        }
+
+def build_settings(args, es_port, scenario):
+    """生成场景使用的配置（不读取配置文件）"""
+    return Settings(
+        mysql=MySQLSettings(pool_size=max(2, scenario['max_workers'] + 1)),
+        elasticsearch=ElasticsearchSettings(host='127.0.0.1', port=es_port, index_name=args.index_name,
+                                            maxsize=max(2, scenario['max_workers'] + 1)),
+        wechat=WechatSettings(to_group_key='benchmark', rate_per_minute=1000000, max_retries=0),
+        check=CheckSettings(
+            sample_size=args.sample_size,
+            batch_size=scenario['batch_size'],
+            max_workers=scenario['max_workers'],
+            compare_mode=scenario['compare_mode'],
+            sample_strategy=scenario['strategy'],
+            sample_seed=str(args.seed),
+            sample_window_months=args.window_months,
+            # 分层抽样的历史统计、复查队列和差异历史库写入临时目录，不影响state目录；各场景从同一份统计开始
+            stratified_state_file=os.path.join(args.work_dir, f"stratified-{os.getpid()}.json"),
+            recheck_state_file=os.path.join(args.work_dir, f"recheck-{os.getpid()}.json"),
+            history_file=os.path.join(args.work_dir, f"history-{os.getpid()}.db"),
+        ),
+        metrics=MetricsSettings()
+    )
+
+def create_checker(settings, es_port):
+    """创建检查器，企业微信webhook指向本地替身"""
+    checker = DataChecker(settings)
+    checker.wechat.to_url = f"http://127.0.0.1:{es_port}/cgi-bin/webhook/send?key=benchmark"
+    return checker
+
+def instrument(checker, timer, detected):
+    """包装检查器的各阶段方法以记录耗时，并收集检出的不一致工单"""
+    checker.sampler.sample = timer.wrap('sample', checker.sampler.sample)
+    checker.get_mysql_data_batch = timer.wrap('mysql_fetch', checker.get_mysql_data_batch)
+    checker.get_es_data_batch = timer.wrap('es_fetch', checker.get_es_data_batch)
+    checker.get_mysql_digests = timer.wrap('mysql_digest', checker.get_mysql_digests)
+    checker.get_es_digests = timer.wrap('es_digest', checker.get_es_digests)
+    checker.wechat.send_digest = timer.wrap('alert', checker.wechat.send_digest)
+    
+    compare_batch = timer.wrap('compare', checker.compare_batch)
+    def compare_and_record(order_ids, mysql_batch, es_batch):
+        results = compare_batch(order_ids, mysql_batch, es_batch)
+        detected.update(order_id for order_id, (ok, _) in results.items() if not ok)
+        return results
+    checker.compare_batch = compare_and_record
+
+def measure_compare(checker, order_ids):
+    """预先取好数据后，分别测量逐单compare_data与按批compare_batch的耗时"""
+    mysql_batch = checker.get_mysql_data_batch(order_ids)
+    es_batch = checker.get_es_data_batch(order_ids)
+    per_order = []
+    for order_id in order_ids:
+        start = time.perf_counter()
+        checker.compare_data(mysql_batch.get(order_id), es_batch.get(order_id), order_id)
+        per_order.append(time.perf_counter() - start)
+    
+    checker.custconfig_cache.begin_run()
+    per_batch = []
+    for start_index in range(0, len(order_ids), checker.batch_size):
+        chunk = order_ids[start_index:start_index + checker.batch_size]
+        start = time.perf_counter()
+        checker.compare_batch(chunk, mysql_batch, es_batch)
+        per_batch.append(time.perf_counter() - start)
+    
+    return {
+        'compare_data_orders_per_sec': len(order_ids) / sum(per_order) if sum(per_order) else None,
+        'compare_data_p50_ms': percentile(per_order, 50) * 1000,
+        'compare_data_p99_ms': percentile(per_order, 99) * 1000,
+        'compare_batch_orders_per_sec': len(order_ids) / sum(per_batch) if sum(per_batch) else None,
+    }
+
+def run_scenario(args, es_port, fake_mysql, drifted, scenario):
+    """执行一个场景，返回结果字典"""
+    db_connect.pymysql.connect = fake_mysql.connect
+    checker = create_checker(build_settings(args, es_port, scenario), es_port)
+    timer = StageTimer()
+    detected = set()
+    checked = set()
+    instrument(checker, timer, detected)
+    
+    get_random_orders = checker.get_random_orders
+    def record_sample():
+        order_ids = get_random_orders()
+        checked.update(order_ids)
+        return order_ids
+    checker.get_random_orders = record_sample
+    
+    run_times = []
+    try:
+        for _ in range(args.warmup):
+            checker.check_consistency()
+        timer.samples.clear()
+        detected.clear()
+        checked.clear()
+        queries_before = dict(metrics.QUERIES.values)
+        bytes_before = dict(metrics.FETCHED_BYTES.values)
+        
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            checker.check_consistency()
+            run_times.append(time.perf_counter() - start)
+        
+        queries = {key[0]: value - queries_before.get(key, 0) for key, value in metrics.QUERIES.values.items()}
+        fetched_bytes = {key[0]: value - bytes_before.get(key, 0) for key, value in metrics.FETCHED_BYTES.values.items()}
+        compare = measure_compare(checker, sorted(checked)[:args.sample_size])
+    finally:
+        checker.close()
+    
+    expected = {order_id for order_id in checked if order_id in drifted}
+    total_orders = args.sample_size * args.repeat
+    return {
+        'scenario': scenario,
+        'orders_per_sec': total_orders / sum(run_times) if sum(run_times) else None,
+        'run_p50_ms': percentile(run_times, 50) * 1000,
+        'stages': timer.summary(),
+        'compare': compare,
+        'queries': queries,
+        'fetched_bytes': fetched_bytes,
+        'peak_rss_mb': peak_rss_mb(),
+        'checked': len(checked),
+        'expected_inconsistent': len(expected),
+        'detected_inconsistent': len(detected & checked),
+        'missed': len(expected - detected),
+        'false_positives': len(detected - expected),
+    }
+
+def run_isolated(args, es_port, fake_mysql, drifted, scenario):
+    """在fork出的子进程中执行场景，使各场景的峰值RSS互不影响"""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return run_scenario(args, es_port, fake_mysql, drifted, scenario)
+    
+    context = multiprocessing.get_context('fork')
+    parent_end, child_end = context.Pipe(duplex=False)
+    
+    def target():
+        try:
+            child_end.send(run_scenario(args, es_port, fake_mysql, drifted, scenario))
+        except Exception as e:
+            child_end.send({'scenario': scenario, 'error': repr(e)})
+    
+    process = context.Process(target=target)
+    process.start()
+    result = parent_end.recv()
+    process.join()
+    return result
+
+def format_ms(value):
+    return '-' if value is None else f"{value:.1f}"
+
+def print_report(results, stages):
+    """按场景输出结果表"""
+    header = ['strategy', 'batch', 'workers', 'mode', 'orders/s', 'cmp_data/s', 'cmp_batch/s']
+    header += [f"{stage} p50/p99ms" for stage in stages]
+    header += ['rss MB', 'detected/expected']
+    rows = []
+    errors = []
+    for result in results:
+        scenario = result['scenario']
+        row = [scenario['strategy'], str(scenario['batch_size']), str(scenario['max_workers']),
+               scenario['compare_mode']]
+        if 'error' in result:
+            errors.append(f"{' '.join(row)}: {result['error']}")
+            continue
+        row += [f"{result['orders_per_sec']:.0f}",
+                f"{result['compare']['compare_data_orders_per_sec']:.0f}",
+                f"{result['compare']['compare_batch_orders_per_sec']:.0f}"]
+        for stage in stages:
+            timing = result['stages'].get(stage)
+            row.append(f"{format_ms(timing['p50_ms'])}/{format_ms(timing['p99_ms'])}" if timing else '-')
+        row.append(format_ms(result['peak_rss_mb']))
+        row.append(f"{result['detected_inconsistent']}/{result['expected_inconsistent']}"
+                   + ('' if not result['missed'] and not result['false_positives'] else
+                      f" (漏检 {result['missed']}, 误报 {result['false_positives']})"))
+        rows.append(row)
+    
+    widths = [max(len(str(row[i])) for row in [header] + rows if i < len(row)) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+    for error in errors:
+        print(f"场景执行失败 {error}")
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='MySQL与ES数据一致性检查的离线性能基准')
+    parser.add_argument('--orders', type=int, default=20000, help='生成的工单数')
+    parser.add_argument('--fanout', type=int, default=2, help='每个工单在每张子表中的行数')
+    parser.add_argument('--field-size', type=int, default=16, help='字符串字段的长度')
+    parser.add_argument('--drift-rate', type=float, default=0.01, help='注入差异的工单比例')
+    parser.add_argument('--customers', type=int, default=200, help='客户数')
+    parser.add_argument('--sample-size', type=int, default=2000, help='每次检查抽样的工单数')
+    parser.add_argument('--window-months', type=int, default=3, help='抽样时间窗口（月）')
+    parser.add_argument('--strategies', default='pk_seek', help='抽样策略，逗号分隔')
+    parser.add_argument('--batch-sizes', default='500', help='批大小，逗号分隔')
+    parser.add_argument('--workers', default='1,4', help='并发线程数，逗号分隔')
+    parser.add_argument('--compare-modes', default='full', help='比较模式，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景计时的检查次数')
+    parser.add_argument('--warmup', type=int, default=1, help='每个场景预热的检查次数')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--index-name', default='workorder', help='主索引名')
+    parser.add_argument('--json', help='把结果另存为JSON文件，便于对比回归')
+    parser.add_argument('--log-level', default='ERROR', help='检查程序的日志级别')
+    args = parser.parse_args()
+    
+    # 基准只输出到控制台，不写入logs目录
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    
+    work_dir = tempfile.mkdtemp(prefix='esdatacheck-bench-')
+    args.work_dir = work_dir
+    server = FakeElasticsearchServer().start()
+    try:
+        settings = build_settings(args, server.port, {
+            'strategy': 'pk_seek', 'batch_size': 500, 'max_workers': 1, 'compare_mode': 'full'
+        })
+        # 生成数据只需要表映射，不建立连接
+        db_connect.pymysql.connect = FakeMySQL(':memory:').connect
+        mapping_checker = DataChecker(settings)
+        
+        start = time.perf_counter()
+        generator = DataGenerator(mapping_checker, orders=args.orders, fanout=args.fanout,
+                                  field_size=args.field_size, drift_rate=args.drift_rate,
+                                  customers=args.customers, seed=args.seed)
+        db_path = os.path.join(work_dir, 'mysql.db')
+        drifted = generator.generate(db_path, server.store)
+        print(f"生成 {args.orders} 条工单（子表行数 {args.fanout}，字段长度 {args.field_size}），"
+              f"注入差异 {len(drifted)} 条，耗时 {time.perf_counter() - start:.1f}s，"
+              f"基线RSS {format_ms(peak_rss_mb())} MB")
+        
+        fake_mysql = FakeMySQL(db_path)
+        scenarios = [
+            {'strategy': strategy, 'batch_size': batch_size, 'max_workers': workers, 'compare_mode': mode}
+            for strategy, batch_size, workers, mode in itertools.product(
+                parse_list(args.strategies), parse_list(args.batch_sizes, int),
+                parse_list(args.workers, int), parse_list(args.compare_modes))
+        ]
+        
+        results = []
+        for scenario in scenarios:
+            print(f"执行场景 {scenario} ...", flush=True)
+            results.append(run_isolated(args, server.port, fake_mysql, drifted, scenario))
+        
+        stages = ['sample', 'mysql_fetch', 'es_fetch', 'mysql_digest', 'es_digest', 'compare', 'alert']
+        stages = [stage for stage in stages if any(stage in result.get('stages', {}) for result in results)]
+        print()
+        print_report(results, stages)
+        
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已保存到 {args.json}")
+        
+        failed = any('error' in result or result['missed'] or result['false_positives'] for result in results)
+        return 1 if failed else 0
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 聚合对账模块：按 创建日期 × WorkStatus × AppCode 分组比较两侧工单数，定位缺失或多出的工单
+
+from datetime import datetime, timedelta
+from loguru import logger
+from full_reconcile import id_key
+import metrics
+
+# 分组维度：MySQL字段 -> ES字段
+GROUP_FIELDS = (("WorkStatus", "WorkStatus"), ("AppCode", "AppCode"))
+
+def bucket_value(value):
+    """把两侧的分组值统一为字符串，NULL记为空字符串"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+class AggregateReconciler:
+    """聚合对账
+    
+    MySQL侧对主表 GROUP BY DATE(CreatedAt), WorkStatus, AppCode 计数，ES侧对主索引做同样维度的
+    composite聚合（date_histogram + terms），两次聚合查询即可覆盖整个时间窗口内的全部工单。
+    计数不同的分组再分别读取两侧的工单Id求差集，得到缺失、多出或分组字段不一致的工单，
+    交给逐字段比较确认；随机抽样很难发现的缺失文档在这里直接按分组暴露。
+    """
+    
+    def __init__(self, checker, window_days=7, max_orders=200):
+        """初始化聚合对账
+        
+        Args:
+            checker: DataChecker实例，复用其连接与表映射
+            window_days: 比较最近多少天创建的工单（含今天）
+            max_orders: 从不一致分组中最多定位的工单数
+        """
+        self.checker = checker
+        self.db_connector = checker.db_connector
+        self.main_table = checker.get_main_table()
+        self.window_days = max(1, window_days)
+        self.max_orders = max(0, max_orders)
+        self.page_size = 1000  # composite聚合每页的分组数
+    
+    def window_start(self):
+        """时间窗口的起始日期，格式 YYYY-MM-DD"""
+        return (datetime.now() - timedelta(days=self.window_days - 1)).strftime('%Y-%m-%d')
+    
+    def mysql_buckets(self, since):
+        """MySQL侧各分组的工单数，返回 {(日期, WorkStatus, AppCode): (工单数, 分组原始值)}"""
+        columns = [mysql_field for mysql_field, _ in GROUP_FIELDS]
+        sql = (f"SELECT DATE(CreatedAt) AS day, {', '.join(columns)}, COUNT(*) AS cnt "
+               f"FROM {self.main_table} WHERE CreatedAt >= %s "
+               f"GROUP BY DATE(CreatedAt), {', '.join(columns)}")
+        buckets = {}
+        with self.db_connector.mysql_cursor() as cursor:
+            cursor.execute(sql, (since,))
+            for row in cursor.fetchall():
+                values = tuple(row[column] for column in columns)
+                key = (str(row['day'])[:10],) + tuple(bucket_value(value) for value in values)
+                buckets[key] = (row['cnt'], values)
+        return buckets
+    
+    def es_buckets(self, since):
+        """ES侧各分组的文档数，composite聚合按after_key翻页，返回格式同mysql_buckets"""
+        es_client = self.db_connector.get_es_client()
+        sources = [{"day": {"date_histogram": {"field": "CreatedAt", "calendar_interval": "1d",
+                                               "format": "yyyy-MM-dd"}}}]
+        sources.extend({es_field: {"terms": {"field": es_field, "missing_bucket": True}}}
+                       for _, es_field in GROUP_FIELDS)
+        composite = {"size": self.page_size, "sources": sources}
+        body = {
+            "size": 0,
+            "query": {"range": {"CreatedAt": {"gte": since, "format": "yyyy-MM-dd"}}},
+            "aggs": {"groups": {"composite": composite}}
+        }
+        
+        buckets = {}
+        while True:
+            response = es_client.search(index=self.checker.main_index_name, body=body)
+            result = response.get('aggregations', {}).get('groups', {})
+            for bucket in result.get('buckets', []):
+                values = tuple(bucket['key'].get(es_field) for _, es_field in GROUP_FIELDS)
+                key = (str(bucket['key']['day'])[:10],) + tuple(bucket_value(value) for value in values)
+                buckets[key] = (bucket['doc_count'], values)
+            if not result.get('after_key') or len(result.get('buckets', [])) < self.page_size:
+                break
+            composite['after'] = result['after_key']
+        return buckets
+    
+    def mysql_bucket_ids(self, day, values):
+        """读取MySQL侧一个分组内的工单Id"""
+        conditions = ["CreatedAt >= %s", "CreatedAt < %s"]
+        next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        params = [day, next_day]
+        for (mysql_field, _), value in zip(GROUP_FIELDS, values):
+            if value is None:
+                conditions.append(f"{mysql_field} IS NULL")
+            else:
+                conditions.append(f"{mysql_field} = %s")
+                params.append(value)
+        with self.db_connector.mysql_cursor() as cursor:
+            cursor.execute(f"SELECT Id FROM {self.main_table} WHERE {' AND '.join(conditions)}", tuple(params))
+            return {id_key(row['Id']) for row in cursor.fetchall()}
+    
+    def es_bucket_ids(self, day, values):
+        """读取ES侧一个分组内的工单Id，按Id排序用search_after翻页"""
+        next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        filters = [{"range": {"CreatedAt": {"gte": day, "lt": next_day, "format": "yyyy-MM-dd"}}}]
+        must_not = []
+        for (_, es_field), value in zip(GROUP_FIELDS, values):
+            if value is None:
+                must_not.append({"exists": {"field": es_field}})
+            else:
+                filters.append({"term": {es_field: value}})
+        body = {
+            "size": self.page_size,
+            "query": {"bool": {"filter": filters, "must_not": must_not}},
+            "sort": [{"Id": "asc"}],
+            "_source": ["Id"]
+        }
+        
+        es_client = self.db_connector.get_es_client()
+        ids = set()
+        while True:
+            hits = es_client.search(index=self.checker.main_index_name, body=body).get('hits', {}).get('hits', [])
+            for hit in hits:
+                ids.add(id_key(hit['_source'].get('Id', hit['_id'])))
+            if len(hits) < self.page_size:
+                break
+            body['search_after'] = hits[-1]['sort']
+        return ids
+    
+    def locate(self, differing, mysql_buckets, es_buckets):
+        """在计数不同的分组中读取两侧Id求差集，差异最大的分组优先，最多定位max_orders条"""
+        located = {}
+        for key in differing:
+            if len(located) >= self.max_orders:
+                logger.info(f"已定位 {len(located)} 条工单，达到上限，其余不一致分组不再展开")
+                break
+            day = key[0]
+            mysql_ids = self.mysql_bucket_ids(day, mysql_buckets[key][1]) if key in mysql_buckets else set()
+            es_ids = self.es_bucket_ids(day, es_buckets[key][1]) if key in es_buckets else set()
+            for order_id in sorted(mysql_ids ^ es_ids):
+                if len(located) >= self.max_orders:
+                    break
+                located.setdefault(order_id, None)
+        return list(located)
+    
+    @metrics.timed('aggregate')
+    def run(self):
+        """执行聚合对账
+        
+        Returns:
+            tuple: (计数不同的分组列表 [(分组键, MySQL数, ES数)], 定位到的工单Id列表)，出错时返回 (None, [])
+        """
+        since = self.window_start()
+        try:
+            mysql_buckets = self.mysql_buckets(since)
+            es_buckets = self.es_buckets(since)
+        except Exception as e:
+            logger.error(f"聚合对账查询失败: {str(e)}")
+            return None, []
+        
+        differing = []
+        for key in set(mysql_buckets) | set(es_buckets):
+            mysql_count = mysql_buckets.get(key, (0, None))[0]
+            es_count = es_buckets.get(key, (0, None))[0]
+            if mysql_count != es_count:
+                differing.append((key, mysql_count, es_count))
+        differing.sort(key=lambda item: (-abs(item[1] - item[2]), item[0]))
+        metrics.AGGREGATE_DIFFERING_BUCKETS.set(len(differing))
+        
+        mysql_total = sum(count for count, _ in mysql_buckets.values())
+        es_total = sum(count for count, _ in es_buckets.values())
+        logger.info(f"聚合对账完成（{since} 起）：MySQL {mysql_total} 条/{len(mysql_buckets)} 组，"
+                    f"ES {es_total} 条/{len(es_buckets)} 组，计数不同的分组 {len(differing)} 个")
+        for key, mysql_count, es_count in differing[:20]:
+            logger.warning(f"分组 {' / '.join(key)} 工单数不一致：MySQL {mysql_count} vs ES {es_count}")
+        
+        try:
+            order_ids = self.locate([key for key, _, _ in differing], mysql_buckets, es_buckets)
+        except Exception as e:
+            logger.error(f"定位不一致分组中的工单失败: {str(e)}")
+            order_ids = []
+        if differing:
+            logger.info(f"从不一致分组中定位到 {len(order_ids)} 条工单，将优先逐字段比较")
+        return differing, order_ids
+    
+    def format_message(self, differing, limit=20):
+        """格式化不一致分组，用于企业微信通知"""
+        message = f"时间窗口: 最近 {self.window_days} 天，{len(differing)} 个分组工单数不一致\n\n"
+        for key, mysql_count, es_count in differing[:limit]:
+            message += f"{' / '.join(key)}：MySQL {mysql_count} vs ES {es_count}\n"
+        if len(differing) > limit:
+            message += f"还有 {len(differing) - limit} 个分组未显示...\n"
+        return message
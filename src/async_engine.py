@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 异步检查引擎：用aiomysql连接池和AsyncElasticsearch同时检查全部抽样工单，单个慢工单不再阻塞整轮检查
+
+import asyncio
+from loguru import logger
+from data_checker import chunked
+from paged_compare import mark_paged, paged_tables
+import metrics
+
+try:
+    import aiomysql
+    from elasticsearch import AsyncElasticsearch, AIOHttpConnection
+except ImportError:  # 未安装aiomysql/aiohttp时只能使用同步检查
+    aiomysql = None
+    AsyncElasticsearch = None
+    AIOHttpConnection = object
+
+class MeteredAsyncConnection(AIOHttpConnection):
+    """异步ES连接：与MeteredConnection一样统计请求次数、失败次数和响应体字节数"""
+    
+    async def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+        if method == 'HEAD':
+            return await super().perform_request(method, url, params, body, timeout, ignore, headers)
+        metrics.QUERIES.inc(backend='es')
+        try:
+            status, response_headers, data = await super().perform_request(
+                method, url, params, body, timeout, ignore, headers
+            )
+        except Exception:
+            metrics.QUERY_ERRORS.inc(backend='es')
+            raise
+        metrics.FETCHED_BYTES.inc(len(data.encode('utf-8')) if isinstance(data, str) else len(data or b''),
+                                  backend='es')
+        return status, response_headers, data
+
+class AsyncCheckEngine:
+    """异步抽样检查
+    
+    每个抽样工单是一个协程，在信号量限制的并发数内同时获取MySQL和ES数据（MySQL使用aiomysql连接池，
+    ES使用AsyncElasticsearch），获取完的工单由一个比较协程按批按列比较。表映射、投影、按列比较、
+    复查、修复、差异历史和告警都复用DataChecker；客户特殊配置在一轮检查内按客户只加载一次。
+    工单比较完才释放并发名额，之后只保留差异（修复模式下保留两侧数据），内存占用与并发数而不是抽样数成正比。
+    
+    两侧都不按工单逐条查询：在途工单按数据来源排队，每批最多并发数的1/4（不超过batch_size）个工单，
+    MySQL用DataChecker.mysql_chunk_queries生成与同步检查相同的逐表IN查询，ES每批一次_msearch。
+    没有批次在执行时排队的工单立即获取；已有批次在执行时，排队的工单凑满一批才再开一批，
+    同时执行的批次数不超过连接池大小。多个小批次先后完成，比较与获取交替进行，不会整轮同步等待。
+    
+    连接池和ES客户端绑定事件循环，每轮检查新建、结束时关闭。摘要比较模式不适用，始终逐字段比较。
+    """
+    
+    def __init__(self, checker, concurrency=200, mysql_pool_size=20):
+        """初始化异步检查引擎
+        
+        Args:
+            checker: DataChecker实例，复用其表映射、比较逻辑和结果汇总
+            concurrency: 同时在途的工单数
+            mysql_pool_size: aiomysql连接池的最大连接数
+        """
+        if aiomysql is None or AsyncElasticsearch is None:
+            raise RuntimeError("异步检查需要安装aiomysql和aiohttp")
+        self.checker = checker
+        self.concurrency = max(1, concurrency)
+        self.mysql_pool_size = max(1, mysql_pool_size)
+        self.mysql_pool = None
+        self.es_client = None
+        # 本轮检查中按 (数据来源, 客户ID) 加载客户特殊配置的任务（结果为 客户ID -> 配置行），同一客户的工单共享一次加载
+        self.custconfig_loads = {}
+        # 按数据来源等待获取数据的 (工单ID, future)，由batch_orders合并成批
+        self.pending = {}
+        self.pending_events = {}
+        # 按数据来源正在执行的批次任务，数量不超过连接池大小
+        self.batch_tasks = {}
+        # 已获取完数据、等待比较的 (工单ID, MySQL数据, ES数据, 比较完成的future)
+        self.ready = []
+        self.ready_event = None
+        # 已占用并发名额、仍在获取数据的工单数
+        self.fetching = 0
+    
+    async def create_mysql_pool(self):
+        """新建aiomysql连接池，连接参数与同步连接相同"""
+        mysql = self.checker.settings.mysql
+        return await aiomysql.create_pool(
+            host=mysql.host,
+            port=mysql.port,
+            user=mysql.user,
+            password=mysql.password,
+            db=mysql.database,
+            charset=mysql.charset,
+            autocommit=True,
+            minsize=1,
+            maxsize=self.mysql_pool_size
+        )
+    
+    def create_es_client(self):
+        """新建AsyncElasticsearch客户端，连接参数与同步客户端相同"""
+        es_config = dict(self.checker.db_connector.es_config, connection_class=MeteredAsyncConnection)
+        return AsyncElasticsearch(**es_config)
+    
+    async def open(self):
+        """建立本轮检查使用的连接池和ES客户端"""
+        self.mysql_pool = await self.create_mysql_pool()
+        self.es_client = self.create_es_client()
+        self.custconfig_loads = {}
+        self.pending = {'mysql': [], 'es': []}
+        self.pending_events = {'mysql': asyncio.Event(), 'es': asyncio.Event()}
+        self.batch_tasks = {'mysql': set(), 'es': set()}
+        self.ready = []
+        self.ready_event = asyncio.Event()
+        self.fetching = 0
+    
+    async def close(self):
+        """关闭连接池和ES客户端"""
+        if self.mysql_pool is not None:
+            self.mysql_pool.close()
+            await self.mysql_pool.wait_closed()
+            self.mysql_pool = None
+        if self.es_client is not None:
+            await self.es_client.close()
+            self.es_client = None
+        self.custconfig_loads = {}
+    
+    async def query(self, cursor, sql, args):
+        """执行查询并返回全部行，统计查询次数和数据量"""
+        metrics.QUERIES.inc(backend='mysql')
+        try:
+            await cursor.execute(sql, args)
+            rows = await cursor.fetchall()
+        except Exception:
+            metrics.QUERY_ERRORS.inc(backend='mysql')
+            raise
+        metrics.FETCHED_BYTES.inc(metrics.estimate_bytes(rows), backend='mysql')
+        return list(rows)
+    
+    async def run_queries(self, cursor, queries):
+        """执行DataChecker查询生成器产出的语句，把结果行交回生成器，返回生成器的返回值"""
+        try:
+            sql, args = next(queries)
+            while True:
+                sql, args = queries.send(await self.query(cursor, sql, args))
+        except StopIteration as stop:
+            return stop.value
+    
+    def fetch(self, side, order_id):
+        """把工单加入side（'mysql'或'es'）的获取队列，返回该工单数据的future
+        
+        数据结构与批量获取相同，未找到或出错时为None。
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending[side].append((order_id, future))
+        self.pending_events[side].set()
+        return future
+    
+    async def batch_orders(self, side, fetch_batch, max_batches):
+        """把排队的工单合并成批获取，批次完成或有新工单排队时重新判断是否开始新批次
+        
+        Args:
+            side: 数据来源，'mysql'或'es'
+            fetch_batch: 获取一批 [(工单ID, future)] 并设置各future结果的协程函数
+            max_batches: 同时执行的最大批次数
+        """
+        batch_size = min(self.checker.batch_size, max(1, self.concurrency // 4))
+        pending, event, tasks = self.pending[side], self.pending_events[side], self.batch_tasks[side]
+        while True:
+            await event.wait()
+            event.clear()
+            while pending and len(tasks) < max_batches and (not tasks or len(pending) >= batch_size):
+                batch = pending[:batch_size]
+                del pending[:len(batch)]
+                task = asyncio.ensure_future(fetch_batch(batch))
+                tasks.add(task)
+                task.add_done_callback(lambda done: self.batch_done(side, done))
+    
+    def batch_done(self, side, task):
+        """批次完成：让batch_orders重新判断排队的工单"""
+        self.batch_tasks[side].discard(task)
+        self.pending_events[side].set()
+    
+    def finish_batch(self, side, batch, results):
+        """设置一批工单的future结果，未取得数据的工单为None"""
+        source = 'MySQL' if side == 'mysql' else 'ElasticSearch主索引'
+        for order_id, future in batch:
+            if order_id not in results:
+                logger.warning(f"{source}中未找到工单 {order_id} 的数据")
+            future.set_result(results.get(order_id))
+    
+    async def fetch_mysql_batch(self, batch):
+        """批量获取一批工单的MySQL数据，设置到各工单的future"""
+        checker = self.checker
+        order_ids = [order_id for order_id, _ in batch]
+        results = {}
+        try:
+            with metrics.STAGE_SECONDS.time(stage='mysql_fetch'):
+                async with self.mysql_pool.acquire() as conn:
+                    async with conn.cursor(aiomysql.DictCursor) as cursor:
+                        results = await self.run_queries(
+                            cursor, checker.mysql_chunk_queries(checker.get_main_table(), order_ids)
+                        )
+                
+                # 客户特殊配置在归还连接后加载，避免持有连接等待其他批次的加载任务
+                customer_ids = {order_data['main'].get('CustomerId') for order_data in results.values()
+                                if order_data['main'].get('CustomerId')}
+                configs = await self.customer_configs('mysql', customer_ids)
+                for order_data in results.values():
+                    customer_id = order_data['main'].get('CustomerId')
+                    if not customer_id:
+                        continue
+                    if configs[customer_id] is None:
+                        mark_paged(order_data, 'basic_custspecialconfig')
+                    else:
+                        order_data['special']['basic_custspecialconfig'] = list(configs[customer_id])
+        except Exception as e:
+            logger.error(f"批量获取MySQL工单数据时发生错误（{len(batch)} 条）: {str(e)}")
+            results = {}
+        self.finish_batch('mysql', batch, results)
+    
+    async def load_mysql_custconfig(self, customer_ids):
+        """加载一批客户在MySQL中的特殊配置，返回 客户ID -> 配置行，行数超过分页大小的客户为None"""
+        async with self.mysql_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                stored = await self.run_queries(cursor, self.checker.mysql_custconfig_queries(customer_ids))
+        return {customer_id: rows for customer_id, (rows, _) in stored.items()}
+    
+    async def customer_configs(self, side, customer_ids):
+        """返回 客户ID -> 配置行（超过分页大小时为None）
+        
+        本轮检查内同一客户只加载一次，尚未加载的客户合并为一次加载。
+        """
+        new_ids = [customer_id for customer_id in customer_ids if (side, customer_id) not in self.custconfig_loads]
+        if new_ids:
+            loader = self.load_mysql_custconfig if side == 'mysql' else self.load_es_custconfig
+            task = asyncio.ensure_future(loader(new_ids))
+            for customer_id in new_ids:
+                self.custconfig_loads[(side, customer_id)] = task
+        return {customer_id: (await self.custconfig_loads[(side, customer_id)])[customer_id]
+                for customer_id in customer_ids}
+    
+    def related_search(self, es_index, key_field, key):
+        """按键字段查询特殊表索引第一页的查询体，总数超过一页的集合比较时分页归并"""
+        body = {
+            "query": {"term": {key_field: key}},
+            "size": self.checker.related_page_size,
+            "sort": [{"Id": "asc"}],
+            "track_total_hits": True
+        }
+        if es_index in self.checker.special_source_fields:
+            body['_source'] = self.checker.special_source_fields[es_index]
+        return body
+    
+    def related_docs(self, response):
+        """取查询响应中的文档，总数超过一页时返回None"""
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        hits = response.get('hits', {}).get('hits', [])
+        total = response.get('hits', {}).get('total', 0)
+        if isinstance(total, dict):
+            total = total.get('value', 0)
+        if total > len(hits):
+            return None
+        return [hit['_source'] for hit in hits]
+    
+    async def load_es_custconfig(self, customer_ids):
+        """加载一批客户在ES中的特殊配置，返回 客户ID -> 文档列表，文档数超过分页大小的客户为None"""
+        es_index = self.checker.custspecialconfig_index_name
+        searches = []
+        for customer_id in customer_ids:
+            searches.append({"index": es_index})
+            searches.append(self.related_search(es_index, 'CustomerId', customer_id))
+        responses = (await self.es_client.msearch(body=searches)).get('responses', [])
+        return {customer_id: self.related_docs(response) for customer_id, response in zip(customer_ids, responses)}
+    
+    async def fetch_es_batch(self, batch):
+        """批量获取一批工单的ES数据，设置到各工单的future
+        
+        主索引文档（按Id的terms查询）和各工单的operating日志合并为一次_msearch（字段列表放在请求体中，
+        不逐个请求编码进URL）。
+        """
+        checker = self.checker
+        order_ids = [order_id for order_id, _ in batch]
+        searches = [
+            {"index": checker.main_index_name},
+            {"query": {"terms": {"Id": order_ids}}, "size": len(order_ids), "_source": checker.main_source_includes},
+        ]
+        for order_id in order_ids:
+            searches.append({"index": checker.operating_index_name})
+            searches.append(self.related_search(checker.operating_index_name, 'WorkOrderId', order_id))
+        
+        results = {}
+        try:
+            with metrics.STAGE_SECONDS.time(stage='es_fetch'):
+                responses = (await self.es_client.msearch(body=searches)).get('responses', [])
+                main = responses[0]
+                if 'error' in main:
+                    raise RuntimeError(main['error'])
+                # ES中的Id可能是数字或字符串，统一按字符串对应回订单ID
+                id_lookup = {str(order_id): order_id for order_id in order_ids}
+                for hit in main.get('hits', {}).get('hits', []):
+                    order_id = id_lookup.get(str(hit['_source'].get('Id')))
+                    if order_id is not None and order_id not in results:
+                        results[order_id] = hit['_source']
+                
+                for order_id, operating in zip(order_ids, responses[1:]):
+                    if order_id not in results:
+                        continue
+                    try:
+                        docs = self.related_docs(operating)
+                    except Exception as e:
+                        logger.error(f"获取ElasticSearch工单 {order_id} 的operating日志时发生错误: {str(e)}")
+                        del results[order_id]
+                        continue
+                    if docs is None:
+                        mark_paged(results[order_id], 'tb_operatinginfo')
+                    elif docs:
+                        results[order_id]['operating_data'] = docs
+                
+                customer_ids = {es_data.get('CustomerId') for es_data in results.values() if es_data.get('CustomerId')}
+                configs = await self.customer_configs('es', customer_ids)
+                for es_data in results.values():
+                    customer_id = es_data.get('CustomerId')
+                    if not customer_id:
+                        continue
+                    if configs[customer_id] is None:
+                        mark_paged(es_data, 'basic_custspecialconfig')
+                    elif configs[customer_id]:
+                        es_data['custspecialconfig_data'] = list(configs[customer_id])
+        except Exception as e:
+            logger.error(f"批量获取ElasticSearch工单数据时发生错误（{len(batch)} 条）: {str(e)}")
+            results = {}
+        self.finish_batch('es', batch, results)
+    
+    async def compare_ready(self, run, total):
+        """逐批比较已获取完数据的工单，直到比较完total个工单
+        
+        积累到并发数的1/4（最多batch_size）或没有仍在获取中的工单时才比较一批，
+        保持按列比较的批量效率；比较期间新获取完的工单留到下一批。
+        需要分页归并的批次放到线程中执行，避免分页查询阻塞事件循环。
+        """
+        min_batch = min(self.checker.batch_size, max(1, self.concurrency // 4))
+        compared = 0
+        while compared < total:
+            await self.ready_event.wait()
+            self.ready_event.clear()
+            if self.fetching and len(self.ready) < min_batch:
+                continue
+            ready, self.ready = self.ready, []
+            for chunk in chunked(ready, self.checker.batch_size):
+                items = [(order_id, mysql_data, es_data) for order_id, mysql_data, es_data, _ in chunk]
+                try:
+                    if any(mysql_data and es_data and paged_tables(mysql_data, es_data)
+                           for _, mysql_data, es_data in items):
+                        results = await asyncio.to_thread(self.checker.compare_items, items)
+                    else:
+                        results = self.checker.compare_items(items)
+                except Exception as e:
+                    for _, _, _, future in chunk:
+                        future.set_exception(e)
+                    raise
+                for order_id, mysql_data, es_data, future in chunk:
+                    self.checker.record_outcome(run, order_id, results[order_id], mysql_data, es_data)
+                    future.set_result(None)
+            compared += len(ready)
+    
+    async def check_order(self, semaphore, order_id):
+        """获取一个工单的两侧数据，交给比较协程，比较完才释放并发名额"""
+        async with semaphore:
+            self.fetching += 1
+            try:
+                mysql_data, es_data = await asyncio.gather(self.fetch('mysql', order_id), self.fetch('es', order_id))
+            finally:
+                self.fetching -= 1
+            future = asyncio.get_running_loop().create_future()
+            self.ready.append((order_id, mysql_data, es_data, future))
+            self.ready_event.set()
+            await future
+    
+    async def check_orders(self, order_ids, run):
+        """在并发限制内检查全部工单"""
+        await self.open()
+        batchers = [
+            asyncio.ensure_future(self.batch_orders('mysql', self.fetch_mysql_batch, self.mysql_pool_size)),
+            asyncio.ensure_future(self.batch_orders('es', self.fetch_es_batch,
+                                                    self.checker.db_connector.es_config.get('maxsize', 10))),
+        ]
+        try:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(
+                self.compare_ready(run, len(order_ids)),
+                *(self.check_order(semaphore, order_id) for order_id in order_ids)
+            )
+        finally:
+            for batcher in batchers:
+                batcher.cancel()
+            await self.close()
+    
+    def run(self, order_ids=None):
+        """执行一轮异步数据一致性检查，流程与DataChecker.check_consistency相同
+        
+        Args:
+            order_ids: 要检查的工单ID列表，为空时随机抽样
+        
+        Returns:
+            bool: 本轮是否全部一致
+        """
+        checker = self.checker
+        logger.info(f"开始异步数据一致性检查，并发数: {self.concurrency}")
+        
+        # 先处理已到期的复查
+        checker.process_rechecks()
+        
+        differing = []
+        if order_ids is None:
+            order_ids, differing = checker.get_check_orders()
+        if not order_ids:
+            logger.error("未能获取工单ID进行检查")
+            return
+        
+        run = checker.begin_check(differing)
+        asyncio.run(self.check_orders(order_ids, run))
+        return checker.finish_check(run, order_ids, differing)
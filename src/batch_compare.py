@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 按列批量比较模块：把一批工单同一张表同一字段的值放在一起规范化后一次性比较
+
+from datetime import datetime
+from itertools import compress, count, repeat
+from operator import ne, is_not, or_
+from loguru import logger
+
+# 规范化后的空值，MySQL的None与ES的None、空字符串都规范化为它
+NULL = object()
+# 无法规范化的值，两侧各用一个，保证不会相等而交给compare_field_values判断
+MYSQL_OPAQUE = object()
+ES_OPAQUE = object()
+
+# 原值相等且两侧类型相同时必然一致的类型（float的0.0/-0.0、Decimal的精度表示等不在此列）
+EXACT_TYPES = frozenset((str, int, bool, type(None)))
+
+# 特殊表在ES中对应的数据键名
+SPECIAL_DATA_KEYS = {
+    'tb_operatinginfo': 'operating_data',
+    'basic_custspecialconfig': 'custspecialconfig_data',
+}
+
+def mysql_text(value):
+    """普通字段的MySQL值规范化"""
+    kind = type(value)
+    if kind is str:
+        return value
+    if value is None:
+        return NULL
+    if kind is bool:
+        return '1' if value else '0'
+    if kind is bytes:
+        return value.decode('utf-8', errors='ignore')
+    return str(value)
+
+def es_text(value):
+    """普通字段的ES值规范化"""
+    if type(value) is str:
+        return value if value else NULL
+    if value is None:
+        return NULL
+    return str(value)
+
+def mysql_date_text(value):
+    """日期字段的MySQL值规范化：格式化到秒"""
+    kind = type(value)
+    if kind is datetime:
+        return value.strftime('%Y-%m-%d %H:%M:%S')[:19]
+    if value is None:
+        return NULL
+    if kind is str:
+        return value[:19]
+    return MYSQL_OPAQUE
+
+def es_date_text(value):
+    """日期字段的ES值规范化：去掉时区、T替换为空格、截取到秒"""
+    if type(value) is str:
+        if not value:
+            return NULL
+        return value.split('+')[0].split('Z')[0].strip().replace('T', ' ')[:19]
+    if value is None:
+        return NULL
+    return ES_OPAQUE
+
+class ColumnarComparator:
+    """按列批量比较
+    
+    先按工单遍历数据结构，把结构性差异（条数不一致、记录缺失）按原顺序记下，
+    需要逐字段比较的行对按表收集；再对每个 (表, 字段) 取出整列值以map/compress一次比较整列：
+    整列都是str/int/bool/None的非日期字段直接比较原值与类型，其余字段用预编译的规范化函数转换后比较，
+    只有结果不同的位置才调用compare_field_values确认。
+    
+    规范化规则保证两侧规范化结果相同时compare_field_values一定返回True，
+    因此结果（包括差异的顺序）与逐字段调用compare_field_values完全一致。
+    """
+    
+    def __init__(self, checker):
+        """初始化按列比较器
+        
+        Args:
+            checker: DataChecker实例，复用其表映射与compare_field_values
+        """
+        self.checker = checker
+        self.main_table = checker.get_main_table()
+        self.date_fields = set(checker.DATE_FIELDS)
+        self.json_fields = checker.json_fields
+        self.normalizers = {}
+        self.special_fields = {}
+        
+        # 预编译 (表, 字段) 的规范化函数
+        for table_name, mapping in checker.table_mappings.items():
+            for mysql_field, _ in mapping['fields']:
+                self.get_normalizers(table_name, mysql_field)
+        for table_name, mapping in checker.special_tables.items():
+            for mysql_field, _ in mapping['fields']:
+                self.get_normalizers(table_name, mysql_field)
+    
+    def get_normalizers(self, table_name, field):
+        """返回 (表, 字段) 的 (MySQL规范化函数, ES规范化函数)"""
+        key = (table_name, field)
+        normalizers = self.normalizers.get(key)
+        if normalizers is None:
+            if field in self.date_fields:
+                normalizers = (mysql_date_text, es_date_text)
+            elif field in self.json_fields:
+                normalizers = (self.json_text, self.json_text)
+            else:
+                normalizers = (mysql_text, es_text)
+            self.normalizers[key] = normalizers
+        return normalizers
+    
+    def json_text(self, value):
+        """JSON字段两侧的值规范化：键排序、去空白后的JSON文本"""
+        canonical = self.checker.json_comparator.canonical(value)
+        return NULL if canonical is None else canonical
+    
+    def compare_batch(self, items, skip_tables=None):
+        """批量比较多个工单
+        
+        Args:
+            items: (工单ID, MySQL数据, ES数据) 列表
+            skip_tables: 工单ID -> 该工单不比较的特殊表
+        
+        Returns:
+            dict: 工单ID -> (是否一致, 差异列表)
+        """
+        results = {}
+        skip_tables = skip_tables or {}
+        if not self.main_table:
+            logger.error("未找到主表映射定义")
+            return {order_id: (False, []) for order_id, _, _ in items}
+        
+        # 每个工单的差异片段：结构性差异为dict，行对为 (分组键, 行号)
+        segments = {}
+        # 分组键 -> {'table', 'fields', 'ids', 'mysql_rows', 'es_rows'}
+        groups = {}
+        
+        for order_id, mysql_data, es_data in items:
+            if not mysql_data or not es_data:
+                logger.warning(f"工单 {order_id} 在MySQL或ES中数据缺失，无法比较")
+                results[order_id] = (False, [])
+                continue
+            segments[order_id] = self.collect_order(mysql_data, es_data, groups, skip_tables.get(order_id, ()))
+        
+        mismatches = {group_key: self.compare_group(group) for group_key, group in groups.items()}
+        
+        for order_id, order_segments in segments.items():
+            discrepancies = []
+            for segment in order_segments:
+                if isinstance(segment, dict):
+                    discrepancies.append(segment)
+                else:
+                    group_key, position = segment
+                    discrepancies.extend(mismatches[group_key].get(position, ()))
+            results[order_id] = (not discrepancies, discrepancies)
+        
+        return results
+    
+    def add_row_pair(self, groups, group_key, table_name, fields, id_val, mysql_item, es_item):
+        """把一对需要逐字段比较的行加入对应分组，返回差异片段"""
+        group = groups.get(group_key)
+        if group is None:
+            group = groups[group_key] = {
+                'table': table_name, 'fields': fields, 'ids': [], 'mysql_rows': [], 'es_rows': []
+            }
+        group['ids'].append(id_val)
+        group['mysql_rows'].append(mysql_item)
+        group['es_rows'].append(es_item)
+        return group_key, len(group['ids']) - 1
+    
+    def collect_order(self, mysql_data, es_data, groups, skip_tables=()):
+        """遍历一个工单的数据结构，返回按原比较顺序排列的差异片段"""
+        checker = self.checker
+        segments = []
+        
+        # 主表
+        main_mapping = checker.table_mappings[self.main_table]
+        segments.append(self.add_row_pair(groups, self.main_table, self.main_table, main_mapping['fields'],
+                                          None, mysql_data['main'], es_data))
+        
+        # 普通子表
+        for table_name, mapping in checker.table_mappings.items():
+            if mapping['es_path'] == "" or table_name in checker.special_tables:
+                continue
+            self.collect_rows(segments, groups, table_name, table_name, mapping['fields'],
+                              mysql_data['nested'].get(table_name, []),
+                              es_data.get(mapping['es_path'], []))
+        
+        # 特殊表直接比较MySQL行中的各个字段（不使用字段映射），按字段集合分组
+        for table_name in checker.special_tables:
+            if table_name in skip_tables:
+                continue
+            self.collect_rows(segments, groups, table_name, None, None,
+                              mysql_data['special'].get(table_name, []),
+                              es_data.get(SPECIAL_DATA_KEYS.get(table_name), []))
+        
+        return segments
+    
+    def collect_rows(self, segments, groups, table_name, group_key, fields, mysql_rows, es_rows):
+        """按Id配对一张子表的行，记录条数与缺失差异，行对加入分组"""
+        if len(mysql_rows) != len(es_rows):
+            segments.append({
+                'table': table_name,
+                'type': 'count_mismatch',
+                'mysql_count': len(mysql_rows),
+                'es_count': len(es_rows)
+            })
+        
+        mysql_id_map = {str(item['Id']): item for item in mysql_rows}
+        es_id_map = {str(item['Id']): item for item in es_rows}
+        
+        for id_val, mysql_item in mysql_id_map.items():
+            es_item = es_id_map.get(id_val)
+            if es_item is None:
+                segments.append({'table': table_name, 'type': 'missing_in_es', 'id': id_val})
+                continue
+            if fields is None:
+                row_fields = self.get_special_fields(table_name, mysql_item)
+                segments.append(self.add_row_pair(groups, (table_name, row_fields), table_name, row_fields,
+                                                  id_val, mysql_item, es_item))
+            else:
+                segments.append(self.add_row_pair(groups, group_key, table_name, fields,
+                                                  id_val, mysql_item, es_item))
+        
+        for id_val in es_id_map:
+            if id_val not in mysql_id_map:
+                segments.append({'table': table_name, 'type': 'missing_in_mysql', 'id': id_val})
+    
+    def get_special_fields(self, table_name, mysql_item):
+        """特殊表按MySQL行的字段集合生成 (字段, 字段) 列表，相同字段集合复用同一个元组"""
+        key = (table_name, tuple(mysql_item))
+        fields = self.special_fields.get(key)
+        if fields is None:
+            fields = self.special_fields[key] = tuple((field, field) for field in key[1])
+        return fields
+    
+    def differing_positions(self, table_name, mysql_field, mysql_column, es_column):
+        """返回一列中可能不一致、需要compare_field_values确认的位置"""
+        mysql_types = list(map(type, mysql_column))
+        if mysql_field not in self.date_fields and EXACT_TYPES.issuperset(mysql_types):
+            # 原值相等且类型相同即一致，整列在C层面完成比较
+            return compress(count(), map(or_, map(ne, mysql_column, es_column),
+                                         map(is_not, mysql_types, map(type, es_column))))
+        
+        mysql_normalize, es_normalize = self.get_normalizers(table_name, mysql_field)
+        return compress(count(), map(ne, map(mysql_normalize, mysql_column), map(es_normalize, es_column)))
+    
+    def compare_group(self, group):
+        """按列比较一个分组，返回 行号 -> 按字段顺序排列的差异列表"""
+        table_name = group['table']
+        ids = group['ids']
+        mysql_rows = group['mysql_rows']
+        es_rows = group['es_rows']
+        compare_field_values = self.checker.compare_field_values
+        mismatches = {}
+        
+        for mysql_field, es_field in group['fields']:
+            mysql_column = list(map(dict.get, mysql_rows, repeat(mysql_field)))
+            es_column = list(map(dict.get, es_rows, repeat(es_field)))
+            
+            for position in self.differing_positions(table_name, mysql_field, mysql_column, es_column):
+                mysql_value = mysql_column[position]
+                es_value = es_column[position]
+                if compare_field_values(mysql_value, es_value, mysql_field):
+                    continue
+                
+                discrepancy = {'table': table_name}
+                if ids[position] is not None:
+                    discrepancy['id'] = ids[position]
+                if mysql_field in self.json_fields:
+                    # JSON字段按路径报告差异
+                    mismatches.setdefault(position, []).extend(
+                        dict(discrepancy, field=mysql_field, path=path, mysql_value=mysql_path_value, es_value=es_path_value)
+                        for path, mysql_path_value, es_path_value in self.checker.json_comparator.diff(mysql_value, es_value)
+                    )
+                    continue
+                discrepancy.update(field=mysql_field, mysql_value=mysql_value, es_value=es_value)
+                mismatches.setdefault(position, []).append(discrepancy)
+        
+        return mismatches
@@ -3,7 +3,10 @@
 # 配置文件，包含数据库连接和企业微信配置
 
 import os
+import json
+import threading
 import configparser
+from dataclasses import dataclass, field, fields, replace
 from loguru import logger
 
 # 配置文件路径
@@ -15,6 +18,11 @@ if not os.path.exists(log_dir):
     os.makedirs(log_dir)
 log_file = os.path.join(log_dir, 'data_check.log')
 
+# 本地状态目录（增量检查水位等）
+STATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'state')
+if not os.path.exists(STATE_DIR):
+    os.makedirs(STATE_DIR)
+
 logger.add(
     log_file,
     rotation="1 days",
@@ -41,7 +49,9 @@ def load_config():
             'user': 'root',
             'password': 'password',
             'database': 'your_database',
-            'charset': 'utf8mb4'
+            'charset': 'utf8mb4',
+            'pool_size': '5',  # 连接池大小
+            'health_check_interval': '30'  # 空闲连接健康检查间隔（秒）
         }
         
         # ElasticSearch配置
@@ -50,21 +60,85 @@ def load_config():
             'port': '9200',
             'user': '',
             'password': '',
-            'index_name': 'your_index'
+            'index_name': 'your_index',
+            'timeout': '30',  # 请求超时（秒）
+            'maxsize': '10',  # 每个节点的长连接数
+            'id_is_doc_id': 'true',  # 主索引文档_id是否等于工单Id
+            'health_check_interval': '30'  # 客户端健康检查间隔（秒）
         }
         
         # 企业微信配置
         config['wechat'] = {
-            'corp_id': 'your_corp_id',
-            'corp_secret': 'your_corp_secret',
-            'agent_id': 'your_agent_id',
-            'to_user': '@all'  # 默认发送给所有人
+            'to_group_key': 'your_group_webhook_key',  # 群机器人webhook的key
+            'to_user': '',  # 需要@的手机号，多个用逗号分隔
+            'timeout': '10',  # 请求超时（秒）
+            'rate_per_minute': '20',  # 每分钟最多发送的消息数（群机器人限制20条/分钟）
+            'max_retries': '3',  # 发送失败的最大重试次数
+            'retry_backoff': '2',  # 重试退避基数（秒），每次翻倍
+            'async_send': 'true',  # 是否在后台线程异步发送
+            'queue_size': '1000'  # 发送队列长度上限，队列满时丢弃新消息
         }
         
         # 数据检查配置
         config['check'] = {
             'sample_size': '10',  # 随机抽样数量
             'check_interval': '3600',  # 检查间隔（秒）
+            'batch_size': '500',  # 批量查询时每个IN列表的最大ID数
+            'max_workers': '4',  # 并发获取数据的线程数，1为串行
+            'prefetch_batches': '2',  # 比较当前批次时预取的批次数
+            'compare_mode': 'full',  # 比较模式: full / digest
+            'es_fingerprint_field': '',  # ES主文档中预先存储的指纹字段
+            'checksum_fanout': '16',  # 区间校验每层切分的桶数
+            'checksum_leaf_size': '256',  # 桶宽不超过该值时按工单比较
+            'es_checksum_field': '',  # ES主文档中预先存储的整单校验值字段
+            'sample_strategy': 'pk_seek',  # 抽样策略: pk_seek / block / reservoir / stratified
+            'sample_seed': '',  # 随机种子，留空则每次运行随机
+            'sample_window_months': '3',  # 抽样时间窗口（月）
+            'sample_block_size': '1000',  # block策略的Id区间宽度
+            'stratified_floor_share': '0.2',  # stratified策略中轮流覆盖各分层的样本比例
+            'stratified_recent_hours': '24',  # 最近多少小时内更新的工单算作最近写入
+            'stratified_recent_boost': '4',  # 最近写入的工单的额外权重
+            'stratified_decay': '0.9',  # 各分层历史不一致率每个周期的衰减系数
+            'stratified_strata_ttl': '3600',  # 各分层工单数的缓存秒数，0为每次抽样都重新统计
+            'stratified_state_file': 'stratified_sampler.json',  # 分层统计状态文件名（位于state目录）
+            'incremental_overlap_seconds': '60',  # 增量检查每次向前多回看的秒数
+            'incremental_delay_seconds': '30',  # 最近这段时间内的变更留到下个周期
+            'incremental_max_orders': '5000',  # 增量检查每个周期最多检查的工单数
+            'incremental_initial_lookback_minutes': '60',  # 首次增量检查回看的分钟数
+            'incremental_state_file': 'incremental_watermark.json',  # 水位文件名（位于state目录）
+            'custconfig_cache_ttl': '0',  # 客户特殊配置缓存跨检查周期保留的秒数，0为只在一次检查内去重
+            'custconfig_cache_size': '10000',  # 客户特殊配置缓存的最大客户数
+            'json_cache_size': '10000',  # JSON字段解析结果缓存的最大条数（按内容哈希，跨检查周期保留）
+            'related_page_size': '500',  # operating日志/客户特殊配置每个集合一次获取的最大行数，超过时按Id分页归并比较
+            'config_reload_interval': '5',  # 服务模式下检查配置文件是否修改的间隔（秒），0为不热加载
+            'exclude_fields': '',  # 不获取也不比较的字段，格式 表名.字段名，逗号分隔
+            'table_mappings_file': '',  # 表映射文件（JSON，位于config目录），留空使用内置映射，修改后热加载
+            'recheck_delays': '30,120,600',  # 不一致工单第1、2、…次复查的间隔（秒），留空则立即告警
+            'recheck_lag_seconds': '300',  # 同步延迟阈值，最近变更早于该时间仍不一致的工单直接告警
+            'recheck_state_file': 'recheck_queue.json',  # 复查队列文件名（位于state目录）
+            'history_file': 'discrepancy_history.db',  # 差异历史库文件名（位于state目录），留空不记录也不去重告警
+            'history_retention_days': '30',  # 差异历史和已解决问题的保留天数
+            'history_realert_hours': '24',  # 未解决的不一致再次告警的间隔（小时），0为不再告警
+            'repair': 'false',  # 是否用MySQL数据重新写入确认不一致的工单
+            'repair_dry_run': 'false',  # 修复只输出计划和字段差异，不写入ES
+            'repair_chunk_size': '500',  # 修复时每个_bulk请求的最大文档数
+            'repair_max_chunk_mb': '10',  # 修复时每个_bulk请求的最大大小（MB）
+            'repair_max_retries': '3',  # 修复写入被ES限流（429）时的重试次数
+            'aggregate_check': 'false',  # 抽样检查前是否先按 日期×WorkStatus×AppCode 比较两侧工单数
+            'aggregate_window_days': '7',  # 聚合对账比较最近多少天创建的工单
+            'aggregate_max_orders': '200',  # 从工单数不一致的分组中最多定位并检查的工单数
+            'async_mode': 'false',  # 抽样检查是否使用异步引擎（aiomysql + AsyncElasticsearch）
+            'async_concurrency': '200',  # 异步引擎同时在途的工单数
+            'async_mysql_pool_size': '20',  # 异步引擎aiomysql连接池的最大连接数
+            'full_workers': '1',  # 全量对账的工作进程数，1为单进程，0为CPU核数
+            'full_partitions_per_worker': '4',  # 并行全量对账时每个工作进程平均分到的Id区间数
+        }
+        
+        # 运行指标配置
+        config['metrics'] = {
+            'http_host': '0.0.0.0',  # /metrics端点监听地址
+            'http_port': '0',  # 服务模式下/metrics端点端口，0为不开启
+            'textfile_path': ''  # 每次检查后写入的textfile collector文件路径，留空不写
         }
         
         # 写入配置文件
@@ -78,3 +152,307 @@ def load_config():
     config = configparser.ConfigParser()
     config.read(CONFIG_PATH)
     return config
+
+@dataclass(frozen=True)
+class MySQLSettings:
+    """MySQL连接配置"""
+    host: str = 'localhost'
+    port: int = 3306
+    user: str = 'root'
+    password: str = ''
+    database: str = ''
+    charset: str = 'utf8mb4'
+    pool_size: int = 5
+    health_check_interval: int = 30
+
+@dataclass(frozen=True)
+class ElasticsearchSettings:
+    """ElasticSearch连接配置"""
+    host: str = 'localhost'
+    port: int = 9200
+    user: str = ''
+    password: str = ''
+    index_name: str = ''
+    timeout: int = 30
+    maxsize: int = 10
+    id_is_doc_id: bool = True
+    health_check_interval: int = 30
+
+@dataclass(frozen=True)
+class WechatSettings:
+    """企业微信群机器人配置"""
+    to_group_key: str = ''
+    to_user: str = ''
+    timeout: float = 10
+    rate_per_minute: int = 20
+    max_retries: int = 3
+    retry_backoff: float = 2
+    async_send: bool = True
+    queue_size: int = 1000
+
+@dataclass(frozen=True)
+class CheckSettings:
+    """数据检查配置"""
+    sample_size: int = 10
+    check_interval: int = 3600
+    batch_size: int = 500
+    max_workers: int = 4
+    prefetch_batches: int = 2
+    compare_mode: str = 'full'
+    es_fingerprint_field: str = ''
+    checksum_fanout: int = 16
+    checksum_leaf_size: int = 256
+    es_checksum_field: str = ''
+    sample_strategy: str = 'pk_seek'
+    sample_seed: str = ''
+    sample_window_months: int = 3
+    sample_block_size: int = 1000
+    stratified_floor_share: float = 0.2
+    stratified_recent_hours: int = 24
+    stratified_recent_boost: float = 4
+    stratified_decay: float = 0.9
+    stratified_strata_ttl: int = 3600
+    stratified_state_file: str = 'stratified_sampler.json'
+    incremental_overlap_seconds: int = 60
+    incremental_delay_seconds: int = 30
+    incremental_max_orders: int = 5000
+    incremental_initial_lookback_minutes: int = 60
+    incremental_state_file: str = 'incremental_watermark.json'
+    custconfig_cache_ttl: int = 0
+    custconfig_cache_size: int = 10000
+    json_cache_size: int = 10000
+    related_page_size: int = 500
+    config_reload_interval: int = 5
+    exclude_fields: str = ''
+    table_mappings_file: str = ''
+    recheck_delays: str = '30,120,600'
+    recheck_lag_seconds: int = 300
+    recheck_state_file: str = 'recheck_queue.json'
+    history_file: str = 'discrepancy_history.db'
+    history_retention_days: int = 30
+    history_realert_hours: float = 24
+    repair: bool = False
+    repair_dry_run: bool = False
+    repair_chunk_size: int = 500
+    repair_max_chunk_mb: int = 10
+    repair_max_retries: int = 3
+    aggregate_check: bool = False
+    aggregate_window_days: int = 7
+    aggregate_max_orders: int = 200
+    async_mode: bool = False
+    async_concurrency: int = 200
+    async_mysql_pool_size: int = 20
+    full_workers: int = 1
+    full_partitions_per_worker: int = 4
+
+@dataclass(frozen=True)
+class MetricsSettings:
+    """运行指标输出配置"""
+    http_host: str = '0.0.0.0'
+    http_port: int = 0
+    textfile_path: str = ''
+
+@dataclass(frozen=True)
+class Settings:
+    """解析后的全部配置，不可修改；热加载或命令行覆盖时生成新对象"""
+    mysql: MySQLSettings
+    elasticsearch: ElasticsearchSettings
+    wechat: WechatSettings
+    check: CheckSettings
+    metrics: MetricsSettings
+    mtime: tuple = ()  # 解析时配置文件（及表映射文件）的修改时间
+    mappings: dict = field(default=None, compare=False)  # 表映射文件的内容，为空使用内置映射
+    
+    def with_overrides(self, overrides):
+        """返回应用覆盖值后的新配置
+        
+        Args:
+            overrides: {节名: {键: 值}}
+        """
+        sections = {name: replace(getattr(self, name), **values) for name, values in overrides.items() if values}
+        return replace(self, **sections)
+
+# 配置节名 -> 配置类
+SECTIONS = {
+    'mysql': MySQLSettings,
+    'elasticsearch': ElasticsearchSettings,
+    'wechat': WechatSettings,
+    'check': CheckSettings,
+    'metrics': MetricsSettings,
+}
+
+def parse_section(config, section, settings_class):
+    """按字段类型解析一个配置节，缺少的键使用默认值"""
+    values = {}
+    for item in fields(settings_class):
+        if not config.has_option(section, item.name):
+            continue
+        if item.type is bool:
+            values[item.name] = config.getboolean(section, item.name)
+        elif item.type is int:
+            values[item.name] = config.getint(section, item.name)
+        elif item.type is float:
+            values[item.name] = config.getfloat(section, item.name)
+        else:
+            values[item.name] = config.get(section, item.name)
+    return settings_class(**values)
+
+# 表映射文件可以覆盖的独立索引表，其余独立索引的比较逻辑依赖表名
+SPECIAL_TABLE_NAMES = ('tb_operatinginfo', 'basic_custspecialconfig')
+
+def mappings_path(check):
+    """表映射文件的路径，未配置时返回None"""
+    name = check.table_mappings_file.strip()
+    return os.path.join(os.path.dirname(CONFIG_PATH), name) if name else None
+
+def source_mtimes(check=None):
+    """配置文件和表映射文件的修改时间，文件不存在时对应项为None"""
+    paths = [CONFIG_PATH]
+    if check is not None and mappings_path(check):
+        paths.append(mappings_path(check))
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.path.getmtime(path))
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+def parse_fields(table_name, items):
+    """解析一张表的字段映射 [[MySQL字段名, ES字段名], ...]"""
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"表 {table_name} 的fields必须是非空列表")
+    parsed = []
+    for item in items:
+        if (not isinstance(item, (list, tuple)) or len(item) != 2
+                or not all(isinstance(name, str) and name for name in item)):
+            raise ValueError(f"表 {table_name} 的字段映射 {item} 格式错误，应为 [MySQL字段名, ES字段名]")
+        parsed.append(tuple(item))
+    if 'Id' not in dict(parsed):
+        raise ValueError(f"表 {table_name} 的fields中缺少Id")
+    return parsed
+
+def load_mappings(path):
+    """读取并校验表映射文件
+    
+    文件格式与DataChecker中的内置映射相同：table_mappings为主表（es_path为空）和各子表，
+    special_tables只能覆盖tb_operatinginfo和basic_custspecialconfig的fields。
+    
+    Returns:
+        dict: {'table_mappings': {...}, 'special_tables': {...}}
+    
+    Raises:
+        ValueError: 文件无法读取或格式错误
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"无法读取表映射文件 {path}: {str(e)}")
+    if not isinstance(data, dict) or not isinstance(data.get('table_mappings'), dict):
+        raise ValueError(f"表映射文件 {path} 中缺少table_mappings")
+    
+    table_mappings = {}
+    for table_name, mapping in data['table_mappings'].items():
+        if not isinstance(mapping, dict) or not isinstance(mapping.get('es_path'), str) \
+                or not isinstance(mapping.get('id_field'), str):
+            raise ValueError(f"表 {table_name} 的映射需要es_path和id_field")
+        parsed = {'es_path': mapping['es_path'], 'id_field': mapping['id_field'],
+                  'fields': parse_fields(table_name, mapping.get('fields'))}
+        if mapping.get('json_fields'):
+            parsed['json_fields'] = tuple(mapping['json_fields'])
+        table_mappings[table_name] = parsed
+    main_tables = [name for name, mapping in table_mappings.items() if mapping['es_path'] == ""]
+    if len(main_tables) != 1:
+        raise ValueError(f"表映射中必须有且只有一张主表（es_path为空），当前为: {main_tables}")
+    
+    special_tables = {}
+    for table_name, mapping in (data.get('special_tables') or {}).items():
+        if table_name not in SPECIAL_TABLE_NAMES:
+            raise ValueError(f"special_tables只支持 {', '.join(SPECIAL_TABLE_NAMES)}，不支持 {table_name}")
+        special_tables[table_name] = {'fields': parse_fields(table_name, (mapping or {}).get('fields'))}
+    return {'table_mappings': table_mappings, 'special_tables': special_tables}
+
+# 当前生效的配置、只在内存中生效的覆盖值（如命令行参数）
+_settings = None
+_overrides = {}
+_failed_mtime = None
+_settings_lock = threading.Lock()
+
+def load_settings():
+    """解析配置文件为Settings，失败时返回None"""
+    try:
+        config = load_config()
+    except configparser.Error as e:
+        logger.error(f"配置文件格式错误: {str(e)}")
+        return None
+    if not config:
+        return None
+    
+    try:
+        sections = {name: parse_section(config, name, settings_class) for name, settings_class in SECTIONS.items()}
+        path = mappings_path(sections['check'])
+        settings = Settings(
+            mtime=source_mtimes(sections['check']),
+            mappings=load_mappings(path) if path else None,
+            **sections
+        )
+    except ValueError as e:
+        logger.error(f"配置文件格式错误: {str(e)}")
+        return None
+    return settings.with_overrides(_overrides)
+
+def get_settings():
+    """返回当前配置，只在首次调用时解析配置文件"""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = load_settings()
+        return _settings
+
+def set_overrides(section, **values):
+    """设置只在内存中生效的配置覆盖值，不修改配置文件，热加载后仍然生效"""
+    global _settings
+    with _settings_lock:
+        _overrides.setdefault(section, {}).update(values)
+        if _settings is not None:
+            _settings = _settings.with_overrides(_overrides)
+
+def reload_settings_if_changed():
+    """配置文件或表映射文件修改时间变化时重新解析
+    
+    Returns:
+        Settings: 重新解析后的配置；文件未变化或解析失败时返回None（继续使用原配置）
+    """
+    global _settings, _failed_mtime
+    with _settings_lock:
+        mtime = source_mtimes(_settings.check if _settings is not None else None)
+        if mtime[0] is None:
+            return None
+        if (_settings is not None and mtime == _settings.mtime) or mtime == _failed_mtime:
+            return None
+        
+        settings = load_settings()
+        if settings is None:
+            _failed_mtime = mtime
+            logger.error("配置文件重新加载失败，继续使用原配置")
+            return None
+        
+        _settings = settings
+        _failed_mtime = None
+    
+    logger.info("配置文件已修改，已重新加载配置")
+    return settings
+
+def rollback_settings(previous, rejected):
+    """重新加载的配置应用失败时恢复原配置，同一版本的配置文件不再重复加载
+    
+    Args:
+        previous: 原配置
+        rejected: 应用失败的配置
+    """
+    global _settings, _failed_mtime
+    with _settings_lock:
+        _settings = previous
+        _failed_mtime = rejected.mtime
+
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 客户级特殊配置缓存：basic_custspecialconfig按CustomerId而不是按工单查询和比较
+
+import time
+import threading
+from collections import OrderedDict
+from loguru import logger
+
+class CustomerConfigCache:
+    """客户特殊配置缓存
+    
+    同一次检查内，每个客户的配置两侧各只查询一次，也只在第一个属于该客户的工单上比较一次。
+    ttl_seconds大于0时缓存跨检查周期保留（LRU，最多max_entries个客户），
+    复用前先用一次轻量查询取各客户的 (行数, 最大UpdatedAt) 版本，版本变化或超过TTL的客户重新加载。
+    """
+    
+    def __init__(self, ttl_seconds=0, max_entries=10000):
+        """初始化缓存
+        
+        Args:
+            ttl_seconds: 缓存跨检查周期保留的秒数，0表示只在一次检查内去重
+            max_entries: 每一侧最多缓存的客户数
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.lock = threading.Lock()
+        self.entries = {}  # 数据来源 -> OrderedDict(客户ID -> 缓存项)
+        self.run_id = 0
+        self.compared = set()
+        self.claimed = {}  # 工单ID -> 客户ID，本次检查中在该工单上比较了该客户的配置
+        self.stats = {'hits': 0, 'validated': 0, 'loaded': 0}
+    
+    def begin_run(self):
+        """开始一次新的检查：重置比较记录，清理过期缓存"""
+        with self.lock:
+            self.run_id += 1
+            self.compared.clear()
+            self.claimed.clear()
+            if self.ttl_seconds <= 0:
+                self.entries.clear()
+                return
+            
+            deadline = time.monotonic() - self.ttl_seconds
+            for side_entries in self.entries.values():
+                for customer_id in [key for key, entry in side_entries.items() if entry['loaded_at'] < deadline]:
+                    del side_entries[customer_id]
+    
+    def claim(self, customer_id, order_id=None):
+        """本次检查中第一次比较该客户的配置时返回True，之后返回False
+        
+        Args:
+            customer_id: 客户ID
+            order_id: 比较该客户配置的工单ID，记录下来供差异历史按客户跟踪问题
+        """
+        with self.lock:
+            if customer_id in self.compared:
+                return False
+            self.compared.add(customer_id)
+            if order_id is not None:
+                self.claimed[order_id] = customer_id
+            return True
+    
+    def claimed_orders(self):
+        """本次检查中比较了客户配置的工单，返回 工单ID -> 客户ID"""
+        with self.lock:
+            return dict(self.claimed)
+    
+    def lookup(self, side, customer_ids, load_versions):
+        """查找客户配置缓存
+        
+        Args:
+            side: 数据来源标识（如 'mysql'、'es'），不同来源分别缓存
+            customer_ids: 客户ID列表
+            load_versions: 回调，传入客户ID列表返回 客户ID -> 版本，用于校验上个周期留下的缓存
+        
+        Returns:
+            tuple: (客户ID -> 配置行列表, 需要重新加载的客户ID列表)
+        """
+        hits = {}
+        stale = {}
+        missing = []
+        with self.lock:
+            side_entries = self.entries.setdefault(side, OrderedDict())
+            for customer_id in customer_ids:
+                entry = side_entries.get(customer_id)
+                if entry is None:
+                    missing.append(customer_id)
+                elif entry['run'] == self.run_id:
+                    side_entries.move_to_end(customer_id)
+                    hits[customer_id] = entry['rows']
+                else:
+                    stale[customer_id] = entry
+        
+        if stale:
+            versions = load_versions(list(stale))
+            with self.lock:
+                for customer_id, entry in stale.items():
+                    if versions.get(customer_id) == entry['version'] and side_entries.get(customer_id) is entry:
+                        entry['run'] = self.run_id
+                        side_entries.move_to_end(customer_id)
+                        hits[customer_id] = entry['rows']
+                        self.stats['validated'] += 1
+                    else:
+                        missing.append(customer_id)
+        
+        with self.lock:
+            self.stats['hits'] += len(hits)
+        return hits, missing
+    
+    def store(self, side, loaded):
+        """保存新加载的客户配置
+        
+        Args:
+            side: 数据来源标识
+            loaded: 客户ID -> (配置行列表, 版本)
+        """
+        now = time.monotonic()
+        with self.lock:
+            side_entries = self.entries.setdefault(side, OrderedDict())
+            for customer_id, (rows, version) in loaded.items():
+                side_entries[customer_id] = {'rows': rows, 'version': version, 'loaded_at': now, 'run': self.run_id}
+                side_entries.move_to_end(customer_id)
+            while len(side_entries) > self.max_entries:
+                side_entries.popitem(last=False)
+            self.stats['loaded'] += len(loaded)
+    
+    def log_stats(self):
+        """输出缓存命中情况"""
+        logger.debug(f"客户配置缓存: 命中 {self.stats['hits']} 次（其中跨周期校验复用 {self.stats['validated']} 次），"
+                     f"加载 {self.stats['loaded']} 次")
@@ -2,37 +2,75 @@
 # -*- coding:utf-8 -*-
 # 数据一致性检查模块
 
-import random
+import os
+import copy
 import json
 import pymysql
 from loguru import logger
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from db_connect import DatabaseConnector
 from wechat_notify import WechatNotifier
-from config import load_config
+from config import get_settings, STATE_DIR
+from sampler import create_sampler
+from fingerprint import FingerprintComparator
+from batch_compare import ColumnarComparator
+from customer_cache import CustomerConfigCache
+from aggregate_check import AggregateReconciler
+from recheck import RecheckQueue, parse_delays
+from history import DiscrepancyHistory
+from repair import OrderRepairer
+from json_compare import JsonFieldComparator
+from paged_compare import PagedCollectionComparator, mark_paged, paged_tables
+import metrics
+
+def chunked(items, size):
+    """按固定大小切分列表"""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def run_queries(cursor, queries):
+    """执行查询生成器产出的 (SQL, 参数)，把结果行交回生成器，返回生成器的返回值"""
+    try:
+        sql, params = next(queries)
+        while True:
+            cursor.execute(sql, params)
+            sql, params = queries.send(cursor.fetchall())
+    except StopIteration as stop:
+        return stop.value
 
 class DataChecker:
     """MySQL与ElasticSearch数据一致性检查类"""
     
-    def __init__(self):
-        """初始化数据一致性检查"""
-        self.config = load_config()
-        if not self.config:
+    # 需要按日期格式比较的字段
+    DATE_FIELDS = ('CreatedAt', 'UpdatedAt', 'DeletedAt', 'InstallTime', 'RequiredTime',
+                   'EffectiveTime', 'EffectiveSuccessfulTime', 'LastUpdateTimeStamp')
+    
+    def __init__(self, settings=None):
+        """初始化数据一致性检查
+        
+        Args:
+            settings: 已解析的配置，为空时使用当前全局配置
+        """
+        self.settings = settings or get_settings()
+        if not self.settings:
             logger.error("配置加载失败，请检查配置文件")
             raise ValueError("配置加载失败")
         
-        self.sample_size = int(self.config.get('check', 'sample_size'))
-        self.index_name = self.config.get('elasticsearch', 'index_name')
-        self.db_connector = DatabaseConnector()
-        self.wechat = WechatNotifier()
+        self.db_connector = DatabaseConnector(self.settings)
+        self.wechat = WechatNotifier(self.settings)
+        # 客户特殊配置缓存：同一次检查内按客户去重，ttl大于0时跨检查周期复用
+        self.custconfig_cache = CustomerConfigCache()
         
         # 获取ES索引名称
-        self.main_index_name = self.index_name
+        self.main_index_name = self.settings.elasticsearch.index_name
         self.operating_index_name = "operating"
         self.custspecialconfig_index_name = "custspecialconfig"
         
-        # 特殊表定义（对应单独索引）
-        self.special_tables = {
+        # 特殊表定义（对应单独索引），配置了表映射文件时其中的fields覆盖内置定义
+        self.builtin_special_tables = {
             "tb_operatinginfo": {
                 "es_index": self.operating_index_name,
                 "id_field": "WorkOrderId",
@@ -71,8 +109,8 @@ class DataChecker:
             }
         }
         
-        # 表映射定义
-        self.table_mappings = {
+        # 内置表映射定义，配置了表映射文件（table_mappings_file）时整体替换为文件中的映射
+        self.builtin_table_mappings = {
             # 主表映射
             "tb_workorderinfo": {
                 "es_path": "",  # ES中主表字段在根级别
@@ -326,6 +364,7 @@ class DataChecker:
             "tb_workbussinessjsoninfo": {
                 "es_path": "JsonInfo",
                 "id_field": "WorkOrderId",
+                "json_fields": ("BussinessJson",),  # 按JSON结构比较的字段
                 "fields": [
                     ("Id", "Id"),
                     ("WorkOrderId", "WorkOrderId"),
@@ -348,187 +387,670 @@ class DataChecker:
                 ]
             },
         }
+        
+        # 当前表映射来自的表映射文件内容（None为内置映射，False为尚未生成），在apply_settings中生成
+        self.mappings = False
+        self.exclude_fields = None
+        self.json_comparator = JsonFieldComparator()
+        # 差异历史库，在apply_settings中按配置打开
+        self.history = None
+        
+        # 检查参数（依赖表映射，需在映射定义之后应用）
+        self.apply_settings(self.settings)
+    
+    def apply_settings(self, settings):
+        """应用检查相关配置（初始化和服务模式热加载时调用），不重建数据库连接
+        
+        Args:
+            settings: 已解析的配置
+        """
+        if settings.mysql != self.settings.mysql or settings.elasticsearch != self.settings.elasticsearch:
+            logger.warning("MySQL/ElasticSearch连接配置已修改，需要重启服务才能生效")
+        self.settings = settings
+        check = settings.check
+        
+        self.sample_size = check.sample_size
+        self.batch_size = max(1, check.batch_size)
+        # 主索引文档的_id是否等于工单Id，是则优先使用_mget按_id批量获取
+        self.es_id_is_doc_id = settings.elasticsearch.id_is_doc_id
+        # 比较模式：full逐字段比较；digest先比较订单摘要，只对摘要不同的订单逐字段比较
+        self.compare_mode = check.compare_mode
+        # 并发获取数据的线程数，1表示串行执行
+        self.max_workers = max(1, check.max_workers)
+        # 在比较当前批次时预先获取的批次数
+        self.prefetch_batches = max(1, check.prefetch_batches)
+        self.custconfig_cache.ttl_seconds = check.custconfig_cache_ttl
+        self.custconfig_cache.max_entries = max(1, check.custconfig_cache_size)
+        self.json_comparator.cache_size = max(0, check.json_cache_size)
+        # operating日志和客户特殊配置每个集合一次最多获取的行数，超过时改为分页归并比较
+        self.related_page_size = max(1, check.related_page_size)
+        self.paged = PagedCollectionComparator(self, self.related_page_size)
+        
+        # 表映射或字段排除变化时重建映射、投影和按列比较器
+        if settings.mappings != self.mappings:
+            self.apply_mappings(settings.mappings)
+            self.exclude_fields = None
+        if check.exclude_fields != self.exclude_fields:
+            self.apply_field_excludes(check.exclude_fields)
+            # 按列批量比较器，预编译各表字段的规范化函数
+            self.comparator = ColumnarComparator(self)
+        # 抽样器（stratified策略按表映射中的主表分层）
+        self.sampler = create_sampler(check, self.db_connector, self.get_main_table())
+        
+        # 摘要比较器
+        self.fingerprint = None
+        if self.compare_mode == 'digest':
+            self.fingerprint = FingerprintComparator(self, check.es_fingerprint_field.strip() or None)
+        
+        # 聚合对账：抽样检查前先按分组比较两侧工单数，优先检查不一致分组中的工单
+        self.aggregate = None
+        if check.aggregate_check:
+            self.aggregate = AggregateReconciler(self, check.aggregate_window_days, check.aggregate_max_orders)
+        
+        # 延迟复查队列：刚更新过的不一致工单按退避间隔复查，确认后才告警；间隔为空时立即告警
+        self.recheck = None
+        delays = parse_delays(check.recheck_delays)
+        if delays:
+            state_file = check.recheck_state_file.strip() or 'recheck_queue.json'
+            self.recheck = RecheckQueue(os.path.join(STATE_DIR, state_file), delays, check.recheck_lag_seconds)
+        
+        # 修复模式：用已获取的MySQL数据重新写入确认不一致的工单
+        self.repairer = None
+        if check.repair or check.repair_dry_run:
+            self.repairer = OrderRepairer(self, check.repair_chunk_size, check.repair_max_chunk_mb * 1024 * 1024,
+                                          check.repair_max_retries, dry_run=check.repair_dry_run)
+        
+        self.apply_history_settings(check)
+        self.wechat.apply_settings(settings.wechat)
+    
+    def apply_history_settings(self, check):
+        """按配置打开差异历史库，文件名变化时重新打开，文件名为空时关闭"""
+        history_file = check.history_file.strip()
+        path = os.path.join(STATE_DIR, history_file) if history_file else None
+        if self.history is not None and self.history.path != path:
+            self.history.close()
+            self.history = None
+        if path and self.history is None:
+            try:
+                self.history = DiscrepancyHistory(path)
+            except Exception as e:
+                logger.error(f"打开差异历史库 {path} 失败，本次运行不记录历史也不去重告警: {str(e)}")
+        if self.history is not None:
+            self.history.retention_days = check.history_retention_days
+            self.history.realert_seconds = check.history_realert_hours * 3600
     
+    def record_history(self, results):
+        """把一轮比较结果写入差异历史库
+        
+        Returns:
+            set: 需要告警的工单ID；未启用历史库或写入失败时返回None，表示全部告警
+        """
+        if self.history is None or not results:
+            return None
+        try:
+            return self.history.record(self.get_main_table(), results, self.custconfig_cache.claimed_orders())
+        except Exception as e:
+            logger.error(f"写入差异历史库失败，本轮不去重告警: {str(e)}")
+            return None
+    
+    def alert_sections(self, inconsistent, alert_ids):
+        """生成需要告警的工单消息，返回 (消息列表, 已知未解决不再告警的工单数)"""
+        sections = [
+            self.format_discrepancy_message(order_id, discrepancies, with_time=False)
+            for order_id, discrepancies in inconsistent.items()
+            if alert_ids is None or order_id in alert_ids
+        ]
+        return sections, len(inconsistent) - len(sections)
+    
+    def repair_inconsistent(self, orders):
+        """修复模式下重新写入确认不一致的工单
+        
+        Args:
+            orders: 工单ID -> (MySQL数据, ES数据, 差异列表)
+        
+        Returns:
+            str: 附加到汇总消息的修复结果，未开启修复或没有需要修复的工单时返回None
+        """
+        if self.repairer is None or not orders:
+            return None
+        try:
+            return self.repairer.format_message(self.repairer.repair(orders))
+        except Exception as e:
+            logger.error(f"修复不一致工单时发生错误: {str(e)}")
+            return None
+    
+    def apply_mappings(self, mappings):
+        """按表映射文件的内容生成表映射，为空时使用内置映射
+        
+        Args:
+            mappings: config.load_mappings解析的 {'table_mappings': ..., 'special_tables': ...}
+        """
+        self.mappings = mappings
+        if mappings:
+            self.table_mappings = copy.deepcopy(mappings['table_mappings'])
+            logger.info(f"使用表映射文件中的映射，共 {len(self.table_mappings)} 张表")
+        else:
+            self.table_mappings = copy.deepcopy(self.builtin_table_mappings)
+        self.special_tables = copy.deepcopy(self.builtin_special_tables)
+        for table_name, mapping in ((mappings or {}).get('special_tables') or {}).items():
+            self.special_tables[table_name]['fields'] = list(mapping['fields'])
+        
+        # 映射中定义的全部字段，字段排除配置在此基础上生效
+        self.defined_fields = {
+            table_name: list(mapping['fields'])
+            for table_name, mapping in list(self.table_mappings.items()) + list(self.special_tables.items())
+        }
+        # 按JSON结构比较的字段（与DATE_FIELDS一样按字段名生效），解析结果跨检查周期缓存
+        self.json_fields = frozenset(
+            field for mapping in self.table_mappings.values() for field in mapping.get('json_fields', ())
+        )
+    
+    def apply_field_excludes(self, exclude_fields):
+        """从映射中去掉配置排除的字段（格式 表名.字段名，逗号分隔），并重新生成投影
+        
+        被排除的字段既不获取也不比较；Id和工单键字段不能排除。
+        """
+        self.exclude_fields = exclude_fields
+        excludes = set()
+        for item in exclude_fields.split(','):
+            table_name, _, field = item.strip().partition('.')
+            if not item.strip():
+                continue
+            if table_name not in self.defined_fields or field not in dict(self.defined_fields[table_name]):
+                logger.warning(f"排除字段配置 {item.strip()} 不在表映射中，已忽略")
+                continue
+            excludes.add((table_name, field))
+        
+        for table_name, mapping in list(self.table_mappings.items()) + list(self.special_tables.items()):
+            required = {'Id', mapping['id_field']}
+            mapping['fields'] = [
+                (mysql_field, es_field) for mysql_field, es_field in self.defined_fields[table_name]
+                if mysql_field in required or (table_name, mysql_field) not in excludes
+            ]
+        # 被排除的 (表名, 字段名)，修复时需要另外获取映射中定义的全部字段
+        self.excluded_fields = excludes
+        if excludes:
+            logger.info(f"以下字段不获取也不比较: {', '.join(sorted(f'{t}.{f}' for t, f in excludes))}")
+        
+        self.build_projections()
+    
+    def build_projections(self):
+        """根据表映射生成MySQL查询列和ES的_source字段，只获取参与比较的字段"""
+        self.select_columns = {}
+        # 映射中定义的全部字段的查询列，修复时生成完整的ES文档
+        self.defined_columns = {}
+        for table_name, mapping in list(self.table_mappings.items()) + list(self.special_tables.items()):
+            columns = [mysql_field for mysql_field, _ in mapping['fields']]
+            self.select_columns[table_name] = ', '.join(f"`{column}`" for column in columns)
+            self.defined_columns[table_name] = ', '.join(
+                f"`{mysql_field}`" for mysql_field, _ in self.defined_fields[table_name]
+            )
+        
+        # 主索引：主表字段在根级别，子表字段在各自的嵌套路径下
+        includes = []
+        for mapping in self.table_mappings.values():
+            prefix = f"{mapping['es_path']}." if mapping['es_path'] else ""
+            includes.extend(f"{prefix}{es_field}" for _, es_field in mapping['fields'])
+        for field in ('Id', 'CustomerId'):
+            if field not in includes:
+                includes.append(field)
+        self.main_source_includes = includes
+        
+        self.special_source_fields = {
+            mapping['es_index']: [es_field for _, es_field in mapping['fields']]
+            for mapping in self.special_tables.values()
+        }
+    
+    @metrics.timed('sample')
     def get_random_orders(self):
         """从MySQL中随机获取订单ID进行抽查"""
         try:
-            with self.db_connector as db:
-                cursor = db.mysql_conn.cursor()
-                
-                # 获取最近3个月内有效的工单总数
-                count_sql = """
-                SELECT COUNT(Id) as total FROM tb_workorder 
-                WHERE Deleted = 0 AND CreatedAt > DATE_SUB(NOW(), INTERVAL 3 MONTH)
-                """
-                cursor.execute(count_sql)
-                total = cursor.fetchone()['total']
-                
-                if total == 0:
-                    logger.warning("未找到符合条件的工单记录")
-                    return []
-                
-                # 随机抽取工单ID
-                sample_sql = """
-                SELECT Id FROM tb_workorder 
-                WHERE Deleted = 0 AND CreatedAt > DATE_SUB(NOW(), INTERVAL 3 MONTH)
-                ORDER BY RAND() LIMIT %s
-                """
-                cursor.execute(sample_sql, (self.sample_size,))
-                orders = cursor.fetchall()
-                
-                logger.info(f"随机抽取了 {len(orders)} 条工单记录进行检查")
-                return [order['Id'] for order in orders]
+            orders = self.sampler.sample(self.sample_size)
+            if not orders:
+                logger.warning("未找到符合条件的工单记录")
+                return []
+            
+            logger.info(f"使用 {self.sampler.name} 策略随机抽取了 {len(orders)} 条工单记录进行检查")
+            return orders
         except Exception as e:
             logger.error(f"随机抽取工单时发生错误: {str(e)}")
             return []
     
+    def get_check_orders(self):
+        """获取本次抽样检查的工单：开启聚合对账时，不一致分组中定位到的工单排在随机样本之前
+        
+        Returns:
+            tuple: (工单ID列表, 工单数不一致的分组列表)
+        """
+        differing = []
+        located = []
+        if self.aggregate is not None:
+            differing, located = self.aggregate.run()
+            differing = differing or []
+        
+        orders = dict.fromkeys(located)
+        orders.update(dict.fromkeys(self.get_random_orders()))
+        return list(orders), differing
+    
+    def get_main_table(self):
+        """获取主表名称（es_path为空的映射）"""
+        for table_name, mapping in self.table_mappings.items():
+            if mapping['es_path'] == "":
+                return table_name
+        return "tb_workorderinfo"
+    
     def get_mysql_data(self, order_id):
         """从MySQL获取指定订单ID的数据"""
-        result = {}
+        return self.get_mysql_data_batch([order_id]).get(order_id)
+    
+    @metrics.timed('mysql_fetch')
+    def get_mysql_data_batch(self, order_ids, columns=None):
+        """批量从MySQL获取多个订单的数据
         
-        try:
-            with self.db_connector as db:
-                cursor = db.mysql_conn.cursor()
-                
-                # 获取主表名称
-                main_table = "tb_workorderinfo"
-                for table, mapping in self.table_mappings.items():
-                    if mapping['es_path'] == "":
-                        main_table = table
-                        break
-                
-                # 查询主表数据
-                main_sql = f"SELECT * FROM {main_table} WHERE Id = %s"
-                cursor.execute(main_sql, (order_id,))
-                main_data = cursor.fetchone()
-                
-                if not main_data:
+        每张表按batch_size分块执行一次IN查询，再在内存中按订单分组，
+        查询次数只与表数量和分块数有关，与订单数量无关。
+        
+        Args:
+            order_ids: 订单ID列表
+            columns: 表名 -> 查询列，为空时使用参与比较的字段（select_columns）；
+                指定时不使用客户配置缓存
+        
+        Returns:
+            dict: 订单ID -> 与单个订单结构相同的数据，未找到或查询失败的订单不包含在内
+        """
+        results = {}
+        main_table = self.get_main_table()
+        
+        for chunk in chunked(order_ids, self.batch_size):
+            try:
+                with self.db_connector.mysql_cursor() as cursor:
+                    results.update(self.fetch_mysql_chunk(cursor, main_table, chunk, columns))
+            except Exception as e:
+                logger.error(f"批量获取MySQL工单数据时发生错误（{len(chunk)} 条）: {str(e)}")
+                continue
+            
+            for order_id in chunk:
+                if order_id not in results:
                     logger.warning(f"MySQL中未找到工单 {order_id} 的数据")
-                    return None
-                
-                # 存储主表数据
-                result['main'] = main_data
-                result['nested'] = {}
-                result['special'] = {}  # 存储特殊表数据
-                
-                # 查询普通子表数据
-                for table_name, mapping in self.table_mappings.items():
-                    if mapping['es_path'] == "":  # 跳过主表
-                        continue
-                    
-                    nested_sql = f"SELECT * FROM {table_name} WHERE {mapping['id_field']} = %s"
-                    cursor.execute(nested_sql, (order_id,))
-                    nested_data = cursor.fetchall()
-                    
-                    # 存储子表数据
-                    result['nested'][table_name] = nested_data
-                
-                # 查询特殊表数据
-                # tb_operatinginfo表（对应operating索引）
-                nested_sql = "SELECT * FROM tb_operatinginfo WHERE WorkOrderId = %s"
-                cursor.execute(nested_sql, (order_id,))
-                operating_data = cursor.fetchall()
-                result['special']['tb_operatinginfo'] = operating_data
-                
-                # basic_custspecialconfig表（对应custspecialconfig索引）
-                # 需要根据 CustomerId 查询
-                customer_id = main_data.get('CustomerId')
-                if customer_id:
-                    nested_sql = "SELECT * FROM basic_custspecialconfig WHERE CustomerId = %s AND Deleted = 0"
-                    cursor.execute(nested_sql, (customer_id,))
-                    custconfig_data = cursor.fetchall()
-                    result['special']['basic_custspecialconfig'] = custconfig_data
-                
-                return result
-        except Exception as e:
-            logger.error(f"获取MySQL工单 {order_id} 数据时发生错误: {str(e)}")
-            return None
+        
+        return results
+    
+    def fetch_mysql_chunk(self, cursor, main_table, order_ids, columns=None):
+        """对一个分块的订单ID执行逐表IN查询并按订单分组"""
+        chunk_result = run_queries(cursor, self.mysql_chunk_queries(main_table, order_ids, columns))
+        if chunk_result:
+            self.fetch_mysql_custconfig(cursor, chunk_result, columns)
+        return chunk_result
+    
+    def fetch_mysql_related(self, cursor, chunk_result):
+        """为已取得主表数据的订单批量查询子表和特殊表数据（原地填充）"""
+        run_queries(cursor, self.mysql_related_queries(chunk_result))
+        self.fetch_mysql_custconfig(cursor, chunk_result)
+    
+    def mysql_chunk_queries(self, main_table, order_ids, columns=None):
+        """生成一个分块订单的主表、子表和operating表查询，返回 订单ID -> 订单数据（不含客户特殊配置）
+        
+        生成器每次产出 (SQL, 参数)，调用方执行后把结果行send回来，同步游标（run_queries）
+        和异步引擎的aiomysql游标共用同一套批量查询。columns为 表名 -> 查询列，为空时使用select_columns。
+        """
+        columns = columns or self.select_columns
+        chunk_result = {}
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        
+        # 查询主表数据
+        main_sql = f"SELECT {columns[main_table]} FROM {main_table} WHERE Id IN ({placeholders})"
+        for main_data in (yield main_sql, tuple(order_ids)):
+            chunk_result[main_data['Id']] = {
+                'main': main_data,
+                'nested': {},
+                'special': {}  # 存储特殊表数据
+            }
+        
+        if chunk_result:
+            yield from self.mysql_related_queries(chunk_result, columns)
+        return chunk_result
+    
+    def mysql_related_queries(self, chunk_result, columns=None):
+        """生成已取得主表数据的订单的子表和operating表查询（原地填充），用法同mysql_chunk_queries"""
+        columns = columns or self.select_columns
+        found_ids = tuple(chunk_result.keys())
+        placeholders = ', '.join(['%s'] * len(found_ids))
+        
+        # 查询普通子表数据
+        for table_name, mapping in self.table_mappings.items():
+            if mapping['es_path'] == "":  # 跳过主表
+                continue
+            
+            for order_data in chunk_result.values():
+                order_data['nested'][table_name] = []
+            
+            id_field = mapping['id_field']
+            nested_sql = (f"SELECT {columns[table_name]} FROM {table_name} "
+                          f"WHERE {id_field} IN ({placeholders})")
+            for row in (yield nested_sql, found_ids):
+                order_data = chunk_result.get(row[id_field])
+                if order_data is not None:
+                    order_data['nested'][table_name].append(row)
+        
+        # 查询特殊表数据
+        # tb_operatinginfo表（对应operating索引）：先按工单计数，行数超过分页大小的工单不批量获取，比较时分页归并
+        for order_data in chunk_result.values():
+            order_data['special']['tb_operatinginfo'] = []
+        small_ids = []
+        for row in (yield (f"SELECT WorkOrderId, COUNT(*) AS row_count FROM tb_operatinginfo "
+                           f"WHERE WorkOrderId IN ({placeholders}) GROUP BY WorkOrderId"), found_ids):
+            order_data = chunk_result.get(row['WorkOrderId'])
+            if order_data is None:
+                continue
+            if row['row_count'] > self.related_page_size:
+                mark_paged(order_data, 'tb_operatinginfo')
+            else:
+                small_ids.append(row['WorkOrderId'])
+        if small_ids:
+            nested_sql = (f"SELECT {columns['tb_operatinginfo']} FROM tb_operatinginfo "
+                          f"WHERE WorkOrderId IN ({', '.join(['%s'] * len(small_ids))})")
+            for row in (yield nested_sql, tuple(small_ids)):
+                order_data = chunk_result.get(row['WorkOrderId'])
+                if order_data is not None:
+                    order_data['special']['tb_operatinginfo'].append(row)
+    
+    def fetch_mysql_custconfig(self, cursor, chunk_result, columns=None):
+        """为已取得主表数据的订单填充basic_custspecialconfig表数据（对应custspecialconfig索引）
+        
+        需要根据 CustomerId 查询，同一次检查内相同客户只查询一次；指定查询列时不使用缓存。
+        """
+        customer_ids = list({
+            order_data['main'].get('CustomerId')
+            for order_data in chunk_result.values()
+            if order_data['main'].get('CustomerId')
+        })
+        if not customer_ids:
+            return
+        
+        if columns:
+            stored = run_queries(cursor, self.mysql_custconfig_queries(customer_ids, columns))
+            custconfig_map = {customer_id: rows for customer_id, (rows, _) in stored.items()}
+        else:
+            custconfig_map, missing = self.custconfig_cache.lookup(
+                'mysql', customer_ids, lambda ids: self.get_mysql_custconfig_versions(cursor, ids)
+            )
+            if missing:
+                stored = run_queries(cursor, self.mysql_custconfig_queries(missing))
+                custconfig_map.update({customer_id: rows for customer_id, (rows, _) in stored.items()})
+                self.custconfig_cache.store('mysql', stored)
+        
+        for order_data in chunk_result.values():
+            customer_id = order_data['main'].get('CustomerId')
+            if not customer_id:
+                continue
+            if custconfig_map[customer_id] is None:
+                mark_paged(order_data, 'basic_custspecialconfig')
+            else:
+                order_data['special']['basic_custspecialconfig'] = list(custconfig_map[customer_id])
+    
+    def mysql_custconfig_queries(self, customer_ids, columns=None):
+        """生成加载客户特殊配置的查询，返回 客户ID -> (配置行列表, 版本)，用法同mysql_chunk_queries
+        
+        先取各客户的版本（含行数），行数超过分页大小的客户配置行为None，比较时分页归并。
+        """
+        columns = columns or self.select_columns
+        versions = yield from self.mysql_custconfig_version_queries(customer_ids)
+        loaded = {customer_id: [] for customer_id in customer_ids
+                  if versions[customer_id][0] <= self.related_page_size}
+        if loaded:
+            customer_placeholders = ', '.join(['%s'] * len(loaded))
+            nested_sql = (f"SELECT {columns['basic_custspecialconfig']} FROM basic_custspecialconfig "
+                          f"WHERE CustomerId IN ({customer_placeholders}) AND Deleted = 0")
+            for row in (yield nested_sql, tuple(loaded)):
+                if row['CustomerId'] in loaded:
+                    loaded[row['CustomerId']].append(row)
+        
+        stored = {customer_id: (rows, self.mysql_custconfig_version(rows)) for customer_id, rows in loaded.items()}
+        stored.update({customer_id: (None, versions[customer_id]) for customer_id in customer_ids
+                       if customer_id not in loaded})
+        return stored
+    
+    def mysql_custconfig_version(self, rows):
+        """根据已加载的客户配置行计算版本 (行数, 最大UpdatedAt)"""
+        updated = [row['UpdatedAt'] for row in rows if row.get('UpdatedAt') is not None]
+        return len(rows), max(updated) if updated else None
+    
+    def get_mysql_custconfig_versions(self, cursor, customer_ids):
+        """查询客户配置在MySQL中的版本 (行数, 最大UpdatedAt)，用于校验缓存"""
+        return run_queries(cursor, self.mysql_custconfig_version_queries(customer_ids))
+    
+    def mysql_custconfig_version_queries(self, customer_ids):
+        """生成查询客户配置版本的语句，返回 客户ID -> 版本，用法同mysql_chunk_queries"""
+        versions = {customer_id: (0, None) for customer_id in customer_ids}
+        placeholders = ', '.join(['%s'] * len(customer_ids))
+        for row in (yield (f"SELECT CustomerId, COUNT(*) AS row_count, MAX(UpdatedAt) AS updated_at "
+                           f"FROM basic_custspecialconfig WHERE CustomerId IN ({placeholders}) AND Deleted = 0 "
+                           f"GROUP BY CustomerId"), tuple(customer_ids)):
+            versions[row['CustomerId']] = (row['row_count'], row['updated_at'])
+        return versions
     
     def get_es_data(self, order_id):
         """从ElasticSearch获取指定订单ID的数据"""
-        try:
-            with self.db_connector as db:
-                result = {}
-                
-                # 查询主索引数据
-                query = {
-                    "query": {
-                        "term": {
-                            "Id": order_id
-                        }
-                    }
-                }
-                
-                # 查询主索引
-                response = db.es_client.search(
-                    index=self.main_index_name,
-                    body=query
-                )
-                
-                # 检查是否有匹配结果
-                hits = response.get('hits', {}).get('hits', [])
-                if not hits:
+        return self.get_es_data_batch([order_id]).get(order_id)
+    
+    @metrics.timed('es_fetch')
+    def get_es_data_batch(self, order_ids):
+        """批量从ElasticSearch获取多个订单的数据
+        
+        主索引优先用_mget按_id获取，未命中的再用一次terms查询兜底；
+        operating和custspecialconfig索引的查询合并为每个分块一次_msearch。
+        
+        Args:
+            order_ids: 订单ID列表
+        
+        Returns:
+            dict: 订单ID -> 与单个订单结构相同的数据，未找到或查询失败的订单不包含在内
+        """
+        results = {}
+        
+        for chunk in chunked(order_ids, self.batch_size):
+            try:
+                es_client = self.db_connector.get_es_client()
+                results.update(self.fetch_es_chunk(es_client, chunk))
+            except Exception as e:
+                logger.error(f"批量获取ElasticSearch工单数据时发生错误（{len(chunk)} 条）: {str(e)}")
+                continue
+            
+            for order_id in chunk:
+                if order_id not in results:
                     logger.warning(f"ElasticSearch主索引中未找到工单 {order_id} 的数据")
-                    return None
-                
-                # 获取主索引数据
-                result = hits[0]['_source']
-                
-                # 查询operating索引数据（对应tb_operatinginfo表）
-                operating_query = {
-                    "query": {
-                        "term": {
-                            "WorkOrderId": order_id
-                        }
-                    },
-                    "size": 100  # 最多获取100条记录
-                }
-                
-                try:
-                    operating_response = db.es_client.search(
-                        index=self.operating_index_name,
-                        body=operating_query
-                    )
-                    
-                    operating_hits = operating_response.get('hits', {}).get('hits', [])
-                    if operating_hits:
-                        # 添加operating数据到结果中
-                        result['operating_data'] = [hit['_source'] for hit in operating_hits]
-                        logger.info(f"从operating索引中获取到 {len(operating_hits)} 条数据")
-                except Exception as e:
-                    logger.warning(f"查询operating索引时出错: {str(e)}")
-                
-                # 查询custspecialconfig索引数据（对应basic_custspecialconfig表）
-                # 这里需要根据工单中的CustomerId字段来查询
-                customer_id = result.get('CustomerId')
-                if customer_id:
-                    custconfig_query = {
-                        "query": {
-                            "term": {
-                                "CustomerId": customer_id
-                            }
-                        },
-                        "size": 100  # 最多获取100条记录
+        
+        return results
+    
+    def fetch_main_docs(self, es_client, order_ids, source_includes=None):
+        """批量获取主索引文档，返回 订单ID -> _source
+        
+        Args:
+            es_client: ES客户端
+            order_ids: 订单ID列表
+            source_includes: 只返回的_source字段列表（需包含Id），为空时使用按映射生成的字段
+        """
+        source_includes = source_includes or self.main_source_includes
+        # ES中的Id可能是数字或字符串，统一按字符串对应回订单ID
+        id_lookup = {str(order_id): order_id for order_id in order_ids}
+        docs = {}
+        source_params = {'_source_includes': source_includes}
+        
+        if self.es_id_is_doc_id:
+            response = es_client.mget(
+                index=self.main_index_name,
+                body={"ids": list(id_lookup.keys())},
+                **source_params
+            )
+            for doc in response.get('docs', []):
+                if doc.get('found') and doc.get('_id') in id_lookup:
+                    docs[id_lookup[doc['_id']]] = doc['_source']
+        
+        # _mget未命中（或_id不等于Id）时用一次terms查询兜底
+        missing = [order_id for order_id in order_ids if order_id not in docs]
+        if missing:
+            query = {
+                "query": {
+                    "terms": {
+                        "Id": missing
                     }
-                    
-                    try:
-                        custconfig_response = db.es_client.search(
-                            index=self.custspecialconfig_index_name,
-                            body=custconfig_query
-                        )
-                        
-                        custconfig_hits = custconfig_response.get('hits', {}).get('hits', [])
-                        if custconfig_hits:
-                            # 添加custspecialconfig数据到结果中
-                            result['custspecialconfig_data'] = [hit['_source'] for hit in custconfig_hits]
-                            logger.info(f"从custspecialconfig索引中获取到 {len(custconfig_hits)} 条数据")
-                    except Exception as e:
-                        logger.warning(f"查询custspecialconfig索引时出错: {str(e)}")
-                
-                return result
+                },
+                "size": len(missing),
+                "_source": source_includes
+            }
+            response = es_client.search(
+                index=self.main_index_name,
+                body=query
+            )
+            for hit in response.get('hits', {}).get('hits', []):
+                order_id = id_lookup.get(str(hit['_source'].get('Id')))
+                if order_id is not None and order_id not in docs:
+                    docs[order_id] = hit['_source']
+        
+        return docs
+    
+    def fetch_es_chunk(self, es_client, order_ids):
+        """获取一个分块的订单在各索引中的数据"""
+        chunk_result = self.fetch_main_docs(es_client, order_ids)
+        if chunk_result:
+            self.fetch_es_related(es_client, chunk_result)
+        return chunk_result
+    
+    def fetch_es_related(self, es_client, chunk_result, source_fields=None):
+        """为已取得主索引文档的订单批量查询operating和custspecialconfig索引（原地填充）
+        
+        Args:
+            es_client: ES客户端
+            chunk_result: 订单ID -> 主索引文档
+            source_fields: 索引名 -> 只返回的_source字段列表，为空时使用按映射生成的字段
+        """
+        source_fields = source_fields or self.special_source_fields
+        
+        # 组装_msearch请求：每个订单一条operating查询，每个客户一条custspecialconfig查询
+        searches = []
+        requests_meta = []
+        for order_id in chunk_result:
+            searches.append({"index": self.operating_index_name})
+            searches.append({
+                "query": {
+                    "term": {
+                        "WorkOrderId": order_id
+                    }
+                },
+                # 最多获取一页，总数超过一页的工单比较时分页归并
+                "size": self.related_page_size,
+                "sort": [{"Id": "asc"}],
+                "track_total_hits": True
+            })
+            if self.operating_index_name in source_fields:
+                searches[-1]['_source'] = source_fields[self.operating_index_name]
+            requests_meta.append(('operating', order_id))
+        
+        customer_ids = []
+        for result in chunk_result.values():
+            customer_id = result.get('CustomerId')
+            if customer_id and customer_id not in customer_ids:
+                customer_ids.append(customer_id)
+        
+        # 客户配置先查缓存，只查询本次检查中尚未加载或版本已变化的客户
+        cache_side = 'es'
+        if self.custspecialconfig_index_name in source_fields:
+            cache_side = ('es', tuple(source_fields[self.custspecialconfig_index_name]))
+        custconfig_map = {}
+        missing = []
+        if customer_ids:
+            custconfig_map, missing = self.custconfig_cache.lookup(
+                cache_side, customer_ids, lambda ids: self.get_es_custconfig_versions(es_client, ids)
+            )
+        for customer_id in missing:
+            searches.append({"index": self.custspecialconfig_index_name})
+            searches.append({
+                "query": {
+                    "term": {
+                        "CustomerId": customer_id
+                    }
+                },
+                "size": self.related_page_size,
+                "sort": [{"Id": "asc"}],
+                # 同时返回版本信息，供下个周期校验缓存
+                "track_total_hits": True,
+                "aggs": {"version": {"max": {"field": "UpdatedAt"}}}
+            })
+            if self.custspecialconfig_index_name in source_fields:
+                searches[-1]['_source'] = source_fields[self.custspecialconfig_index_name]
+            requests_meta.append(('custspecialconfig', customer_id))
+        
+        try:
+            responses = es_client.msearch(body=searches).get('responses', [])
         except Exception as e:
-            logger.error(f"获取ElasticSearch工单 {order_id} 数据时发生错误: {str(e)}")
-            return None
+            logger.warning(f"批量查询operating/custspecialconfig索引时出错: {str(e)}")
+            return
+        
+        loaded = {}
+        for (kind, key), response in zip(requests_meta, responses):
+            if 'error' in response:
+                logger.warning(f"查询{kind}索引时出错: {response['error']}")
+                continue
+            
+            hits = response.get('hits', {}).get('hits', [])
+            # 总数超过一页的集合不放入批次数据，只做标记（客户配置缓存为None）
+            version = self.es_custconfig_version(response)
+            oversized = version[0] > len(hits)
+            if kind == 'custspecialconfig':
+                loaded[key] = (None if oversized else [hit['_source'] for hit in hits], version)
+                continue
+            
+            if oversized:
+                mark_paged(chunk_result[key], 'tb_operatinginfo')
+            elif hits:
+                # 添加operating数据到结果中
+                chunk_result[key]['operating_data'] = [hit['_source'] for hit in hits]
+        
+        if loaded:
+            custconfig_map.update({customer_id: docs for customer_id, (docs, _) in loaded.items()})
+            self.custconfig_cache.store(cache_side, loaded)
+        
+        # 添加custspecialconfig数据到结果中
+        for result in chunk_result.values():
+            customer_id = result.get('CustomerId')
+            if customer_id in custconfig_map and custconfig_map[customer_id] is None:
+                mark_paged(result, 'basic_custspecialconfig')
+            elif custconfig_map.get(customer_id):
+                result['custspecialconfig_data'] = list(custconfig_map[customer_id])
+        
+        logger.debug(f"从ElasticSearch批量获取了 {len(chunk_result)} 条工单数据，"
+                     f"共 {len(responses)} 个子查询")
+    
+    def es_custconfig_version(self, response):
+        """从custspecialconfig查询响应中取版本 (文档数, 最大UpdatedAt)"""
+        total = response.get('hits', {}).get('total', 0)
+        if isinstance(total, dict):
+            total = total.get('value', 0)
+        return total, response.get('aggregations', {}).get('version', {}).get('value')
+    
+    def get_es_custconfig_versions(self, es_client, customer_ids):
+        """查询客户配置在ES中的版本 (文档数, 最大UpdatedAt)，用于校验缓存"""
+        searches = []
+        for customer_id in customer_ids:
+            searches.append({"index": self.custspecialconfig_index_name})
+            searches.append({
+                "query": {"term": {"CustomerId": customer_id}},
+                "size": 0,
+                "track_total_hits": True,
+                "aggs": {"version": {"max": {"field": "UpdatedAt"}}}
+            })
+        
+        try:
+            responses = es_client.msearch(body=searches).get('responses', [])
+        except Exception as e:
+            logger.warning(f"查询custspecialconfig索引版本时出错，重新加载客户配置: {str(e)}")
+            return {}
+        
+        return {
+            customer_id: self.es_custconfig_version(response)
+            for customer_id, response in zip(customer_ids, responses)
+            if 'error' not in response
+        }
     
     def compare_field_values(self, mysql_value, es_value, field_name):
         """比较MySQL和ES中字段值是否一致"""
@@ -536,9 +1058,12 @@ class DataChecker:
         if mysql_value is None and (es_value is None or es_value == ""):
             return True
         
+        # JSON字段按结构比较，忽略键顺序和空白
+        if field_name in self.json_fields:
+            return self.json_comparator.equal(mysql_value, es_value)
+        
         # 处理日期字段的特殊比较
-        if field_name in ('CreatedAt', 'UpdatedAt', 'DeletedAt', 'InstallTime', 'RequiredTime', 
-                         'EffectiveTime', 'EffectiveSuccessfulTime', 'LastUpdateTimeStamp'):
+        if field_name in self.DATE_FIELDS:
             if mysql_value is not None:
                 # 将MySQL的datetime转为字符串格式
                 if isinstance(mysql_value, datetime):
@@ -572,162 +1097,50 @@ class DataChecker:
     
     def compare_data(self, mysql_data, es_data, order_id):
         """比较MySQL和ES中的数据是否一致"""
-        if not mysql_data or not es_data:
-            logger.warning(f"工单 {order_id} 在MySQL或ES中数据缺失，无法比较")
-            return False, []
-        
-        discrepancies = []
+        return self.comparator.compare_batch([(order_id, mysql_data, es_data)])[order_id]
+    
+    def compare_batch(self, order_ids, mysql_batch, es_batch):
+        """按列批量比较一个批次的工单，返回 工单ID -> (是否一致, 差异列表)"""
+        return self.compare_items(
+            [(order_id, mysql_batch.get(order_id), es_batch.get(order_id)) for order_id in order_ids]
+        )
+    
+    @metrics.timed('compare')
+    def compare_items(self, items):
+        """按列批量比较 (工单ID, MySQL数据, ES数据) 列表
         
-        # 查找主表映射
-        main_table = None
-        for table_name, mapping in self.table_mappings.items():
-            if mapping['es_path'] == "":
-                main_table = table_name
-                break
-        
-        if not main_table:
-            logger.error("未找到主表映射定义")
-            return False, []
-        
-        # 比较主表字段
-        main_mapping = self.table_mappings[main_table]
-        for mysql_field, es_field in main_mapping['fields']:
-            mysql_value = mysql_data['main'].get(mysql_field)
-            es_value = es_data.get(es_field)
-            
-            if not self.compare_field_values(mysql_value, es_value, mysql_field):
-                discrepancies.append({
-                    'table': main_table,
-                    'field': mysql_field,
-                    'mysql_value': mysql_value,
-                    'es_value': es_value
-                })
-        
-        # 比较正常子表数据
-        for table_name, mapping in self.table_mappings.items():
-            if mapping['es_path'] == "":  # 跳过主表
+        客户特殊配置按客户而不是按工单比较：本次检查中只在每个客户的第一个工单上比较，
+        同一客户的其他工单跳过basic_custspecialconfig。
+        行数超过分页大小的operating日志和客户特殊配置不在批量比较中处理，逐个集合分页归并比较。
+        """
+        skip_tables = {}
+        paged_items = []
+        for order_id, mysql_data, es_data in items:
+            if not mysql_data or not es_data:
                 continue
-            
-            # 如果是特殊表则跳过，特殊表在下面单独处理
-            if table_name in self.special_tables:
-                continue
-            
-            es_path = mapping['es_path']
-            mysql_nested_data = mysql_data['nested'].get(table_name, [])
-            es_nested_data = es_data.get(es_path, [])
-            
-            # 检查子表数据条数
-            if len(mysql_nested_data) != len(es_nested_data):
-                discrepancies.append({
-                    'table': table_name,
-                    'type': 'count_mismatch',
-                    'mysql_count': len(mysql_nested_data),
-                    'es_count': len(es_nested_data)
-                })
-            
-            # 构建ID到记录的映射，以便精确比较
-            mysql_id_map = {str(item['Id']): item for item in mysql_nested_data}
-            es_id_map = {str(item['Id']): item for item in es_nested_data}
-            
-            # 检查MySQL中有但ES中没有的记录
-            for id_val, mysql_item in mysql_id_map.items():
-                if id_val not in es_id_map:
-                    discrepancies.append({
-                        'table': table_name,
-                        'type': 'missing_in_es',
-                        'id': id_val
-                    })
-                    continue
-                
-                # 比较每个字段的值
-                es_item = es_id_map[id_val]
-                for mysql_field, es_field in mapping['fields']:
-                    mysql_value = mysql_item.get(mysql_field)
-                    es_value = es_item.get(es_field)
-                    
-                    if not self.compare_field_values(mysql_value, es_value, mysql_field):
-                        discrepancies.append({
-                            'table': table_name,
-                            'id': id_val,
-                            'field': mysql_field,
-                            'mysql_value': mysql_value,
-                            'es_value': es_value
-                        })
-            
-            # 检查ES中有但MySQL中没有的记录
-            for id_val in es_id_map:
-                if id_val not in mysql_id_map:
-                    discrepancies.append({
-                        'table': table_name,
-                        'type': 'missing_in_mysql',
-                        'id': id_val
-                    })
-        
-        # 比较特殊表数据
-        for table_name, special_config in self.special_tables.items():
-            mysql_data_list = mysql_data['special'].get(table_name, [])
-            
-            # 根据表名确定使用的ES数据键名
-            es_data_key = None
-            if table_name == "tb_operatinginfo":
-                es_data_key = "operating_data"
-            elif table_name == "basic_custspecialconfig":
-                es_data_key = "custspecialconfig_data"
-            
-            es_data_list = es_data.get(es_data_key, [])
-            
-            # 检查特殊表数据条数
-            if len(mysql_data_list) != len(es_data_list):
-                discrepancies.append({
-                    'table': table_name,
-                    'type': 'count_mismatch',
-                    'mysql_count': len(mysql_data_list),
-                    'es_count': len(es_data_list)
-                })
-            
-            # 构建ID到记录的映射
-            mysql_id_map = {str(item['Id']): item for item in mysql_data_list}
-            es_id_map = {str(item['Id']): item for item in es_data_list}
-            
-            # 检查每个记录
-            for id_val, mysql_item in mysql_id_map.items():
-                if id_val not in es_id_map:
-                    discrepancies.append({
-                        'table': table_name,
-                        'type': 'missing_in_es',
-                        'id': id_val
-                    })
-                    continue
-                
-                # 特殊表直接比较各个字段（不使用字段映射）
-                es_item = es_id_map[id_val]
-                for field in mysql_item.keys():
-                    mysql_value = mysql_item.get(field)
-                    es_value = es_item.get(field)
-                    
-                    if not self.compare_field_values(mysql_value, es_value, field):
-                        discrepancies.append({
-                            'table': table_name,
-                            'id': id_val,
-                            'field': field,
-                            'mysql_value': mysql_value,
-                            'es_value': es_value
-                        })
-            
-            # 检查ES中有但MySQL中没有的记录
-            for id_val in es_id_map:
-                if id_val not in mysql_id_map:
-                    discrepancies.append({
-                        'table': table_name,
-                        'type': 'missing_in_mysql',
-                        'id': id_val
-                    })
-        
-        is_consistent = len(discrepancies) == 0
-        return is_consistent, discrepancies
-    
-    def format_discrepancy_message(self, order_id, discrepancies):
-        """格式化不一致消息，用于企业微信通知"""
+            skipped = set()
+            customer_id = mysql_data['main'].get('CustomerId')
+            if customer_id and not self.custconfig_cache.claim(customer_id, order_id):
+                skipped.add('basic_custspecialconfig')
+            tables = paged_tables(mysql_data, es_data) - skipped
+            if tables:
+                paged_items.append((order_id, mysql_data, es_data, tables))
+            if skipped or tables:
+                skip_tables[order_id] = tuple(skipped | tables)
+        results = self.comparator.compare_batch(items, skip_tables)
+        if paged_items:
+            self.paged.compare_orders(paged_items, results)
+        metrics.record_discrepancies(self.get_main_table(), results)
+        return results
+    
+    def format_discrepancy_message(self, order_id, discrepancies, with_time=True):
+        """格式化不一致消息，用于企业微信通知
+        
+        Args:
+            order_id: 工单ID
+            discrepancies: 差异列表
+            with_time: 是否附加检查时间（汇总消息中由汇总段统一给出）
+        """
         message = f"工单ID: {order_id}\n\n"
         
         for disc in discrepancies[:10]:  # 限制显示前10个不一致
@@ -737,6 +1150,8 @@ class DataChecker:
                 message += f"表 **{disc['table']}** 中ID为 {disc['id']} 的记录在ES中缺失\n\n"
             elif disc.get('type') == 'missing_in_mysql':
                 message += f"表 **{disc['table']}** 中ID为 {disc['id']} 的记录在MySQL中缺失\n\n"
+            elif disc.get('type') == 'compare_error':
+                message += f"表 **{disc['table']}** 比较失败，本次未能确认是否一致：{str(disc.get('error'))[:100]}\n\n"
             else:
                 # 字段值不一致
                 mysql_value = str(disc['mysql_value'])[:50]
@@ -748,57 +1163,289 @@ class DataChecker:
                 if len(str(disc['es_value'])) > 50:
                     es_value += "..."
                 
-                message += f"表 **{disc['table']}** 字段 **{disc.get('field')}** 值不一致：\n"
+                path = f" 路径 {disc['path']}" if disc.get('path') else ""
+                message += f"表 **{disc['table']}** 字段 **{disc.get('field')}**{path} 值不一致：\n"
                 message += f"MySQL: {mysql_value}\n"
                 message += f"ES: {es_value}\n\n"
         
         if len(discrepancies) > 10:
             message += f"还有 {len(discrepancies) - 10} 处不一致未显示...\n"
         
-        message += f"\n检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        if with_time:
+            message += f"\n检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
         return message
     
-    def check_consistency(self):
-        """执行数据一致性检查"""
+    @metrics.timed('mysql_digest')
+    def get_mysql_digests(self, order_ids):
+        """计算一个批次的MySQL侧订单摘要，出错时返回None（退回逐字段比较）"""
+        try:
+            return self.fingerprint.mysql_digests(order_ids)
+        except Exception as e:
+            logger.warning(f"计算MySQL订单摘要时出错，改为逐字段比较: {str(e)}")
+            return None
+    
+    @metrics.timed('es_digest')
+    def get_es_digests(self, order_ids):
+        """计算一个批次的ES侧订单摘要，出错时返回None（退回逐字段比较）"""
+        try:
+            return self.fingerprint.es_digests(order_ids)
+        except Exception as e:
+            logger.warning(f"计算ES订单摘要时出错，改为逐字段比较: {str(e)}")
+            return None
+    
+    def resolve_batch(self, chunk, mysql_result, es_result, executor=None):
+        """把一个批次的获取结果整理为 (chunk, mysql_batch, es_batch, matched_ids)
+        
+        摘要模式下mysql_result/es_result是订单摘要，摘要一致的订单放入matched_ids，
+        其余订单再获取完整数据用于逐字段比较。
+        """
+        if not self.fingerprint:
+            return chunk, mysql_result, es_result, set()
+        
+        if mysql_result is None or es_result is None:
+            mismatched = list(chunk)
+        else:
+            mismatched = self.fingerprint.find_mismatches(chunk, mysql_result, es_result)
+        matched = set(chunk) - set(mismatched)
+        
+        if not mismatched:
+            return chunk, {}, {}, matched
+        
+        if executor is None:
+            return chunk, self.get_mysql_data_batch(mismatched), self.get_es_data_batch(mismatched), matched
+        
+        mysql_future = executor.submit(self.get_mysql_data_batch, mismatched)
+        es_future = executor.submit(self.get_es_data_batch, mismatched)
+        return chunk, mysql_future.result(), es_future.result(), matched
+    
+    def iter_fetched_batches(self, order_ids):
+        """按批次获取MySQL和ES数据，按原顺序逐批产出 (chunk, mysql_batch, es_batch, matched_ids)
+        
+        max_workers大于1时，同一批次的MySQL与ES查询并行执行，并提前获取后续
+        prefetch_batches个批次，调用方比较当前批次的同时后续批次仍在获取中。
+        摘要模式下先获取两侧摘要，matched_ids为摘要一致、无需逐字段比较的订单。
+        """
+        chunks = list(chunked(order_ids, self.batch_size))
+        
+        if self.fingerprint:
+            fetch_mysql, fetch_es = self.get_mysql_digests, self.get_es_digests
+        else:
+            fetch_mysql, fetch_es = self.get_mysql_data_batch, self.get_es_data_batch
+        
+        if self.max_workers <= 1:
+            for chunk in chunks:
+                yield self.resolve_batch(chunk, fetch_mysql(chunk), fetch_es(chunk))
+            return
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch") as executor:
+            pending = deque()
+            next_index = 0
+            try:
+                while next_index < len(chunks) or pending:
+                    # 保持最多prefetch_batches个批次在途
+                    while next_index < len(chunks) and len(pending) < self.prefetch_batches:
+                        chunk = chunks[next_index]
+                        pending.append((
+                            chunk,
+                            executor.submit(fetch_mysql, chunk),
+                            executor.submit(fetch_es, chunk)
+                        ))
+                        next_index += 1
+                    
+                    chunk, mysql_future, es_future = pending.popleft()
+                    yield self.resolve_batch(chunk, mysql_future.result(), es_future.result(), executor)
+            finally:
+                for _, mysql_future, es_future in pending:
+                    mysql_future.cancel()
+                    es_future.cancel()
+    
+    def check_consistency(self, order_ids=None):
+        """执行数据一致性检查
+        
+        Args:
+            order_ids: 要检查的工单ID列表，为空时随机抽样
+        """
         logger.info("开始数据一致性检查...")
         
-        # 随机获取工单ID
-        order_ids = self.get_random_orders()
+        # 先处理已到期的复查
+        self.process_rechecks()
+        
+        # 随机获取工单ID（开启聚合对账时加上不一致分组中定位到的工单）
+        differing = []
+        if order_ids is None:
+            order_ids, differing = self.get_check_orders()
         if not order_ids:
             logger.error("未能获取工单ID进行检查")
             return
         
-        inconsistent_count = 0
-        
-        for order_id in order_ids:
-            logger.info(f"正在检查工单 {order_id}")
-            
-            # 获取MySQL数据
-            mysql_data = self.get_mysql_data(order_id)
-            
-            # 获取ES数据
-            es_data = self.get_es_data(order_id)
-            
-            # 比较数据一致性
-            is_consistent, discrepancies = self.compare_data(mysql_data, es_data, order_id)
+        run = self.begin_check(differing)
+        for chunk, mysql_batch, es_batch, matched_ids in self.iter_fetched_batches(order_ids):
+            # 摘要一致的订单无需逐字段比较，其余订单按列批量比较
+            compare_results = self.compare_batch(
+                [order_id for order_id in chunk if order_id not in matched_ids], mysql_batch, es_batch
+            )
             
-            if not is_consistent:
-                inconsistent_count += 1
-                logger.warning(f"工单 {order_id} 数据不一致，发现 {len(discrepancies)} 处差异")
+            for order_id in chunk:
+                logger.info(f"正在检查工单 {order_id}")
                 
-                # 格式化消息并发送企业微信通知
-                message = self.format_discrepancy_message(order_id, discrepancies)
-                self.wechat.send_message(f"数据一致性检查 - 发现不一致", message)
-            else:
-                logger.info(f"工单 {order_id} 数据一致")
+                if order_id in matched_ids:
+                    logger.info(f"工单 {order_id} 数据一致（摘要一致）")
+                    run['outcomes'][order_id] = True
+                    run['history'][order_id] = (True, [])
+                    continue
+                
+                self.record_outcome(run, order_id, compare_results[order_id],
+                                    mysql_batch.get(order_id), es_batch.get(order_id))
+        
+        return self.finish_check(run, order_ids, differing)
+    
+    def begin_check(self, differing=None):
+        """开始一轮检查，返回汇总本轮结果的状态
+        
+        Args:
+            differing: 聚合对账中工单数不一致的分组，消息排在最前面
+        """
+        self.custconfig_cache.begin_run()
+        return {
+            'outcomes': {},      # 各工单的比较结果，回传给抽样器
+            'history': {},       # 写入差异历史库的比较结果（不含等待复查的工单）
+            'inconsistent': {},  # 本轮不一致工单的差异
+            'repair': {},        # 修复模式下需要重新写入的工单
+            'deferred': 0,       # 刚更新过、进入复查队列的不一致工单数
+            # 本周期的不一致工单消息，检查结束后汇总发送
+            'sections': [self.aggregate.format_message(differing)] if differing else [],
+        }
+    
+    def record_outcome(self, run, order_id, result, mysql_data=None, es_data=None):
+        """记录一个工单的比较结果：不一致但刚更新过的进入复查队列，其余计入本轮结果
+        
+        Args:
+            run: begin_check返回的状态
+            order_id: 工单ID
+            result: (是否一致, 差异列表)
+            mysql_data: 该工单的MySQL数据，复查和修复时使用
+            es_data: 该工单的ES数据，修复时使用
+        """
+        is_consistent, discrepancies = result
+        run['outcomes'][order_id] = is_consistent
+        
+        if not is_consistent and self.recheck is not None and self.recheck.defer(order_id, mysql_data):
+            run['deferred'] += 1
+            metrics.RECHECKS.inc(result='deferred')
+            logger.info(f"工单 {order_id} 数据不一致，但最近刚有变更，加入复查队列")
+        elif not is_consistent:
+            logger.warning(f"工单 {order_id} 数据不一致，发现 {len(discrepancies)} 处差异")
+            run['history'][order_id] = (False, discrepancies)
+            run['inconsistent'][order_id] = discrepancies
+            if self.repairer is not None:
+                run['repair'][order_id] = (mysql_data, es_data, discrepancies)
+        else:
+            run['history'][order_id] = (True, [])
+            logger.info(f"工单 {order_id} 数据一致")
+            if self.recheck is not None and order_id in self.recheck:
+                self.recheck.resolve(order_id)
+    
+    def finish_check(self, run, order_ids, differing=None):
+        """汇总一轮检查：修复、写入差异历史库、发送告警
+        
+        Returns:
+            bool: 本轮是否全部一致
+        """
+        inconsistent_count = len(run['inconsistent'])
+        deferred_count = run['deferred']
+        sections = run['sections']
         
         # 检查结果汇总
         summary = f"数据一致性检查完成。共检查 {len(order_ids)} 条记录，发现 {inconsistent_count} 条不一致。"
+        if deferred_count:
+            summary += f"另有 {deferred_count} 条刚更新的工单不一致，等待复查。"
         logger.info(summary)
+        self.custconfig_cache.log_stats()
+        self.sampler.record_results(run['outcomes'])
+        if self.recheck is not None:
+            self.recheck.save()
+        
+        repair_message = self.repair_inconsistent(run['repair'])
+        if repair_message:
+            sections.append(repair_message)
+        
+        # 写入差异历史库，已知未解决的问题不重复告警
+        order_sections, suppressed = self.alert_sections(run['inconsistent'], self.record_history(run['history']))
+        sections.extend(order_sections)
+        if suppressed:
+            logger.info(f"{suppressed} 条不一致工单为已知未解决的问题，本次不重复告警")
+        metrics.LAST_CHECK_ORDERS.set(len(order_ids))
+        metrics.LAST_CHECK_INCONSISTENT.set(inconsistent_count)
+        
+        # 汇总发送本周期的不一致工单，超过消息长度上限时拆分为多条
+        if sections:
+            known = f"，其中 {suppressed} 条为已知未解决的问题，不再列出" if suppressed else ""
+            header = (f"共检查 {len(order_ids)} 条工单，发现 {inconsistent_count} 条不一致{known}\n\n"
+                      f"检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            self.wechat.send_digest("数据一致性检查 - 发现不一致", [header] + sections)
         
         # 如果全部一致，也发送一个通知
-        if inconsistent_count == 0 and order_ids:
+        if inconsistent_count == 0 and not differing and order_ids:
+            pending = f"其中 {deferred_count} 条刚更新的工单暂不一致，等待复查。\n\n" if deferred_count else ""
             self.wechat.send_message("数据一致性检查 - 全部一致", 
-                                    f"本次检查的 {len(order_ids)} 条工单数据全部一致。\n\n检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                                    f"本次检查的 {len(order_ids)} 条工单数据全部一致。\n\n{pending}检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
-        return inconsistent_count == 0
+        return inconsistent_count == 0 and not differing
+    
+    def process_rechecks(self):
+        """复查已到期的工单：只批量获取这些工单重新比较，一致的移出队列，仍不一致且满足上报条件的汇总告警
+        
+        Returns:
+            bool: 本次复查是否没有确认不一致的工单
+        """
+        if self.recheck is None:
+            return True
+        order_ids = self.recheck.due()
+        if not order_ids:
+            return True
+        
+        logger.info(f"复查 {len(order_ids)} 条之前不一致的工单")
+        self.custconfig_cache.begin_run()
+        mysql_batch = self.get_mysql_data_batch(order_ids)
+        es_batch = self.get_es_data_batch(order_ids)
+        compare_results = self.compare_batch(order_ids, mysql_batch, es_batch)
+        self.recheck.mark_attempt(order_ids)
+        
+        history_results = {}
+        confirmed = {}
+        repair_orders = {}
+        for order_id in order_ids:
+            is_consistent, discrepancies = compare_results[order_id]
+            if is_consistent:
+                history_results[order_id] = (True, [])
+                logger.info(f"工单 {order_id} 复查一致，移出复查队列")
+                self.recheck.resolve(order_id)
+                metrics.RECHECKS.inc(result='resolved')
+            elif self.recheck.defer(order_id, mysql_batch.get(order_id)):
+                logger.info(f"工单 {order_id} 复查仍不一致，继续等待复查")
+                metrics.RECHECKS.inc(result='deferred')
+            else:
+                logger.warning(f"工单 {order_id} 复查后确认不一致，发现 {len(discrepancies)} 处差异")
+                metrics.RECHECKS.inc(result='confirmed')
+                history_results[order_id] = (False, discrepancies)
+                confirmed[order_id] = discrepancies
+                if self.repairer is not None:
+                    repair_orders[order_id] = (mysql_batch.get(order_id), es_batch.get(order_id), discrepancies)
+        
+        self.recheck.save()
+        sections, _ = self.alert_sections(confirmed, self.record_history(history_results))
+        repair_message = self.repair_inconsistent(repair_orders)
+        if repair_message:
+            sections.insert(0, repair_message)
+        if sections:
+            header = (f"复查 {len(order_ids)} 条工单，确认 {len(confirmed)} 条不一致\n\n"
+                      f"检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            self.wechat.send_digest("数据一致性复查 - 确认不一致", [header] + sections)
+        return not confirmed
+    
+    def close(self):
+        """释放检查器持有的数据库连接，并等待告警消息发送完毕"""
+        self.db_connector.close_connections()
+        self.wechat.close()
+        if self.history is not None:
+            self.history.close()
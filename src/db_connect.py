@@ -2,56 +2,268 @@
 # -*- coding:utf-8 -*-
 # 数据库连接模块
 
+import time
+import threading
+from queue import LifoQueue, Empty
+from contextlib import contextmanager
 import pymysql
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, Urllib3HttpConnection
 from loguru import logger
-from config import load_config
+from config import get_settings
+import metrics
+
+class MeteredCursor:
+    """游标包装：统计MySQL查询次数、失败次数和读取的数据量"""
+    
+    # 迭代游标时每次读取的行数
+    iter_batch_size = 1000
+    
+    def __init__(self, cursor):
+        self.cursor = cursor
+    
+    def execute(self, query, args=None):
+        metrics.QUERIES.inc(backend='mysql')
+        try:
+            return self.cursor.execute(query, args)
+        except Exception:
+            metrics.QUERY_ERRORS.inc(backend='mysql')
+            raise
+    
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row:
+            metrics.FETCHED_BYTES.inc(metrics.estimate_bytes((row,)), backend='mysql')
+        return row
+    
+    def fetchmany(self, size=None):
+        rows = self.cursor.fetchmany(size) if size else self.cursor.fetchmany()
+        metrics.FETCHED_BYTES.inc(metrics.estimate_bytes(rows), backend='mysql')
+        return rows
+    
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        metrics.FETCHED_BYTES.inc(metrics.estimate_bytes(rows), backend='mysql')
+        return rows
+    
+    def __iter__(self):
+        # 逐批读取，SSDictCursor等流式游标不会把整个结果集读入内存
+        while True:
+            rows = self.fetchmany(self.iter_batch_size)
+            if not rows:
+                return
+            yield from rows
+    
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class MeteredConnection(Urllib3HttpConnection):
+    """ES连接：统计请求次数、失败次数和响应体字节数"""
+    
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+        if method == 'HEAD':
+            return super().perform_request(method, url, params, body, timeout, ignore, headers)
+        metrics.QUERIES.inc(backend='es')
+        try:
+            status, response_headers, data = super().perform_request(
+                method, url, params, body, timeout, ignore, headers
+            )
+        except Exception:
+            metrics.QUERY_ERRORS.inc(backend='es')
+            raise
+        metrics.FETCHED_BYTES.inc(len(data.encode('utf-8')) if isinstance(data, str) else len(data or b''),
+                                  backend='es')
+        return status, response_headers, data
+
+class MySQLConnectionPool:
+    """简易MySQL连接池，空闲过久的连接借出前做健康检查，失效连接自动重建"""
+    
+    def __init__(self, creator, max_size=5, health_check_interval=30):
+        """初始化连接池
+        
+        Args:
+            creator: 创建新连接的函数
+            max_size: 最大连接数
+            health_check_interval: 连接空闲超过该秒数后，借出前先ping检查
+        """
+        self.creator = creator
+        self.max_size = max(1, max_size)
+        self.health_check_interval = health_check_interval
+        
+        self._idle = LifoQueue()  # 空闲连接 (conn, 最后使用时间)
+        self._lock = threading.Lock()
+        # 归还连接或丢弃连接腾出名额时通知等待的线程
+        self._available = threading.Condition(self._lock)
+        self._created = 0
+        # close_all时递增，借出时记录的代数与当前不同的连接归还时直接关闭
+        self._generation = 0
+        self._borrowed = {}  # id(conn) -> 借出时的代数
+    
+    def _new_connection(self):
+        """在连接数上限内新建连接"""
+        with self._lock:
+            if self._created >= self.max_size:
+                return None
+            self._created += 1
+        try:
+            return self.creator()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+    
+    def _discard(self, conn):
+        """丢弃失效连接"""
+        with self._lock:
+            self._created -= 1
+            self._available.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    def _check_health(self, conn, last_used):
+        """检查空闲连接是否可用，不可用时尝试重连"""
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.ping(reconnect=True)
+            return True
+        except Exception as e:
+            logger.warning(f"MySQL连接健康检查失败，将重建连接: {str(e)}")
+            return False
+    
+    def _lend(self, conn):
+        """记录借出连接时的代数"""
+        with self._lock:
+            self._borrowed[id(conn)] = self._generation
+        return conn
+    
+    def acquire(self, timeout=30):
+        """从连接池借出一个连接，空闲未超过检查间隔的连接直接借出，不额外ping"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except Empty:
+                conn = self._new_connection()
+                if conn is not None:
+                    return self._lend(conn)
+                # 已达上限，等待其他线程归还连接或丢弃连接腾出名额后重试
+                with self._available:
+                    if self._idle.empty() and self._created >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._available.wait(remaining):
+                            raise TimeoutError("等待MySQL连接池空闲连接超时")
+                continue
+            
+            if self._check_health(conn, last_used):
+                return self._lend(conn)
+            self._discard(conn)
+    
+    def release(self, conn, broken=False):
+        """归还连接，broken为True或连接在close_all之前借出时直接丢弃"""
+        with self._lock:
+            stale = self._borrowed.pop(id(conn), self._generation) != self._generation
+        if broken or stale or not getattr(conn, 'open', True):
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.put((conn, time.monotonic()))
+            self._available.notify()
+    
+    @contextmanager
+    def connection(self):
+        """以上下文方式借用连接，出现连接类错误时丢弃该连接"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+    
+    def close_all(self):
+        """关闭所有空闲连接，此前借出的连接归还时也会被直接关闭；之后仍可继续借出新连接"""
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(conn)
 
 class DatabaseConnector:
-    """数据库连接器，包含MySQL和ElasticSearch的连接方法"""
+    """数据库连接器，包含MySQL和ElasticSearch的连接方法
     
-    def __init__(self):
-        """初始化数据库连接器"""
-        self.config = load_config()
-        if not self.config:
+    MySQL连接由连接池复用，ElasticSearch使用一个共享的长连接客户端，
+    两者在一个检查周期（或整个服务进程）内保持，直到调用close_connections。
+    """
+    
+    def __init__(self, settings=None):
+        """初始化数据库连接器
+        
+        Args:
+            settings: 已解析的配置，为空时使用当前全局配置
+        """
+        self.settings = settings or get_settings()
+        if not self.settings:
             logger.error("配置加载失败，请检查配置文件")
             raise ValueError("配置加载失败")
+        mysql = self.settings.mysql
+        es = self.settings.elasticsearch
         
         # MySQL连接配置
+        # 连接会被长期复用，开启autocommit避免一直停留在同一事务快照中读到旧数据
         self.mysql_config = {
-            'host': self.config.get('mysql', 'host'),
-            'port': int(self.config.get('mysql', 'port')),
-            'user': self.config.get('mysql', 'user'),
-            'password': self.config.get('mysql', 'password'),
-            'database': self.config.get('mysql', 'database'),
-            'charset': self.config.get('mysql', 'charset'),
-            'cursorclass': pymysql.cursors.DictCursor
+            'host': mysql.host,
+            'port': mysql.port,
+            'user': mysql.user,
+            'password': mysql.password,
+            'database': mysql.database,
+            'charset': mysql.charset,
+            'cursorclass': pymysql.cursors.DictCursor,
+            'autocommit': True
         }
         
         # ElasticSearch连接配置
         self.es_config = {
-            'hosts': [f"http://{self.config.get('elasticsearch', 'host')}:{self.config.get('elasticsearch', 'port')}"],
-            'http_auth': None
+            'hosts': [f"http://{es.host}:{es.port}"],
+            'http_auth': None,
+            'timeout': es.timeout,
+            'maxsize': es.maxsize,
+            'retry_on_timeout': True,
+            'max_retries': 3,
+            'connection_class': MeteredConnection
         }
         
         # 如果ES配置了用户名和密码，则添加认证
-        es_user = self.config.get('elasticsearch', 'user')
-        es_password = self.config.get('elasticsearch', 'password')
-        if es_user and es_password:
-            self.es_config['http_auth'] = (es_user, es_password)
+        if es.user and es.password:
+            self.es_config['http_auth'] = (es.user, es.password)
         
-        self.index_name = self.config.get('elasticsearch', 'index_name')
+        self.index_name = es.index_name
+        
+        # 健康检查间隔（秒）
+        self.es_health_check_interval = es.health_check_interval
         
         # 初始化连接对象
-        self.mysql_conn = None
+        self.mysql_pool = MySQLConnectionPool(
+            self.connect_mysql,
+            max_size=mysql.pool_size,
+            health_check_interval=mysql.health_check_interval
+        )
         self.es_client = None
+        self._es_checked_at = 0
+        self._es_lock = threading.Lock()
     
     def connect_mysql(self):
-        """连接MySQL数据库"""
+        """新建一个MySQL连接（供连接池调用）"""
         try:
-            self.mysql_conn = pymysql.connect(**self.mysql_config)
+            conn = pymysql.connect(**self.mysql_config)
             logger.info("MySQL连接成功")
-            return self.mysql_conn
+            return conn
         except Exception as e:
             logger.error(f"MySQL连接失败: {str(e)}")
             raise
@@ -59,29 +271,76 @@ class DatabaseConnector:
     def connect_elasticsearch(self):
         """连接ElasticSearch"""
         try:
-            self.es_client = Elasticsearch(**self.es_config, timeout=30)
+            self.es_client = Elasticsearch(**self.es_config)
             if not self.es_client.ping():
                 raise ConnectionError("无法连接到ElasticSearch")
+            self._es_checked_at = time.monotonic()
             logger.info("ElasticSearch连接成功")
             return self.es_client
         except Exception as e:
             logger.error(f"ElasticSearch连接失败: {str(e)}")
             raise
     
+    @contextmanager
+    def mysql_connection(self):
+        """从连接池借用一个MySQL连接"""
+        with self.mysql_pool.connection() as conn:
+            yield conn
+    
+    @contextmanager
+    def mysql_cursor(self, cursor_class=None):
+        """从连接池借用连接并返回游标，用完自动归还
+        
+        Args:
+            cursor_class: 游标类型，如 pymysql.cursors.SSDictCursor 用于流式读取，默认使用DictCursor
+        """
+        with self.mysql_connection() as conn:
+            cursor = conn.cursor(cursor_class) if cursor_class else conn.cursor()
+            try:
+                yield MeteredCursor(cursor)
+            finally:
+                cursor.close()
+    
+    def get_es_client(self):
+        """获取共享的ElasticSearch客户端，超过检查间隔时先ping，失败则重建"""
+        with self._es_lock:
+            if self.es_client is None:
+                return self.connect_elasticsearch()
+            
+            if time.monotonic() - self._es_checked_at < self.es_health_check_interval:
+                return self.es_client
+            
+            try:
+                healthy = self.es_client.ping()
+            except Exception:
+                healthy = False
+            
+            if healthy:
+                self._es_checked_at = time.monotonic()
+                return self.es_client
+            
+            logger.warning("ElasticSearch连接健康检查失败，正在重建客户端")
+            try:
+                self.es_client.close()
+            except Exception:
+                pass
+            self.es_client = None
+            return self.connect_elasticsearch()
+    
     def close_connections(self):
         """关闭所有数据库连接"""
-        if self.mysql_conn:
-            self.mysql_conn.close()
-            logger.debug("MySQL连接已关闭")
+        self.mysql_pool.close_all()
+        logger.debug("MySQL连接池已关闭")
         
-        if self.es_client:
-            self.es_client.close()
-            logger.debug("ElasticSearch连接已关闭")
+        with self._es_lock:
+            if self.es_client:
+                self.es_client.close()
+                self.es_client = None
+                logger.debug("ElasticSearch连接已关闭")
     
     def __enter__(self):
-        """支持with语句的上下文管理器"""
-        self.connect_mysql()
-        self.connect_elasticsearch()
+        """支持with语句的上下文管理器，在with块内复用同一组连接"""
+        self.get_es_client()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 摘要比较模块：先比较每个订单的规范化哈希，只对哈希不同的订单做逐字段比较
+
+import zlib
+import hashlib
+from loguru import logger
+
+# 规范化时NULL的占位符与字段分隔符，两侧必须保持一致
+NULL_MARK = '\x00'
+SEPARATOR = '\x1f'
+
+def normalize_es_value(value, is_date):
+    """把ES中的字段值规范化为与MySQL侧SQL表达式相同的字符串"""
+    if value is None:
+        return NULL_MARK
+    if is_date and isinstance(value, str):
+        # 与compare_field_values相同：去掉时区、T替换为空格、截取到秒
+        value = value.split('+')[0].split('Z')[0].strip()
+        return value.replace('T', ' ')[:19]
+    return str(value)
+
+def sql_value_expr(field, is_date):
+    """生成MySQL侧规范化单个字段的SQL表达式"""
+    if is_date:
+        return f"IFNULL(DATE_FORMAT({field}, '%%Y-%%m-%%d %%H:%%i:%%s'), CHAR(0 USING utf8mb4))"
+    return f"IFNULL(CAST({field} AS CHAR), CHAR(0 USING utf8mb4))"
+
+def sql_row_string(fields, date_fields):
+    """生成MySQL侧把整行规范化为字符串的SQL表达式"""
+    exprs = [sql_value_expr(field, field in date_fields) for field in fields]
+    return f"CONCAT_WS(CHAR(31 USING utf8mb4), {', '.join(exprs)})"
+
+def sql_row_hash(fields, date_fields):
+    """生成MySQL侧计算整行哈希的SQL表达式"""
+    return f"MD5({sql_row_string(fields, date_fields)})"
+
+def sql_row_crc(fields, date_fields):
+    """生成MySQL侧计算整行CRC32校验值的SQL表达式，可直接SUM聚合"""
+    return f"CRC32({sql_row_string(fields, date_fields)})"
+
+def row_hash(values):
+    """计算已规范化字段值列表的行哈希，与sql_row_hash结果相同"""
+    return hashlib.md5(SEPARATOR.join(values).encode('utf-8')).hexdigest()
+
+def row_crc(values):
+    """计算已规范化字段值列表的CRC32，与sql_row_crc结果相同"""
+    return zlib.crc32(SEPARATOR.join(values).encode('utf-8'))
+
+def table_digest(row_hashes):
+    """把一张表的多行哈希合并为表摘要，与行顺序无关"""
+    return hashlib.md5(''.join(sorted(row_hashes)).encode('utf-8')).hexdigest()
+
+def mapped_digest(table_digests, table_names):
+    """把table_mappings中各表的摘要按固定顺序合并为订单摘要
+    
+    同步程序如需在ES文档中预先存储指纹字段，应使用同样的算法：
+    每行按映射字段顺序规范化后以\\x1f连接取MD5（JSON字段取键排序、无空白的规范化JSON文本），
+    每张表的行哈希排序后拼接取MD5，再按表顺序拼接 "表名:摘要" 行取MD5。
+    """
+    lines = [f"{table}:{table_digests.get(table, table_digest([]))}" for table in table_names]
+    return hashlib.md5('\n'.join(lines).encode('utf-8')).hexdigest()
+
+class FingerprintComparator:
+    """摘要比较器
+    
+    MySQL侧在SQL中计算每行映射字段的MD5，只传输哈希值；ES侧从只包含映射字段的_source计算同样的哈希，
+    或者直接读取文档中预先存储的指纹字段。两侧摘要一致的订单视为一致，不再获取完整数据。
+    
+    规范化规则保证摘要一致时逐字段比较也一致；反之摘要不同只说明需要逐字段比较确认，
+    例如ES中日期以数字存储或数值精度表示不同的情况。
+    
+    JSON字段（表映射中的json_fields）两侧都取规范化JSON文本参与哈希，键顺序、空白不同或ES中存为对象的值
+    摘要仍然相同。SQL中无法规范化JSON，含JSON字段的表由MySQL返回各字段的规范化值，在Python中规范化
+    JSON字段后计算行哈希；区间校验和在SQL中聚合，不包含JSON字段（见checksum_fields）。
+    """
+    
+    def __init__(self, checker, stored_field=None):
+        """初始化摘要比较器
+        
+        Args:
+            checker: DataChecker实例，复用其表映射与批量获取逻辑
+            stored_field: ES主文档中预先存储的指纹字段名，为空时从_source计算
+        """
+        self.checker = checker
+        self.stored_field = stored_field
+        self.main_table = checker.get_main_table()
+        self.date_fields = set(checker.DATE_FIELDS)
+        self.json_fields = checker.json_fields
+        self.json_comparator = checker.json_comparator
+    
+    def mapped_tables(self):
+        """table_mappings中的表名，顺序固定"""
+        return list(self.checker.table_mappings.keys())
+    
+    def normalize_json_value(self, value):
+        """把JSON字段的值规范化为键排序、无空白的JSON文本，不是合法JSON时为原始文本"""
+        if value is None:
+            return NULL_MARK
+        return self.json_comparator.canonical(value) or ''
+    
+    def checksum_fields(self, fields):
+        """参与区间校验和的字段：CRC32在SQL中聚合，无法规范化的JSON字段不参与"""
+        return [(mysql_field, es_field) for mysql_field, es_field in fields if mysql_field not in self.json_fields]
+    
+    def hash_columns(self, fields):
+        """MySQL侧计算行哈希的查询列
+        
+        没有JSON字段时在SQL中直接取MD5，只传输哈希；否则返回各字段规范化后的值（列名v0、v1…），
+        由mysql_row_hash规范化JSON字段后计算哈希。
+        """
+        if not any(field in self.json_fields for field in fields):
+            return f"{sql_row_hash(fields, self.date_fields)} AS row_hash"
+        return ', '.join(f"{sql_value_expr(field, field in self.date_fields)} AS v{position}"
+                         for position, field in enumerate(fields))
+    
+    def mysql_row_hash(self, row, fields):
+        """取出或计算hash_columns查询结果中一行的哈希"""
+        if 'row_hash' in row:
+            return row['row_hash']
+        values = []
+        for position, field in enumerate(fields):
+            value = row[f'v{position}']
+            if field in self.json_fields and value != NULL_MARK:
+                value = self.normalize_json_value(value)
+            values.append(value)
+        return row_hash(values)
+    
+    def mysql_digests(self, order_ids):
+        """批量计算MySQL侧订单摘要，返回 订单ID -> {摘要键: 摘要}"""
+        checker = self.checker
+        results = {}
+        
+        with checker.db_connector.mysql_cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(order_ids))
+            main_fields = [mysql_field for mysql_field, _ in checker.table_mappings[self.main_table]['fields']]
+            cursor.execute(
+                f"SELECT Id AS order_key, CustomerId AS customer_key, {self.hash_columns(main_fields)} "
+                f"FROM {self.main_table} WHERE Id IN ({placeholders})",
+                tuple(order_ids)
+            )
+            
+            row_hashes = {}
+            customers = {}
+            for row in cursor.fetchall():
+                row_hashes[row['order_key']] = {self.main_table: [self.mysql_row_hash(row, main_fields)]}
+                customers[row['order_key']] = row['customer_key']
+            
+            if not row_hashes:
+                return results
+            
+            found_ids = tuple(row_hashes.keys())
+            placeholders = ', '.join(['%s'] * len(found_ids))
+            
+            # 普通子表与tb_operatinginfo都按订单ID分组
+            grouped_tables = [
+                (table_name, mapping['id_field'], [mysql_field for mysql_field, _ in mapping['fields']])
+                for table_name, mapping in checker.table_mappings.items()
+                if mapping['es_path'] != ""
+            ]
+            operating = checker.special_tables['tb_operatinginfo']
+            grouped_tables.append(('tb_operatinginfo', operating['id_field'],
+                                   [mysql_field for mysql_field, _ in operating['fields']]))
+            
+            for table_name, id_field, fields in grouped_tables:
+                for hashes in row_hashes.values():
+                    hashes[table_name] = []
+                cursor.execute(
+                    f"SELECT {id_field} AS order_key, {self.hash_columns(fields)} "
+                    f"FROM {table_name} WHERE {id_field} IN ({placeholders})",
+                    found_ids
+                )
+                for row in cursor.fetchall():
+                    if row['order_key'] in row_hashes:
+                        row_hashes[row['order_key']][table_name].append(self.mysql_row_hash(row, fields))
+            
+            # basic_custspecialconfig按客户分组后分配给订单
+            customer_ids = list({customer_id for customer_id in customers.values() if customer_id})
+            customer_hashes = {customer_id: [] for customer_id in customer_ids}
+            if customer_ids:
+                custconfig = checker.special_tables['basic_custspecialconfig']
+                fields = [mysql_field for mysql_field, _ in custconfig['fields']]
+                customer_placeholders = ', '.join(['%s'] * len(customer_ids))
+                cursor.execute(
+                    f"SELECT CustomerId AS order_key, {self.hash_columns(fields)} "
+                    f"FROM basic_custspecialconfig WHERE CustomerId IN ({customer_placeholders}) AND Deleted = 0",
+                    tuple(customer_ids)
+                )
+                for row in cursor.fetchall():
+                    if row['order_key'] in customer_hashes:
+                        customer_hashes[row['order_key']].append(self.mysql_row_hash(row, fields))
+        
+        for order_id, hashes in row_hashes.items():
+            hashes['basic_custspecialconfig'] = customer_hashes.get(customers[order_id], [])
+            results[order_id] = self.build_digest({table: table_digest(values) for table, values in hashes.items()})
+        
+        return results
+    
+    def build_digest(self, table_digests, stored=None):
+        """把各表摘要整理为可比较的订单摘要"""
+        return {
+            'mapped': stored if stored is not None else mapped_digest(table_digests, self.mapped_tables()),
+            'tb_operatinginfo': table_digests.get('tb_operatinginfo', table_digest([])),
+            'basic_custspecialconfig': table_digests.get('basic_custspecialconfig', table_digest([])),
+        }
+    
+    def es_row_values(self, item, fields):
+        """把ES文档按映射字段顺序规范化为字符串列表"""
+        return [self.normalize_json_value(item.get(es_field)) if mysql_field in self.json_fields
+                else normalize_es_value(item.get(es_field), mysql_field in self.date_fields)
+                for mysql_field, es_field in fields]
+    
+    def es_row_hashes(self, items, fields):
+        """计算ES文档列表中每个文档的行哈希"""
+        return [row_hash(self.es_row_values(item, fields)) for item in items]
+    
+    def main_source_includes(self):
+        """ES主索引需要返回的_source字段"""
+        if self.stored_field:
+            return ['Id', 'CustomerId', self.stored_field]
+        return self.checker.main_source_includes
+    
+    def es_digests(self, order_ids):
+        """批量计算ES侧订单摘要，返回 订单ID -> {摘要键: 摘要}"""
+        checker = self.checker
+        es_client = checker.db_connector.get_es_client()
+        
+        docs = checker.fetch_main_docs(es_client, order_ids, source_includes=self.main_source_includes())
+        if not docs:
+            return {}
+        
+        checker.fetch_es_related(es_client, docs)
+        
+        results = {}
+        for order_id, doc in docs.items():
+            digests = {
+                'tb_operatinginfo': table_digest(self.es_row_hashes(
+                    doc.get('operating_data') or [], checker.special_tables['tb_operatinginfo']['fields'])),
+                'basic_custspecialconfig': table_digest(self.es_row_hashes(
+                    doc.get('custspecialconfig_data') or [],
+                    checker.special_tables['basic_custspecialconfig']['fields'])),
+            }
+            
+            if self.stored_field:
+                results[order_id] = self.build_digest(digests, stored=doc.get(self.stored_field))
+                continue
+            
+            for table_name, mapping in checker.table_mappings.items():
+                items = [doc] if mapping['es_path'] == "" else (doc.get(mapping['es_path']) or [])
+                digests[table_name] = table_digest(self.es_row_hashes(items, mapping['fields']))
+            results[order_id] = self.build_digest(digests)
+        
+        return results
+    
+    def find_mismatches(self, order_ids, mysql_digests, es_digests):
+        """返回摘要不一致（或任一侧缺失）需要逐字段比较的订单ID"""
+        mismatched = [
+            order_id for order_id in order_ids
+            if order_id not in mysql_digests
+            or order_id not in es_digests
+            or mysql_digests[order_id] != es_digests[order_id]
+        ]
+        logger.debug(f"摘要比较: {len(order_ids)} 条工单中 {len(mismatched)} 条需要逐字段比较")
+        return mismatched
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 全量对账模块：按Id顺序流式归并MySQL主表与ES主索引
+
+from datetime import datetime
+import pymysql
+from loguru import logger
+
+def id_key(value):
+    """把两侧的Id统一成可比较的键（数字Id按数值比较）"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+class FullReconciler:
+    """全量对账：检查时间窗口或Id范围内的全部工单
+    
+    MySQL主表通过SSDictCursor按Id流式读取，ES主索引通过PIT + search_after按Id排序流式读取，
+    两个有序流在常数内存内归并；每凑满一个窗口（batch_size条）再批量获取子表和特殊索引数据并比较。
+    """
+    
+    def __init__(self, checker, start_id=None, end_id=None, since=None, source_includes=None):
+        """初始化全量对账
+        
+        Args:
+            checker: DataChecker实例，复用其表映射、批量获取和比较逻辑
+            start_id: 起始Id（含），为空表示不限
+            end_id: 结束Id（含），为空表示不限
+            since: 只检查该日期(YYYY-MM-DD)之后创建的工单，为空表示不限
+            source_includes: 流式读取ES时只返回的_source字段（需包含Id），为空时使用按映射生成的字段
+        """
+        self.checker = checker
+        self.db_connector = checker.db_connector
+        self.batch_size = checker.batch_size
+        self.main_table = checker.get_main_table()
+        self.start_id = start_id
+        self.end_id = end_id
+        self.since = since
+        self.source_includes = source_includes or checker.main_source_includes
+        self.pit_keep_alive = "5m"
+        self.use_pit = True  # 短区间读取可关闭PIT，省去打开/关闭的开销
+        self.max_report = 20  # 汇总消息中最多列出的工单数
+    
+    def build_mysql_filter(self):
+        """构造MySQL侧的过滤条件，返回 (where子句, 参数)"""
+        conditions = []
+        params = []
+        if self.start_id is not None:
+            conditions.append("Id >= %s")
+            params.append(self.start_id)
+        if self.end_id is not None:
+            conditions.append("Id <= %s")
+            params.append(self.end_id)
+        if self.since:
+            conditions.append("CreatedAt >= %s")
+            params.append(self.since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where, tuple(params)
+    
+    def build_es_query(self):
+        """构造ES侧与MySQL一致的过滤条件"""
+        filters = []
+        id_range = {}
+        if self.start_id is not None:
+            id_range['gte'] = self.start_id
+        if self.end_id is not None:
+            id_range['lte'] = self.end_id
+        if id_range:
+            filters.append({"range": {"Id": id_range}})
+        if self.since:
+            filters.append({"range": {"CreatedAt": {"gte": self.since, "format": "yyyy-MM-dd"}}})
+        if not filters:
+            return {"match_all": {}}
+        return {"bool": {"filter": filters}}
+    
+    def stream_mysql(self):
+        """按Id顺序流式读取MySQL主表"""
+        where, params = self.build_mysql_filter()
+        sql = f"SELECT {self.checker.select_columns[self.main_table]} FROM {self.main_table} {where} ORDER BY Id"
+        with self.db_connector.mysql_cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+    
+    def stream_es(self):
+        """按Id顺序流式读取ES主索引，优先使用PIT保证翻页期间视图一致"""
+        es_client = self.db_connector.get_es_client()
+        index_name = self.checker.main_index_name
+        
+        pit_id = None
+        if self.use_pit:
+            try:
+                pit_id = es_client.open_point_in_time(index=index_name, keep_alive=self.pit_keep_alive)['id']
+            except Exception as e:
+                logger.warning(f"打开PIT失败，改为直接在索引上翻页: {str(e)}")
+        
+        body = {
+            "size": self.batch_size,
+            "query": self.build_es_query(),
+            "sort": [{"Id": "asc"}]
+        }
+        body['_source'] = self.source_includes
+        try:
+            while True:
+                if pit_id:
+                    body['pit'] = {"id": pit_id, "keep_alive": self.pit_keep_alive}
+                    response = es_client.search(body=body)
+                    pit_id = response.get('pit_id', pit_id)
+                else:
+                    response = es_client.search(index=index_name, body=body)
+                
+                hits = response.get('hits', {}).get('hits', [])
+                if not hits:
+                    break
+                for hit in hits:
+                    yield hit['_source']
+                body['search_after'] = hits[-1]['sort']
+        finally:
+            if pit_id:
+                try:
+                    es_client.close_point_in_time(body={"id": pit_id})
+                except Exception as e:
+                    logger.warning(f"关闭PIT失败: {str(e)}")
+    
+    def merge_join(self):
+        """归并两个按Id有序的流，产出 (key, mysql_row, es_doc)，缺失一侧为None"""
+        mysql_iter = self.stream_mysql()
+        es_iter = self.stream_es()
+        mysql_row = next(mysql_iter, None)
+        es_doc = next(es_iter, None)
+        
+        while mysql_row is not None or es_doc is not None:
+            mysql_key = id_key(mysql_row['Id']) if mysql_row is not None else None
+            es_key = id_key(es_doc.get('Id')) if es_doc is not None else None
+            
+            if es_doc is None or (mysql_row is not None and mysql_key < es_key):
+                yield mysql_key, mysql_row, None
+                mysql_row = next(mysql_iter, None)
+            elif mysql_row is None or es_key < mysql_key:
+                yield es_key, None, es_doc
+                es_doc = next(es_iter, None)
+            else:
+                yield mysql_key, mysql_row, es_doc
+                mysql_row = next(mysql_iter, None)
+                es_doc = next(es_iter, None)
+    
+    def iter_windows(self):
+        """把归并结果按batch_size分成窗口"""
+        window = []
+        for item in self.merge_join():
+            window.append(item)
+            if len(window) >= self.batch_size:
+                yield window
+                window = []
+        if window:
+            yield window
+    
+    def check_window(self, window, stats):
+        """批量获取一个窗口的子表数据并逐单比较"""
+        mysql_part = {
+            mysql_row['Id']: {'main': mysql_row, 'nested': {}, 'special': {}}
+            for _, mysql_row, es_doc in window if mysql_row is not None and es_doc is not None
+        }
+        es_part = {
+            es_doc.get('Id'): es_doc
+            for _, mysql_row, es_doc in window if mysql_row is not None and es_doc is not None
+        }
+        
+        if mysql_part:
+            with self.db_connector.mysql_cursor() as cursor:
+                self.checker.fetch_mysql_related(cursor, mysql_part)
+            self.checker.fetch_es_related(self.db_connector.get_es_client(), es_part)
+        
+        compare_results = self.checker.compare_items([
+            (key, mysql_part[mysql_row['Id']], es_part[es_doc.get('Id')])
+            for key, mysql_row, es_doc in window if mysql_row is not None and es_doc is not None
+        ])
+        
+        for key, mysql_row, es_doc in window:
+            stats['checked'] += 1
+            if es_doc is None:
+                self.record(stats, 'missing_in_es', key)
+                continue
+            if mysql_row is None:
+                self.record(stats, 'missing_in_mysql', key)
+                continue
+            
+            is_consistent, discrepancies = compare_results[key]
+            if not is_consistent:
+                logger.warning(f"工单 {key} 数据不一致，发现 {len(discrepancies)} 处差异")
+                self.record(stats, 'inconsistent', key)
+    
+    def record(self, stats, kind, key):
+        """记录一条问题工单，只保留前max_report个ID用于汇总"""
+        stats[kind] += 1
+        if len(stats['samples'][kind]) < self.max_report:
+            stats['samples'][kind].append(key)
+        if kind != 'inconsistent':
+            logger.warning(f"工单 {key} {'在ES中缺失' if kind == 'missing_in_es' else '在MySQL中缺失'}")
+    
+    def format_summary(self, stats):
+        """格式化全量对账汇总消息"""
+        message = (f"检查范围: Id {self.start_id if self.start_id is not None else '-'} ~ "
+                   f"{self.end_id if self.end_id is not None else '-'}"
+                   f"{'，创建时间 >= ' + self.since if self.since else ''}\n\n")
+        message += f"共检查 {stats['checked']} 条工单\n\n"
+        for kind, label in (('inconsistent', '数据不一致'),
+                            ('missing_in_es', 'ES中缺失'),
+                            ('missing_in_mysql', 'MySQL中缺失')):
+            if stats[kind]:
+                ids = ', '.join(str(key) for key in stats['samples'][kind])
+                more = '...' if stats[kind] > len(stats['samples'][kind]) else ''
+                message += f"**{label}** {stats[kind]} 条: {ids}{more}\n\n"
+        message += f"\n检查时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        return message
+    
+    def new_stats(self):
+        """新建对账统计"""
+        return {
+            'checked': 0,
+            'inconsistent': 0,
+            'missing_in_es': 0,
+            'missing_in_mysql': 0,
+            'samples': {'inconsistent': [], 'missing_in_es': [], 'missing_in_mysql': []}
+        }
+    
+    def scan(self):
+        """归并比较范围内的全部工单，返回对账统计（不发送通知）"""
+        self.checker.custconfig_cache.begin_run()
+        stats = self.new_stats()
+        for window in self.iter_windows():
+            self.check_window(window, stats)
+            logger.info(f"全量对账进度: 已检查 {stats['checked']} 条")
+        return stats
+    
+    def report(self, stats):
+        """输出对账结果并发送汇总通知，返回是否全部一致"""
+        problem_count = stats['inconsistent'] + stats['missing_in_es'] + stats['missing_in_mysql']
+        logger.info(f"全量对账完成。共检查 {stats['checked']} 条工单，不一致 {stats['inconsistent']} 条，"
+                    f"ES缺失 {stats['missing_in_es']} 条，MySQL缺失 {stats['missing_in_mysql']} 条。")
+        
+        title = "全量数据对账 - 发现不一致" if problem_count else "全量数据对账 - 全部一致"
+        self.checker.wechat.send_message(title, self.format_summary(stats))
+        return problem_count == 0
+    
+    def run(self):
+        """执行全量对账，返回是否全部一致"""
+        logger.info("开始全量数据对账...")
+        return self.report(self.scan())
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 差异历史模块：把每轮检查的差异批量写入本地SQLite（WAL模式），跟踪未解决的问题并对告警去重
+
+import time
+import sqlite3
+from loguru import logger
+
+# 差异值在历史库中保存的最大长度
+MAX_VALUE_LENGTH = 500
+
+# 按客户而不是按工单比较的表，其问题按CustomerId跟踪
+CUSTOMER_TABLES = ('basic_custspecialconfig',)
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        started_at REAL NOT NULL,
+        orders INTEGER NOT NULL,
+        inconsistent INTEGER NOT NULL
+    )""",
+    # 每次观察到的差异，只追加，按保留天数清理
+    """CREATE TABLE IF NOT EXISTS discrepancies (
+        id INTEGER PRIMARY KEY,
+        run_id INTEGER NOT NULL,
+        seen_at REAL NOT NULL,
+        order_id INTEGER NOT NULL,
+        tbl TEXT NOT NULL,
+        field TEXT NOT NULL,
+        row_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        mysql_value TEXT,
+        es_value TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_discrepancies_key ON discrepancies (order_id, tbl, field)",
+    "CREATE INDEX IF NOT EXISTS idx_discrepancies_seen ON discrepancies (seen_at)",
+    # 每个 (工单, 表, 字段, 行, 类型) 一条的当前状态，用于告警去重和未解决问题查询；
+    # idx_issues_open 覆盖按表、字段汇总未解决问题的查询
+    """CREATE TABLE IF NOT EXISTS issues (
+        order_id INTEGER NOT NULL,
+        tbl TEXT NOT NULL,
+        field TEXT NOT NULL,
+        row_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        mysql_value TEXT,
+        es_value TEXT,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        last_run INTEGER NOT NULL,
+        occurrences INTEGER NOT NULL,
+        alerted_at REAL,
+        resolved_at REAL,
+        PRIMARY KEY (order_id, tbl, field, row_id, type)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_issues_open ON issues (status, tbl, field, last_seen, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_issues_run ON issues (last_run)",
+    # 客户级问题（CUSTOMER_TABLES），每个 (客户, 表, 字段, 行, 类型) 一条，order_id为最近一次比较该客户时所在的工单
+    """CREATE TABLE IF NOT EXISTS customer_issues (
+        customer_id TEXT NOT NULL,
+        tbl TEXT NOT NULL,
+        field TEXT NOT NULL,
+        row_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        order_id INTEGER NOT NULL,
+        mysql_value TEXT,
+        es_value TEXT,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        last_run INTEGER NOT NULL,
+        occurrences INTEGER NOT NULL,
+        alerted_at REAL,
+        resolved_at REAL,
+        PRIMARY KEY (customer_id, tbl, field, row_id, type)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_customer_issues_open ON customer_issues (status, tbl, field, last_seen, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_customer_issues_run ON customer_issues (last_run)",
+)
+
+UPSERT_ISSUE = """
+    INSERT INTO issues (order_id, tbl, field, row_id, type, status, mysql_value, es_value,
+                        first_seen, last_seen, last_run, occurrences)
+    VALUES (?, ?, ?, ?, ?, 'open', ?, ?, ?, ?, ?, 1)
+    ON CONFLICT (order_id, tbl, field, row_id, type) DO UPDATE SET
+        mysql_value = excluded.mysql_value,
+        es_value = excluded.es_value,
+        last_seen = excluded.last_seen,
+        last_run = excluded.last_run,
+        occurrences = occurrences + 1,
+        first_seen = CASE WHEN status = 'open' THEN first_seen ELSE excluded.first_seen END,
+        alerted_at = CASE WHEN status = 'open' THEN alerted_at ELSE NULL END,
+        resolved_at = NULL,
+        status = 'open'
+"""
+
+UPSERT_CUSTOMER_ISSUE = """
+    INSERT INTO customer_issues (customer_id, order_id, tbl, field, row_id, type, status, mysql_value, es_value,
+                                 first_seen, last_seen, last_run, occurrences)
+    VALUES (?, ?, ?, ?, ?, ?, 'open', ?, ?, ?, ?, ?, 1)
+    ON CONFLICT (customer_id, tbl, field, row_id, type) DO UPDATE SET
+        order_id = excluded.order_id,
+        mysql_value = excluded.mysql_value,
+        es_value = excluded.es_value,
+        last_seen = excluded.last_seen,
+        last_run = excluded.last_run,
+        occurrences = occurrences + 1,
+        first_seen = CASE WHEN status = 'open' THEN first_seen ELSE excluded.first_seen END,
+        alerted_at = CASE WHEN status = 'open' THEN alerted_at ELSE NULL END,
+        resolved_at = NULL,
+        status = 'open'
+"""
+
+def to_text(value):
+    if value is None:
+        return None
+    return str(value)[:MAX_VALUE_LENGTH]
+
+def discrepancy_rows(main_table, order_id, discrepancies):
+    """把一个工单的差异列表展开为 (表, 字段, 行Id, 类型, MySQL值, ES值) 行，数据缺失的工单记在主表上"""
+    if not discrepancies:
+        return [(main_table, '', '', 'missing_order', None, None)]
+    rows = []
+    for disc in discrepancies:
+        disc_type = disc.get('type', 'value_mismatch')
+        if disc_type == 'count_mismatch':
+            mysql_value, es_value = disc.get('mysql_count'), disc.get('es_count')
+        else:
+            mysql_value, es_value = disc.get('mysql_value'), disc.get('es_value')
+        # JSON字段的差异按路径记录，如 BussinessJson.a.b
+        field = disc.get('field', '') + (disc['path'][1:] if disc.get('path') else '')
+        rows.append((disc['table'], field, str(disc.get('id', '')), disc_type,
+                     to_text(mysql_value), to_text(es_value)))
+    return rows
+
+class DiscrepancyHistory:
+    """本地差异历史库
+    
+    每轮检查在一个事务内批量写入：追加本轮观察到的差异，按 (工单, 表, 字段, 行, 类型) 更新问题状态，
+    本轮比较一致的工单和不再出现的差异标记为已解决。客户特殊配置每轮只在每个客户的一个工单上比较，
+    其问题按 (客户, 表, 字段, 行, 类型) 跟踪，只有本轮比较过该客户时才会解决。告警只包含有新问题的工单，
+    已知未解决的问题在realert_seconds之后才再次提醒。观察记录和已解决的问题按保留天数清理。
+    """
+    
+    def __init__(self, path, retention_days=30, realert_seconds=86400):
+        """打开（必要时创建）历史库
+        
+        Args:
+            path: SQLite数据库文件路径
+            retention_days: 观察记录和已解决问题的保留天数
+            realert_seconds: 未解决的问题再次告警的间隔（秒），0为不再告警
+        """
+        self.path = path
+        self.retention_days = retention_days
+        self.realert_seconds = realert_seconds
+        self.prune_interval = 3600  # 两次清理之间的最短间隔（秒）
+        self.last_prune = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+    
+    def record(self, main_table, results, customers=None):
+        """写入一轮检查结果，返回需要告警的工单ID集合
+        
+        Args:
+            main_table: 主表名
+            results: 工单ID -> (是否一致, 差异列表)，不应包含等待复查的工单
+            customers: 工单ID -> 客户ID，本轮在该工单上比较了该客户的特殊配置
+        """
+        now = time.time()
+        customers = {order_id: customer_id for order_id, customer_id in (customers or {}).items()
+                     if order_id in results}
+        observations = []
+        customer_observations = []
+        for order_id, (is_consistent, discrepancies) in results.items():
+            if is_consistent:
+                continue
+            customer_id = customers.get(order_id)
+            for row in discrepancy_rows(main_table, order_id, discrepancies):
+                if row[0] in CUSTOMER_TABLES and customer_id is not None:
+                    customer_observations.append((str(customer_id), order_id) + row)
+                else:
+                    observations.append((order_id,) + row)
+        inconsistent_ids = {observation[0] for observation in observations}
+        inconsistent_ids.update(observation[1] for observation in customer_observations)
+        # 比较失败（compare_error）的表本轮没有比较，其已有问题不能因为没有再次出现而解决
+        failed_tables = {(observation[0], observation[1]) for observation in observations
+                         if observation[4] == 'compare_error'}
+        failed_customers = {observation[0] for observation in customer_observations
+                            if observation[5] == 'compare_error'}
+        
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("INSERT INTO runs (started_at, orders, inconsistent) VALUES (?, ?, ?)",
+                           (now, len(results), len(inconsistent_ids)))
+            run_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO discrepancies (run_id, seen_at, order_id, tbl, field, row_id, type, mysql_value, es_value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, now) + observation for observation in observations]
+                + [(run_id, now) + observation[1:] for observation in customer_observations]
+            )
+            cursor.executemany(
+                UPSERT_ISSUE,
+                [observation + (now, now, run_id) for observation in observations]
+            )
+            cursor.executemany(
+                UPSERT_CUSTOMER_ISSUE,
+                [observation + (now, now, run_id) for observation in customer_observations]
+            )
+            # 本轮检查过的工单中，没有再次出现的问题（含一致工单的全部问题）标记为已解决，用一条语句批量完成；
+            # 客户级问题只在本轮比较过该客户时解决，跳过比较的工单不影响它们
+            placeholders = ', '.join('?' * len(CUSTOMER_TABLES))
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS run_orders (order_id PRIMARY KEY)")
+            cursor.execute("DELETE FROM run_orders")
+            cursor.executemany("INSERT OR IGNORE INTO run_orders (order_id) VALUES (?)",
+                               [(order_id,) for order_id in results])
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS run_failed (order_id, tbl, PRIMARY KEY (order_id, tbl))")
+            cursor.execute("DELETE FROM run_failed")
+            cursor.executemany("INSERT OR IGNORE INTO run_failed (order_id, tbl) VALUES (?, ?)", failed_tables)
+            cursor.execute(
+                f"UPDATE issues SET status = 'resolved', resolved_at = ? "
+                f"WHERE status = 'open' AND last_run <> ? AND order_id IN (SELECT order_id FROM run_orders) "
+                f"AND tbl NOT IN ({placeholders}) AND NOT EXISTS ("
+                f"SELECT 1 FROM run_failed WHERE run_failed.order_id = issues.order_id AND run_failed.tbl = issues.tbl)",
+                (now, run_id) + CUSTOMER_TABLES
+            )
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS run_customers (customer_id PRIMARY KEY)")
+            cursor.execute("DELETE FROM run_customers")
+            cursor.executemany("INSERT OR IGNORE INTO run_customers (customer_id) VALUES (?)",
+                               [(str(customer_id),) for customer_id in customers.values()
+                                if str(customer_id) not in failed_customers])
+            cursor.execute(
+                "UPDATE customer_issues SET status = 'resolved', resolved_at = ? "
+                "WHERE status = 'open' AND last_run <> ? AND customer_id IN (SELECT customer_id FROM run_customers)",
+                (now, run_id)
+            )
+            # 有新问题或到了再次提醒时间的工单需要告警，客户级问题算在本轮比较该客户的工单上
+            realert_before = now - self.realert_seconds if self.realert_seconds > 0 else 0
+            condition = "last_run = ? AND (alerted_at IS NULL OR alerted_at < ?)"
+            alert_ids = set()
+            for table in ('issues', 'customer_issues'):
+                cursor.execute(f"SELECT DISTINCT order_id FROM {table} WHERE {condition}", (run_id, realert_before))
+                alert_ids.update(row[0] for row in cursor.fetchall())
+                cursor.execute(f"UPDATE {table} SET alerted_at = ? WHERE {condition}", (now, run_id, realert_before))
+            # 数字字符串形式的工单ID在库中按整数保存，换回调用方传入的形式
+            lookup = {str(order_id): order_id for order_id in inconsistent_ids}
+            alert_ids = {lookup.get(str(order_id), order_id) for order_id in alert_ids}
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        
+        if now - self.last_prune >= self.prune_interval:
+            self.prune(now)
+        return alert_ids
+    
+    def prune(self, now=None):
+        """删除超过保留天数的观察记录、检查记录和已解决的问题"""
+        now = time.time() if now is None else now
+        self.last_prune = now
+        if self.retention_days <= 0:
+            return
+        cutoff = now - self.retention_days * 86400
+        with self.conn:
+            # 按seen_at/resolved_at索引删除
+            deleted = self.conn.execute("DELETE FROM discrepancies WHERE seen_at < ?", (cutoff,)).rowcount
+            self.conn.execute("DELETE FROM runs WHERE started_at < ?", (cutoff,))
+            for table in ('issues', 'customer_issues'):
+                deleted += self.conn.execute(
+                    f"DELETE FROM {table} WHERE status = 'resolved' AND resolved_at < ?", (cutoff,)
+                ).rowcount
+        if deleted:
+            logger.info(f"差异历史库清理了 {deleted} 条 {self.retention_days} 天前的记录")
+    
+    def open_by_table(self, days=7):
+        """最近days天内仍出现过的未解决问题，按表和字段汇总，返回 [(表, 字段, 问题数, 工单数)]
+        
+        客户级问题的工单数为最近一次比较该客户时所在的工单数。
+        """
+        since = time.time() - days * 86400
+        return self.conn.execute(
+            "SELECT tbl, field, COUNT(*), COUNT(DISTINCT order_id) FROM ("
+            "SELECT tbl, field, order_id FROM issues WHERE status = 'open' AND last_seen >= ? "
+            "UNION ALL "
+            "SELECT tbl, field, order_id FROM customer_issues WHERE status = 'open' AND last_seen >= ?"
+            ") GROUP BY tbl, field ORDER BY COUNT(*) DESC",
+            (since, since)
+        ).fetchall()
+    
+    def order_history(self, order_id, limit=100):
+        """一个工单最近的差异记录，返回 [(时间, 表, 字段, 行Id, 类型, MySQL值, ES值)]"""
+        return self.conn.execute(
+            "SELECT seen_at, tbl, field, row_id, type, mysql_value, es_value FROM discrepancies "
+            "WHERE order_id = ? ORDER BY seen_at DESC LIMIT ?",
+            (order_id, limit)
+        ).fetchall()
+    
+    def close(self):
+        try:
+            self.conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"关闭差异历史库失败: {str(e)}")
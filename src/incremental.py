@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 增量检查模块：基于更新时间水位，只检查上次运行以来变更过的工单
+
+import os
+import json
+from datetime import datetime, timedelta
+from loguru import logger
+from config import STATE_DIR
+
+# 判断变更时间的候选字段，按优先级排列
+CHANGE_COLUMNS = ('UpdatedAt', 'LastUpdateTimeStamp', 'InsertTime', 'CreatedAt')
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class WatermarkStore:
+    """本地水位文件，记录上次增量检查覆盖到的变更时间，有积压时另记该时间上已检查到的工单ID"""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def load(self):
+        """读取水位，返回 (水位, 是否有积压, 积压游标工单ID)，不存在或损坏时返回 (None, False, None)
+        
+        旧版本水位文件只记录了backlog，没有游标工单ID，此时从水位处（含）继续
+        """
+        if not os.path.exists(self.path):
+            return None, False, None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return (datetime.strptime(state['watermark'], TIME_FORMAT), bool(state.get('backlog')),
+                    state.get('last_order_id'))
+        except Exception as e:
+            logger.warning(f"读取增量检查水位文件失败，将重新初始化: {str(e)}")
+            return None, False, None
+    
+    def save(self, watermark, last_order_id=None):
+        """写入水位（先写临时文件再替换，避免中途退出损坏文件）
+        
+        Args:
+            watermark: 已检查到的变更时间
+            last_order_id: 上个周期因数量上限没有检查完时，水位这一时间上已检查到的最大工单ID，
+                下次从 (水位, 工单ID) 之后继续而不再回看；为None表示没有积压
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'watermark': watermark.strftime(TIME_FORMAT),
+                'backlog': last_order_id is not None,
+                'last_order_id': last_order_id,
+                'saved_at': datetime.now().strftime(TIME_FORMAT)
+            }, f)
+        os.replace(tmp_path, self.path)
+
+class IncrementalChecker:
+    """增量检查：每个周期只检查水位之后变更过的工单
+    
+    主表和各子表（含tb_operatinginfo）的变更时间字段合并为一条UNION查询，
+    子表变更也会让所属工单进入本次检查。每周期最多检查max_orders条，
+    超出部分留到下个周期，水位只推进到本次实际覆盖的 (变更时间, 工单ID) 位置，
+    同一秒内变更的工单超过上限时也能逐批向后推进。
+    """
+    
+    def __init__(self, checker, state_file=None, overlap_seconds=60, delay_seconds=30,
+                 max_orders=5000, initial_lookback_minutes=60):
+        """初始化增量检查
+        
+        Args:
+            checker: DataChecker实例
+            state_file: 水位文件路径，默认放在状态目录下
+            overlap_seconds: 每次向前多回看的秒数，覆盖延迟提交的事务
+            delay_seconds: 最近这段时间内的变更留到下个周期，给同步留出时间
+            max_orders: 每个周期最多检查的工单数
+            initial_lookback_minutes: 没有水位时首次回看的分钟数
+        """
+        self.checker = checker
+        self.store = WatermarkStore(state_file or os.path.join(STATE_DIR, 'incremental_watermark.json'))
+        self.overlap_seconds = overlap_seconds
+        self.delay_seconds = delay_seconds
+        self.max_orders = max(1, max_orders)
+        self.initial_lookback_minutes = initial_lookback_minutes
+    
+    def change_sources(self):
+        """返回 (表名, 工单键字段, 变更时间字段) 列表"""
+        sources = []
+        tables = list(self.checker.table_mappings.items())
+        tables.append(('tb_operatinginfo', self.checker.special_tables['tb_operatinginfo']))
+        for table_name, mapping in tables:
+            # 按映射中定义的全部字段判断，不受比较时排除字段的影响
+            fields = {mysql_field for mysql_field, _ in self.checker.defined_fields[table_name]}
+            column = next((column for column in CHANGE_COLUMNS if column in fields), None)
+            if column is None:
+                logger.debug(f"表 {table_name} 没有变更时间字段，增量检查忽略该表")
+                continue
+            key = 'Id' if mapping.get('es_path') == "" else mapping['id_field']
+            sources.append((table_name, key, column))
+        return sources
+    
+    def select_changed_orders(self):
+        """查询变更过的工单，返回 (工单ID列表, 新水位, 积压游标工单ID)，没有积压时游标为None"""
+        with self.checker.db_connector.mysql_cursor() as cursor:
+            cursor.execute("SELECT NOW() - INTERVAL %s SECOND AS upper_bound", (self.delay_seconds,))
+            upper = cursor.fetchone()['upper_bound']
+            if isinstance(upper, str):
+                upper = datetime.strptime(upper[:19], TIME_FORMAT)
+            
+            watermark, backlog, last_order_id = self.store.load()
+            if watermark is None:
+                lower = upper - timedelta(minutes=self.initial_lookback_minutes)
+                logger.info(f"未找到增量检查水位，首次回看 {self.initial_lookback_minutes} 分钟")
+            elif backlog:
+                # 继续处理积压时从水位处接着查，回看会导致每个周期重复同一批工单
+                lower = watermark
+            else:
+                lower = watermark - timedelta(seconds=self.overlap_seconds)
+            
+            if lower >= upper:
+                return [], None, None
+            
+            parts = []
+            params = []
+            for table_name, key, column in self.change_sources():
+                parts.append(f"SELECT {key} AS order_id, {column} AS changed_at FROM {table_name} "
+                             f"WHERE {column} >= %s AND {column} < %s")
+                params.extend((lower, upper))
+            
+            having = ""
+            if backlog and last_order_id is not None:
+                # 按 (变更时间, 工单ID) 游标继续，跳过水位这一时间上已检查过的工单
+                having = "HAVING MAX(changed_at) > %s OR order_id > %s "
+                params.extend((lower, last_order_id))
+            
+            sql = (f"SELECT order_id, MAX(changed_at) AS last_changed FROM ({' UNION ALL '.join(parts)}) changed "
+                   f"GROUP BY order_id {having}ORDER BY last_changed, order_id LIMIT %s")
+            params.append(self.max_orders + 1)
+            cursor.execute(sql, tuple(params))
+            rows = cursor.fetchall()
+        
+        if len(rows) > self.max_orders:
+            # 超出上限，只检查最早的一批，游标推进到这批最后一条的 (变更时间, 工单ID)
+            rows = rows[:self.max_orders]
+            new_watermark = rows[-1]['last_changed']
+            if isinstance(new_watermark, str):
+                new_watermark = datetime.strptime(new_watermark[:19], TIME_FORMAT)
+            logger.warning(f"变更工单超过单周期上限 {self.max_orders}，剩余部分留到下个周期")
+            return [row['order_id'] for row in rows], new_watermark, rows[-1]['order_id']
+        
+        return [row['order_id'] for row in rows], upper, None
+    
+    def run(self):
+        """执行一次增量检查，检查完成后推进水位"""
+        order_ids, new_watermark, last_order_id = self.select_changed_orders()
+        if not order_ids:
+            logger.info("自上次增量检查以来没有工单变更")
+            if new_watermark is not None:
+                self.store.save(new_watermark)
+            return True
+        
+        logger.info(f"增量检查: 发现 {len(order_ids)} 条变更工单")
+        result = self.checker.check_consistency(order_ids)
+        self.store.save(new_watermark, last_order_id)
+        return result
+
+def create_incremental_checker(checker):
+    """根据配置创建增量检查器"""
+    check = checker.settings.check
+    state_file = check.incremental_state_file.strip()
+    return IncrementalChecker(
+        checker,
+        state_file=os.path.join(STATE_DIR, state_file) if state_file else None,
+        overlap_seconds=check.incremental_overlap_seconds,
+        delay_seconds=check.incremental_delay_seconds,
+        max_orders=check.incremental_max_orders,
+        initial_lookback_minutes=check.incremental_initial_lookback_minutes
+    )
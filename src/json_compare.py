@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# JSON字段比较模块：按结构比较JSON字段（忽略键顺序和空白），解析结果按内容哈希缓存，差异按路径报告
+
+import json
+import hashlib
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时使用标准库json，结果相同，只是更慢
+    orjson = None
+
+# 一个字段最多报告的路径差异数
+MAX_PATH_DIFFS = 50
+
+# JSON中不存在的键或数组元素
+MISSING = '<缺失>'
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def canonical_dumps(value):
+    """键排序、无空白的规范化JSON文本"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode('utf-8')
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def json_diff(mysql_value, es_value, path='$', diffs=None):
+    """逐层比较两个已解析的JSON值，返回 [(路径, MySQL值, ES值)]，最多MAX_PATH_DIFFS条"""
+    diffs = [] if diffs is None else diffs
+    if len(diffs) >= MAX_PATH_DIFFS:
+        return diffs
+    if isinstance(mysql_value, dict) and isinstance(es_value, dict):
+        for key in sorted(mysql_value.keys() | es_value.keys()):
+            json_diff(mysql_value.get(key, MISSING), es_value.get(key, MISSING), f"{path}.{key}", diffs)
+    elif isinstance(mysql_value, list) and isinstance(es_value, list):
+        for position in range(max(len(mysql_value), len(es_value))):
+            json_diff(mysql_value[position] if position < len(mysql_value) else MISSING,
+                      es_value[position] if position < len(es_value) else MISSING, f"{path}[{position}]", diffs)
+    elif mysql_value != es_value or (type(mysql_value) is bool) != (type(es_value) is bool):
+        # 1与1.0视为相同，true与1不同
+        diffs.append((path, mysql_value, es_value))
+    return diffs
+
+class JsonFieldComparator:
+    """JSON字段结构比较
+    
+    MySQL侧是JSON文本，ES侧可能是文本也可能是对象。文本用orjson（未安装时用json）解析，
+    解析结果和规范化文本按内容哈希放入LRU缓存，同一内容在多个周期、多次比较中只解析一次；
+    ES侧的对象直接规范化。规范化文本相同即一致；不同时再按解析结果逐层比较，报告每个不同的路径。
+    不是合法JSON的值按原始文本比较。
+    """
+    
+    def __init__(self, cache_size=10000):
+        """初始化JSON比较器
+        
+        Args:
+            cache_size: 最多缓存的解析结果数
+        """
+        self.cache_size = max(0, cache_size)
+        self.cache = OrderedDict()  # 内容哈希 -> (解析结果, 规范化文本)，不是合法JSON时为 (None, None)
+        self.stats = {'hits': 0, 'parsed': 0}
+    
+    def parse(self, value):
+        """返回 (解析结果, 规范化文本)，不是合法JSON时规范化文本为None"""
+        if isinstance(value, (dict, list)):
+            return value, canonical_dumps(value)
+        if isinstance(value, str):
+            data = value.encode('utf-8')
+        elif isinstance(value, bytes):
+            data = value
+        else:
+            return value, None
+        
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+        
+        self.stats['parsed'] += 1
+        try:
+            parsed = loads(data)
+            entry = (parsed, canonical_dumps(parsed))
+        except ValueError:
+            entry = (None, None)
+        if self.cache_size:
+            self.cache[key] = entry
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return entry
+    
+    def canonical(self, value):
+        """规范化文本，用于整列比较；不是合法JSON时返回原值的文本"""
+        if value is None or value == "":
+            return None
+        canonical = self.parse(value)[1]
+        if canonical is None:
+            return value.decode('utf-8', errors='ignore') if isinstance(value, bytes) else str(value)
+        return canonical
+    
+    def equal(self, mysql_value, es_value):
+        """两侧的值按JSON结构是否一致（规范化文本不同时再逐层比较，如1与1.0）"""
+        if self.canonical(mysql_value) == self.canonical(es_value):
+            return True
+        return not self.diff(mysql_value, es_value)
+    
+    def diff(self, mysql_value, es_value):
+        """按路径列出不一致，返回 [(路径, MySQL值, ES值)]；任一侧不是合法JSON时返回整个值的差异"""
+        mysql_parsed, mysql_canonical = self.parse(mysql_value) if mysql_value not in (None, "") else (None, 'null')
+        es_parsed, es_canonical = self.parse(es_value) if es_value not in (None, "") else (None, 'null')
+        if mysql_canonical is None or es_canonical is None:
+            return [('$', mysql_value, es_value)]
+        return json_diff(mysql_parsed, es_parsed)
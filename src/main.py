@@ -2,76 +2,333 @@
 # -*- coding:utf-8 -*-
 # 主程序入口
 
+import os
 import sys
+import json
 import time
 import argparse
 from loguru import logger
 from data_checker import DataChecker
-from config import load_config
+from async_engine import AsyncCheckEngine
+from full_reconcile import FullReconciler
+from parallel_reconcile import ParallelReconciler
+from range_checksum import RangeChecksumEngine
+from incremental import create_incremental_checker
+from history import DiscrepancyHistory
+from config import get_settings, set_overrides, reload_settings_if_changed, rollback_settings, STATE_DIR
+import metrics
 
-def run_check():
-    """执行一次数据一致性检查"""
+# 延迟复查出错后重试的间隔（秒）
+RECHECK_RETRY_SECONDS = 60
+
+def export_metrics(settings=None):
+    """配置了textfile_path时把当前指标写入textfile collector文件"""
+    settings = settings or get_settings()
+    if settings and settings.metrics.textfile_path.strip():
+        metrics.write_textfile(settings.metrics.textfile_path.strip())
+
+@metrics.track_cycle('sample')
+def run_check(checker=None):
+    """执行一次数据一致性检查
+    
+    Args:
+        checker: 复用的数据检查器，为空时新建一个并在检查结束后关闭连接
+    """
+    own_checker = checker is None
     try:
         # 初始化数据检查器
-        checker = DataChecker()
+        if own_checker:
+            checker = DataChecker()
         
-        # 执行检查
-        result = checker.check_consistency()
+        # 执行检查（开启异步引擎时所有抽样工单在并发限制内同时检查）
+        check = checker.settings.check
+        if check.async_mode:
+            result = AsyncCheckEngine(checker, check.async_concurrency, check.async_mysql_pool_size).run()
+        else:
+            result = checker.check_consistency()
         
         # 返回检查结果
         return result
     except Exception as e:
         logger.error(f"数据一致性检查过程中发生错误: {str(e)}")
         return False
+    finally:
+        if own_checker and checker is not None:
+            checker.close()
+
+@metrics.track_cycle('incremental')
+def run_incremental(checker=None, incremental=None):
+    """执行一次增量检查，只检查上次检查以来变更过的工单
+    
+    Args:
+        checker: 复用的数据检查器，为空时新建一个并在检查结束后关闭连接
+        incremental: 复用的增量检查器，为空时根据配置新建
+    """
+    own_checker = checker is None
+    try:
+        if own_checker:
+            checker = DataChecker()
+        if incremental is None:
+            incremental = create_incremental_checker(checker)
+        return incremental.run()
+    except Exception as e:
+        logger.error(f"增量检查过程中发生错误: {str(e)}")
+        return False
+    finally:
+        if own_checker and checker is not None:
+            checker.close()
+
+@metrics.track_cycle('full')
+def run_full(start_id=None, end_id=None, since=None):
+    """执行一次全量对账"""
+    checker = None
+    try:
+        checker = DataChecker()
+        check = checker.settings.check
+        if check.full_workers != 1:
+            # 多进程按Id区间并行对账
+            reconciler = ParallelReconciler(checker, start_id=start_id, end_id=end_id, since=since,
+                                            workers=check.full_workers,
+                                            partitions_per_worker=check.full_partitions_per_worker)
+        else:
+            reconciler = FullReconciler(checker, start_id=start_id, end_id=end_id, since=since)
+        return reconciler.run()
+    except Exception as e:
+        logger.error(f"全量对账过程中发生错误: {str(e)}")
+        return False
+    finally:
+        if checker is not None:
+            checker.close()
+
+@metrics.track_cycle('checksum')
+def run_checksum(start_id=None, end_id=None):
+    """执行一次区间校验和比对"""
+    checker = None
+    try:
+        checker = DataChecker()
+        check = checker.settings.check
+        engine = RangeChecksumEngine(
+            checker,
+            fanout=check.checksum_fanout,
+            leaf_size=check.checksum_leaf_size,
+            stored_field=check.es_checksum_field.strip() or None
+        )
+        return engine.run(start_id, end_id)
+    except Exception as e:
+        logger.error(f"区间校验和比对过程中发生错误: {str(e)}")
+        return False
+    finally:
+        if checker is not None:
+            checker.close()
 
-def run_service():
-    """作为服务运行，定期执行检查"""
-    config = load_config()
-    if not config:
+def show_open_issues(days):
+    """输出差异历史库中最近days天内仍未解决的不一致，按表和字段汇总"""
+    settings = get_settings()
+    if not settings:
+        return False
+    history_file = settings.check.history_file.strip()
+    if not history_file:
+        logger.error("未配置差异历史库(history_file)")
+        return False
+    
+    history = DiscrepancyHistory(os.path.join(STATE_DIR, history_file))
+    try:
+        rows = history.open_by_table(days)
+    finally:
+        history.close()
+    
+    print(f"最近 {days} 天内未解决的不一致：")
+    print(f"{'表':<32}{'字段':<28}{'问题数':>8}{'工单数':>8}")
+    for table_name, field, issues, orders in rows:
+        print(f"{table_name:<32}{field or '-':<28}{issues:>8}{orders:>8}")
+    if not rows:
+        print("无")
+    return True
+
+def dump_mappings():
+    """按表映射文件的格式输出当前使用的表映射（不含字段排除），可作为table_mappings_file的起点"""
+    checker = DataChecker()
+    try:
+        table_mappings = {}
+        for table_name, mapping in checker.table_mappings.items():
+            item = {'es_path': mapping['es_path'], 'id_field': mapping['id_field']}
+            if mapping.get('json_fields'):
+                item['json_fields'] = list(mapping['json_fields'])
+            item['fields'] = [list(pair) for pair in checker.defined_fields[table_name]]
+            table_mappings[table_name] = item
+        special_tables = {
+            table_name: {'fields': [list(pair) for pair in checker.defined_fields[table_name]]}
+            for table_name in checker.special_tables
+        }
+        print(json.dumps({'table_mappings': table_mappings, 'special_tables': special_tables},
+                         ensure_ascii=False, indent=2))
+    finally:
+        checker.close()
+    return True
+
+def wait_for_next_cycle(checker):
+    """等待检查间隔，期间定期检查配置文件（修改后热加载），并执行到期的延迟复查
+    
+    Args:
+        checker: 数据检查器，热加载的配置直接应用到它上面
+    
+    Returns:
+        bool: 等待期间是否重新加载了配置
+    """
+    started_at = time.monotonic()
+    reloaded = False
+    # 复查出错后暂停到该时间再重试，避免到期工单一直到期导致空转
+    recheck_paused_until = 0
+    while True:
+        # 检查间隔可能随配置热加载变化，每次都按当前配置计算剩余时间
+        check = checker.settings.check
+        remaining = started_at + check.check_interval - time.monotonic()
+        if remaining <= 0:
+            return reloaded
+        
+        wait = remaining
+        if check.config_reload_interval > 0:
+            wait = min(wait, check.config_reload_interval)
+        next_recheck = checker.recheck.next_due() if checker.recheck is not None else None
+        if next_recheck is not None:
+            next_recheck = max(next_recheck, recheck_paused_until)
+            wait = min(wait, max(0, next_recheck - time.time()))
+        time.sleep(wait)
+        
+        if next_recheck is not None and next_recheck <= time.time():
+            try:
+                checker.process_rechecks()
+            except Exception as e:
+                logger.error(f"延迟复查过程中发生错误，{RECHECK_RETRY_SECONDS}秒后重试: {str(e)}")
+                recheck_paused_until = time.time() + RECHECK_RETRY_SECONDS
+        
+        if check.config_reload_interval <= 0:
+            continue
+        settings = reload_settings_if_changed()
+        if settings is None:
+            continue
+        current = checker.settings
+        try:
+            checker.apply_settings(settings)
+        except Exception as e:
+            # 新配置只应用了一部分，恢复原配置；该版本的配置文件修改后才会再次加载
+            logger.error(f"应用新配置时发生错误，继续使用原配置: {str(e)}")
+            rollback_settings(current, settings)
+            try:
+                checker.apply_settings(current)
+            except Exception as e:
+                logger.error(f"恢复原配置时发生错误: {str(e)}")
+            continue
+        reloaded = True
+        logger.info(f"已应用新配置，抽样数量: {settings.check.sample_size}，"
+                    f"检查间隔: {settings.check.check_interval}秒")
+
+def run_service(incremental=False):
+    """作为服务运行，定期执行检查
+    
+    配置文件只在启动时解析一次，之后按config_reload_interval检查修改时间，
+    修改后热加载抽样数量、检查间隔等检查参数，不重建数据库连接。
+    
+    Args:
+        incremental: 是否每个周期执行增量检查而不是随机抽样检查
+    """
+    settings = get_settings()
+    if not settings:
         logger.error("配置加载失败，无法启动服务")
         return
     
-    # 获取检查间隔时间(秒)
-    check_interval = int(config.get('check', 'check_interval'))
-    
-    logger.info(f"数据一致性检查服务已启动，检查间隔: {check_interval}秒")
+    logger.info(f"数据一致性检查服务已启动，检查间隔: {settings.check.check_interval}秒")
     
+    # 整个服务进程复用同一个检查器，连接池和ES客户端在各检查周期间保持
+    checker = None
+    metrics_server = None
     try:
+        if settings.metrics.http_port > 0:
+            try:
+                metrics_server = metrics.MetricsServer(settings.metrics.http_host, settings.metrics.http_port).start()
+            except OSError as e:
+                logger.error(f"指标端点启动失败，继续运行但不提供/metrics: {str(e)}")
+        checker = DataChecker(settings)
+        incremental_checker = create_incremental_checker(checker) if incremental else None
         while True:
             # 执行检查
-            run_check()
+            if incremental_checker:
+                run_incremental(checker, incremental_checker)
+            else:
+                run_check(checker)
+            export_metrics(checker.settings)
             
             # 等待下一次检查
-            logger.info(f"等待 {check_interval} 秒后进行下一次检查...")
-            time.sleep(check_interval)
+            logger.info(f"等待 {checker.settings.check.check_interval} 秒后进行下一次检查...")
+            if wait_for_next_cycle(checker) and incremental_checker:
+                incremental_checker = create_incremental_checker(checker)
     except KeyboardInterrupt:
         logger.info("服务已手动停止")
     except Exception as e:
         logger.error(f"服务运行过程中发生错误: {str(e)}")
+    finally:
+        if checker is not None:
+            checker.close()
+        if metrics_server is not None:
+            metrics_server.stop()
 
 def main():
     """主程序入口"""
     parser = argparse.ArgumentParser(description="MySQL和ElasticSearch数据一致性检查工具")
     parser.add_argument("--service", action="store_true", help="作为服务运行，定期执行检查")
     parser.add_argument("--sample", type=int, help="指定抽样数量，覆盖配置文件")
+    parser.add_argument("--full", action="store_true", help="全量对账，检查范围内的全部工单")
+    parser.add_argument("--checksum", action="store_true", help="区间校验和比对，逐层定位不一致的工单")
+    parser.add_argument("--incremental", action="store_true", help="增量检查，只检查上次检查以来变更过的工单，可与--service同用")
+    parser.add_argument("--aggregate", action="store_true", help="抽样检查前先按日期、状态和AppCode比较两侧工单数，覆盖配置文件")
+    parser.add_argument("--repair", action="store_true", help="用MySQL数据重新写入确认不一致的工单，覆盖配置文件")
+    parser.add_argument("--repair-dry-run", action="store_true", help="只输出修复计划和修复前后的字段差异，不写入ES")
+    parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="抽样检查使用异步引擎（aiomysql + AsyncElasticsearch），覆盖配置文件")
+    parser.add_argument("--open-issues", type=int, nargs='?', const=7, metavar="DAYS",
+                        help="输出差异历史库中最近DAYS天（默认7天）内未解决的不一致，按表和字段汇总")
+    parser.add_argument("--dump-mappings", action="store_true",
+                        help="以JSON输出当前使用的表映射，可保存为table_mappings_file后修改")
+    parser.add_argument("--start-id", type=int, help="全量对账/区间校验的起始工单Id（含）")
+    parser.add_argument("--end-id", type=int, help="全量对账/区间校验的结束工单Id（含）")
+    parser.add_argument("--since", help="全量对账只检查该日期之后创建的工单，格式 YYYY-MM-DD")
+    parser.add_argument("--workers", type=int, help="全量对账的工作进程数，0为CPU核数，覆盖配置文件")
     
     args = parser.parse_args()
     
-    # 如果指定了抽样数量，更新配置
+    # 如果指定了抽样数量，只在本进程内覆盖配置，不修改配置文件
     if args.sample:
-        config = load_config()
-        if config:
-            config.set('check', 'sample_size', str(args.sample))
-            # 保存更新后的配置
-            with open(config.path, 'w') as f:
-                config.write(f)
-            logger.info(f"已更新抽样数量为: {args.sample}")
+        set_overrides('check', sample_size=args.sample)
+        logger.info(f"本次运行的抽样数量为: {args.sample}")
+    if args.aggregate:
+        set_overrides('check', aggregate_check=True)
+    if args.repair or args.repair_dry_run:
+        set_overrides('check', repair=True, repair_dry_run=args.repair_dry_run)
+    if args.async_mode:
+        set_overrides('check', async_mode=True)
+    if args.workers is not None:
+        set_overrides('check', full_workers=args.workers)
     
     # 决定运行模式
-    if args.service:
-        run_service()
+    if args.open_issues is not None:
+        show_open_issues(args.open_issues)
+        return
+    if args.dump_mappings:
+        dump_mappings()
+        return
+    if args.full:
+        run_full(args.start_id, args.end_id, args.since)
+    elif args.checksum:
+        run_checksum(args.start_id, args.end_id)
+    elif args.service:
+        run_service(incremental=args.incremental)
+    elif args.incremental:
+        run_incremental()
     else:
         run_check()
+    
+    if not args.service:
+        export_metrics()
 
 if __name__ == "__main__":
     main()
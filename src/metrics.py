@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 运行指标模块：各阶段耗时直方图、查询与差异计数，按Prometheus文本格式输出
+
+import os
+import time
+import threading
+import functools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from loguru import logger
+
+# 耗时直方图的桶上限（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def escape_label(value):
+    """转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{escape_label(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    """带标签的指标基类，各标签组合的值保存在字典中"""
+    
+    kind = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self.render_sample(key, value))
+        return lines
+    
+    def render_sample(self, key, value):
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"]
+
+class Counter(Metric):
+    """只增不减的计数器"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            # 无标签的计数器从0开始输出，便于计算rate
+            self.values[()] = 0
+    
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """可任意设置的数值"""
+    
+    kind = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class Histogram(Metric):
+    """累积桶直方图"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+    
+    def time(self, **labels):
+        """计时上下文，退出时记录耗时（异常退出也记录）"""
+        return Timer(self, labels)
+    
+    def render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            labels = format_labels(self.labelnames, key, (('le', format_value(bound)),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+class Registry:
+    """指标集合"""
+    
+    def __init__(self):
+        self.metrics = []
+    
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+    
+    def render(self):
+        """按Prometheus文本格式(0.0.4)输出全部指标"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'esdatacheck_stage_duration_seconds',
+    '各阶段每次调用的耗时（sample/aggregate/mysql_fetch/es_fetch/mysql_digest/es_digest/compare/repair/alert）',
+    ['stage']
+))
+CYCLE_SECONDS = REGISTRY.register(Histogram(
+    'esdatacheck_cycle_duration_seconds', '一次完整检查的耗时', ['mode']
+))
+CYCLE_LAST_SUCCESS = REGISTRY.register(Gauge(
+    'esdatacheck_last_cycle_success', '最近一次检查是否全部一致且没有出错（1/0）', ['mode']
+))
+CYCLE_LAST_TIMESTAMP = REGISTRY.register(Gauge(
+    'esdatacheck_last_cycle_timestamp_seconds', '最近一次检查结束的Unix时间', ['mode']
+))
+QUERIES = REGISTRY.register(Counter(
+    'esdatacheck_queries_total', '发往MySQL/ElasticSearch的查询次数', ['backend']
+))
+QUERY_ERRORS = REGISTRY.register(Counter(
+    'esdatacheck_query_errors_total', '执行失败的查询次数', ['backend']
+))
+FETCHED_BYTES = REGISTRY.register(Counter(
+    'esdatacheck_fetched_bytes_total',
+    '读取的数据量（ES为响应体字节数，MySQL为结果行字段值长度之和的估算）', ['backend']
+))
+ORDERS_COMPARED = REGISTRY.register(Counter(
+    'esdatacheck_orders_compared_total', '逐字段比较过的工单数'
+))
+ORDERS_INCONSISTENT = REGISTRY.register(Counter(
+    'esdatacheck_orders_inconsistent_total', '比较结果不一致的工单数'
+))
+DISCREPANCIES = REGISTRY.register(Counter(
+    'esdatacheck_discrepancies_total', '按表、字段和类型统计的差异数', ['table', 'field', 'type']
+))
+LAST_CHECK_ORDERS = REGISTRY.register(Gauge(
+    'esdatacheck_last_check_orders', '最近一次抽样/增量检查的工单数'
+))
+LAST_CHECK_INCONSISTENT = REGISTRY.register(Gauge(
+    'esdatacheck_last_check_inconsistent_orders', '最近一次抽样/增量检查中不一致的工单数'
+))
+RECHECKS = REGISTRY.register(Counter(
+    'esdatacheck_rechecks_total', '延迟复查的处理结果（deferred/resolved/confirmed）', ['result']
+))
+AGGREGATE_DIFFERING_BUCKETS = REGISTRY.register(Gauge(
+    'esdatacheck_aggregate_differing_buckets', '最近一次聚合对账中工单数不一致的分组数'
+))
+REPAIRS = REGISTRY.register(Counter(
+    'esdatacheck_repairs_total', '修复模式写入/删除ES文档的结果（ok/failed）', ['result']
+))
+ALERT_MESSAGES = REGISTRY.register(Counter(
+    'esdatacheck_alert_messages_total', '企业微信消息发送结果（sent/failed/dropped）', ['result']
+))
+
+def timed(stage):
+    """方法装饰器：把每次调用的耗时记入STAGE_SECONDS"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage=stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def track_cycle(mode):
+    """检查入口装饰器：记录整次检查的耗时、结束时间和结果"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = False
+            try:
+                with CYCLE_SECONDS.time(mode=mode):
+                    result = func(*args, **kwargs)
+                return result
+            finally:
+                CYCLE_LAST_SUCCESS.set(1 if result else 0, mode=mode)
+                CYCLE_LAST_TIMESTAMP.set(time.time(), mode=mode)
+        return wrapper
+    return decorator
+
+def estimate_bytes(rows):
+    """估算结果行的数据量：字符串/字节按长度，其他值按8字节"""
+    size = 0
+    for row in rows:
+        for value in row.values():
+            kind = type(value)
+            size += len(value) if kind is str or kind is bytes else 8
+    return size
+
+def record_discrepancies(main_table, results):
+    """统计一批比较结果：比较工单数、不一致工单数、各表各字段的差异数
+    
+    Args:
+        main_table: 主表名，数据缺失的工单记在主表上
+        results: 工单ID -> (是否一致, 差异列表)
+    """
+    ORDERS_COMPARED.inc(len(results))
+    for is_consistent, discrepancies in results.values():
+        if is_consistent:
+            continue
+        ORDERS_INCONSISTENT.inc()
+        if not discrepancies:
+            DISCREPANCIES.inc(table=main_table, field='', type='missing_order')
+        for disc in discrepancies:
+            DISCREPANCIES.inc(table=disc['table'], field=disc.get('field', ''),
+                              type=disc.get('type', 'value_mismatch'))
+
+def write_textfile(path):
+    """把指标写入textfile collector读取的文件（先写临时文件再替换）"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(REGISTRY.render())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"写入指标文件 {path} 失败: {str(e)}")
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """只提供 GET /metrics"""
+    
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer:
+    """在后台线程中提供/metrics端点"""
+    
+    def __init__(self, host='0.0.0.0', port=9108):
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True)
+    
+    def start(self):
+        self.thread.start()
+        logger.info(f"指标端点已启动: http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/metrics")
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
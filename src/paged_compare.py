@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 大集合分页比较模块：行数超过分页大小的operating日志和客户特殊配置，两侧按Id分页读取后归并比较
+
+from loguru import logger
+from full_reconcile import id_key
+
+# 工单数据中记录需要分页比较的特殊表的键（MySQL数据和ES文档中相同）
+PAGED_KEY = 'paged_tables'
+
+# 一个集合最多记录的差异数，超出后只计数
+MAX_DISCREPANCIES = 1000
+
+def mark_paged(data, table_name):
+    """标记一个工单的特殊表行数超过分页大小，改为分页比较"""
+    data.setdefault(PAGED_KEY, set()).add(table_name)
+
+def paged_tables(mysql_data, es_data):
+    """任一侧标记为需要分页比较的特殊表"""
+    return mysql_data.get(PAGED_KEY, set()) | es_data.get(PAGED_KEY, set())
+
+class PagedCollectionComparator:
+    """分页归并比较大集合
+    
+    批量获取时，特殊表一个工单（或客户）的行数超过page_size就不再放进批次数据，只做标记；
+    比较时对这些集合单独处理：MySQL按 (键字段, Id) 用 Id > 上页最后Id 的方式分页查询，
+    ES按Id排序用search_after分页，两个有序流逐页归并，配对的行按页交给按列比较器，
+    任一时刻每侧只保留一页数据。行数不同时在差异列表最前面记一条count_mismatch。
+    """
+    
+    def __init__(self, checker, page_size=500):
+        """初始化分页比较器
+        
+        Args:
+            checker: DataChecker实例，复用其连接、表定义和按列比较器
+            page_size: 每页行数，也是批量获取时一个集合的最大行数
+        """
+        self.checker = checker
+        self.db_connector = checker.db_connector
+        self.page_size = max(1, page_size)
+        # 特殊表 -> (键字段, MySQL附加条件)，条件与批量获取时一致
+        self.collections = {
+            'tb_operatinginfo': ('WorkOrderId', ''),
+            'basic_custspecialconfig': ('CustomerId', ' AND Deleted = 0'),
+        }
+    
+    def collection_key(self, table_name, order_id, mysql_data):
+        """特殊表集合的键：operating按工单，客户特殊配置按客户"""
+        if table_name == 'basic_custspecialconfig':
+            return mysql_data['main'].get('CustomerId')
+        return order_id
+    
+    def mysql_pages(self, table_name, key):
+        """按Id分页读取MySQL中一个集合的行"""
+        key_field, condition = self.collections[table_name]
+        sql = (f"SELECT {self.checker.select_columns[table_name]} FROM {table_name} "
+               f"WHERE {key_field} = %s{condition} AND Id > %s ORDER BY Id LIMIT %s")
+        last_id = -1
+        while True:
+            with self.db_connector.mysql_cursor() as cursor:
+                cursor.execute(sql, (key, last_id, self.page_size))
+                rows = cursor.fetchall()
+            if rows:
+                yield rows
+            if len(rows) < self.page_size:
+                return
+            last_id = rows[-1]['Id']
+    
+    def es_pages(self, table_name, key):
+        """按Id排序用search_after分页读取ES中一个集合的文档"""
+        key_field, _ = self.collections[table_name]
+        es_index = self.checker.special_tables[table_name]['es_index']
+        body = {
+            "query": {"term": {key_field: key}},
+            "size": self.page_size,
+            "sort": [{"Id": "asc"}],
+            "_source": self.checker.special_source_fields[es_index]
+        }
+        es_client = self.db_connector.get_es_client()
+        while True:
+            hits = es_client.search(index=es_index, body=body).get('hits', {}).get('hits', [])
+            if hits:
+                yield [hit['_source'] for hit in hits]
+            if len(hits) < self.page_size:
+                return
+            body['search_after'] = hits[-1]['sort']
+    
+    def iter_rows(self, pages):
+        for page in pages:
+            yield from page
+    
+    def compare_pairs(self, table_name, pairs):
+        """按列比较一页配对的行，返回差异列表"""
+        comparator = self.checker.comparator
+        groups = {}
+        positions = []
+        for id_val, mysql_item, es_item in pairs:
+            fields = comparator.get_special_fields(table_name, mysql_item)
+            positions.append(comparator.add_row_pair(groups, fields, table_name, fields, id_val, mysql_item, es_item))
+        mismatches = {group_key: comparator.compare_group(group) for group_key, group in groups.items()}
+        discrepancies = []
+        for group_key, position in positions:
+            discrepancies.extend(mismatches[group_key].get(position, ()))
+        return discrepancies
+    
+    def compare(self, table_name, key):
+        """归并比较一个集合，返回差异列表"""
+        mysql_rows = self.iter_rows(self.mysql_pages(table_name, key))
+        es_rows = self.iter_rows(self.es_pages(table_name, key))
+        counts = {'mysql': 0, 'es': 0}
+        discrepancies = []
+        dropped = 0
+        pairs = []
+        
+        def add(items):
+            nonlocal dropped
+            room = MAX_DISCREPANCIES - len(discrepancies)
+            discrepancies.extend(items[:max(room, 0)])
+            dropped += max(len(items) - max(room, 0), 0)
+        
+        mysql_item = next(mysql_rows, None)
+        es_item = next(es_rows, None)
+        while mysql_item is not None or es_item is not None:
+            mysql_id = id_key(mysql_item['Id']) if mysql_item is not None else None
+            es_id = id_key(es_item.get('Id')) if es_item is not None else None
+            if es_item is None or (mysql_item is not None and mysql_id < es_id):
+                add([{'table': table_name, 'type': 'missing_in_es', 'id': str(mysql_item['Id'])}])
+                counts['mysql'] += 1
+                mysql_item = next(mysql_rows, None)
+            elif mysql_item is None or es_id < mysql_id:
+                add([{'table': table_name, 'type': 'missing_in_mysql', 'id': str(es_item.get('Id'))}])
+                counts['es'] += 1
+                es_item = next(es_rows, None)
+            else:
+                pairs.append((str(mysql_item['Id']), mysql_item, es_item))
+                counts['mysql'] += 1
+                counts['es'] += 1
+                mysql_item = next(mysql_rows, None)
+                es_item = next(es_rows, None)
+            if len(pairs) >= self.page_size:
+                add(self.compare_pairs(table_name, pairs))
+                pairs = []
+        if pairs:
+            add(self.compare_pairs(table_name, pairs))
+        
+        if counts['mysql'] != counts['es']:
+            discrepancies.insert(0, {'table': table_name, 'type': 'count_mismatch',
+                                     'mysql_count': counts['mysql'], 'es_count': counts['es']})
+        logger.info(f"{table_name} 中 {key} 的 {counts['mysql']} 行（ES {counts['es']} 条）已分页比较，"
+                    f"发现 {len(discrepancies) + dropped} 处差异")
+        if dropped:
+            logger.warning(f"{table_name} 中 {key} 的差异过多，只保留前 {MAX_DISCREPANCIES} 处")
+        return discrepancies
+    
+    def compare_orders(self, items, results):
+        """对标记了分页的工单逐个比较大集合，把差异合并进批量比较结果
+        
+        Args:
+            items: (工单ID, MySQL数据, ES数据, 需要分页比较的特殊表) 列表
+            results: 批量比较结果，原地更新
+        """
+        for order_id, mysql_data, es_data, tables in items:
+            _, discrepancies = results[order_id]
+            discrepancies = list(discrepancies)
+            for table_name in sorted(tables):
+                key = self.collection_key(table_name, order_id, mysql_data)
+                try:
+                    discrepancies.extend(self.compare(table_name, key))
+                except Exception as e:
+                    # 记为比较失败的差异：该工单不算一致，差异历史中该表已有的问题也不会因此被解决
+                    logger.error(f"分页比较工单 {order_id} 的 {table_name} 时发生错误，记为比较失败: {str(e)}")
+                    discrepancies.append({'table': table_name, 'type': 'compare_error', 'error': str(e)})
+            results[order_id] = (not discrepancies, discrepancies)
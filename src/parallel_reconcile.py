@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 并行全量对账模块：把Id范围切成多个区间，由进程池中的工作进程分别流式归并对账，最后合并统计
+
+import os
+import math
+import dataclasses
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from loguru import logger
+from data_checker import DataChecker
+from full_reconcile import FullReconciler
+
+def worker_settings(settings):
+    """工作进程使用的配置：只做对账，不记录差异历史、不复查、不修复"""
+    check = dataclasses.replace(settings.check, history_file='', recheck_delays='', repair=False,
+                                repair_dry_run=False, aggregate_check=False)
+    return dataclasses.replace(settings, check=check)
+
+def reconcile_partition(settings, start_id, end_id, since):
+    """在工作进程中对账一个Id区间，返回对账统计"""
+    checker = DataChecker(worker_settings(settings))
+    try:
+        return FullReconciler(checker, start_id=start_id, end_id=end_id, since=since).scan()
+    finally:
+        checker.close()
+
+class ParallelReconciler:
+    """并行全量对账
+    
+    先取两侧Id的并集范围，按Id值切成 工作进程数 × partitions_per_worker 个连续区间，
+    区间数多于进程数，Id分布不均时先完成的进程继续领取剩余区间。每个区间由一个工作进程
+    用FullReconciler处理：MySQL主表按Id区间流式读取，ES主索引用PIT + search_after按同一区间的
+    range条件读取，两侧有序归并后批量比较，比较语义与单进程对账完全相同。
+    
+    没有使用ES的sliced scroll/PIT slice：slice按_id哈希切分文档，与MySQL的Id区间对不上，
+    无法在各自的进程内做有序归并；按Id区间的range查询可以让两侧读取同一批工单。
+    
+    每个工作进程有自己的数据库连接和客户特殊配置缓存，同一客户的配置在每个区间中各比较一次。
+    """
+    
+    # 工作进程的启动方式：spawn不继承父进程的数据库连接和线程
+    start_method = 'spawn'
+    
+    def __init__(self, checker, start_id=None, end_id=None, since=None, workers=0, partitions_per_worker=4):
+        """初始化并行全量对账
+        
+        Args:
+            checker: DataChecker实例，用于确定Id范围和发送汇总通知，其配置传给各工作进程
+            start_id: 起始Id（含），为空时取两侧最小Id
+            end_id: 结束Id（含），为空时取两侧最大Id
+            since: 只检查该日期(YYYY-MM-DD)之后创建的工单，为空表示不限
+            workers: 工作进程数，0为CPU核数
+            partitions_per_worker: 每个工作进程平均分到的区间数
+        """
+        self.checker = checker
+        self.start_id = start_id
+        self.end_id = end_id
+        self.since = since
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.partitions_per_worker = max(1, partitions_per_worker)
+        # 用于生成过滤条件和汇总消息的整体范围对账器
+        self.reporter = FullReconciler(checker, start_id=start_id, end_id=end_id, since=since)
+    
+    def get_id_bounds(self):
+        """确定对账的Id范围 [lo, hi]（含），未指定的一端取两侧满足条件的Id的并集范围"""
+        if self.start_id is not None and self.end_id is not None:
+            return self.start_id, self.end_id
+        
+        main_table = self.checker.get_main_table()
+        where, params = self.reporter.build_mysql_filter()
+        with self.checker.db_connector.mysql_cursor() as cursor:
+            cursor.execute(f"SELECT MIN(Id) AS min_id, MAX(Id) AS max_id FROM {main_table} {where}", params)
+            row = cursor.fetchone()
+        bounds = [value for value in (row['min_id'], row['max_id']) if value is not None]
+        
+        response = self.checker.db_connector.get_es_client().search(
+            index=self.checker.main_index_name,
+            body={
+                "size": 0,
+                "query": self.reporter.build_es_query(),
+                "aggs": {"min_id": {"min": {"field": "Id"}}, "max_id": {"max": {"field": "Id"}}}
+            }
+        )
+        for name in ('min_id', 'max_id'):
+            value = response.get('aggregations', {}).get(name, {}).get('value')
+            if value is not None:
+                bounds.append(int(value))
+        
+        if not bounds:
+            return None, None
+        lo = self.start_id if self.start_id is not None else min(bounds)
+        hi = self.end_id if self.end_id is not None else max(bounds)
+        return lo, hi
+    
+    def partitions(self, lo, hi):
+        """把 [lo, hi] 按Id值切成连续区间，返回 [(起始Id, 结束Id)]（均含）"""
+        count = self.workers * self.partitions_per_worker
+        width = max(1, math.ceil((hi - lo + 1) / count))
+        return [(start, min(start + width - 1, hi)) for start in range(lo, hi + 1, width)]
+    
+    def merge(self, results):
+        """按区间顺序合并各工作进程的对账统计，问题工单样例仍只保留前max_report个"""
+        stats = self.reporter.new_stats()
+        for partition_stats in results:
+            for kind in ('checked', 'inconsistent', 'missing_in_es', 'missing_in_mysql'):
+                stats[kind] += partition_stats[kind]
+            for kind, samples in partition_stats['samples'].items():
+                room = self.reporter.max_report - len(stats['samples'][kind])
+                stats['samples'][kind].extend(samples[:max(room, 0)])
+        return stats
+    
+    def run(self):
+        """执行并行全量对账，返回是否全部一致（有区间对账失败时返回False）"""
+        lo, hi = self.get_id_bounds()
+        if lo is None or hi < lo:
+            logger.warning("对账范围内没有工单")
+            return self.reporter.report(self.reporter.new_stats())
+        
+        partitions = self.partitions(lo, hi)
+        workers = min(self.workers, len(partitions))
+        logger.info(f"开始并行全量对账，Id {lo} ~ {hi} 切分为 {len(partitions)} 个区间，工作进程数: {workers}")
+        
+        results = {}
+        failed = []
+        context = multiprocessing.get_context(self.start_method)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {
+                executor.submit(reconcile_partition, self.checker.settings, start, end, self.since): (start, end)
+                for start, end in partitions
+            }
+            for future in as_completed(futures):
+                start, end = futures[future]
+                try:
+                    results[start] = future.result()
+                except Exception as e:
+                    logger.error(f"对账区间 Id {start} ~ {end} 时发生错误: {str(e)}")
+                    failed.append((start, end))
+                    continue
+                logger.info(f"并行全量对账进度: {len(results) + len(failed)}/{len(partitions)} 个区间，"
+                            f"区间 Id {start} ~ {end} 检查了 {results[start]['checked']} 条")
+        
+        stats = self.merge(results[start] for start in sorted(results))
+        if not failed:
+            return self.reporter.report(stats)
+        
+        # 有区间失败时不能报告全部一致，汇总消息中列出未检查的区间
+        ranges = ', '.join(f"{start} ~ {end}" for start, end in sorted(failed))
+        logger.error(f"并行全量对账完成，但 {len(failed)} 个区间对账失败，未检查: {ranges}。"
+                     f"已检查 {stats['checked']} 条工单，不一致 {stats['inconsistent']} 条，"
+                     f"ES缺失 {stats['missing_in_es']} 条，MySQL缺失 {stats['missing_in_mysql']} 条。")
+        message = f"**以下Id区间对账失败，未检查**: {ranges}\n\n" + self.reporter.format_summary(stats)
+        self.checker.wechat.send_message("全量数据对账 - 部分区间失败", message)
+        return False
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 延迟复查模块：刚更新过的不一致工单先进入复查队列，按退避间隔重新比较，确认后才告警
+
+import os
+import json
+import time
+from datetime import datetime
+from loguru import logger
+
+# 判断工单最近变更时间的字段
+CHANGE_FIELDS = ('UpdatedAt', 'LastUpdateTimeStamp', 'InsertTime')
+
+def last_change(mysql_data):
+    """工单在MySQL中（主表、子表和特殊表）最近一次变更的时间，没有时间字段时返回None"""
+    if not mysql_data:
+        return None
+    rows = [mysql_data['main']]
+    for group in ('nested', 'special'):
+        for table_rows in mysql_data.get(group, {}).values():
+            rows.extend(table_rows)
+    
+    latest = None
+    for row in rows:
+        for field in CHANGE_FIELDS:
+            value = row.get(field)
+            if isinstance(value, str):
+                try:
+                    value = datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+                except ValueError:
+                    continue
+            if isinstance(value, datetime) and (latest is None or value > latest):
+                latest = value
+    return latest
+
+def parse_delays(value):
+    """解析逗号分隔的复查间隔（秒）"""
+    delays = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            delays.append(max(0, int(item)))
+        except ValueError:
+            logger.warning(f"复查间隔配置 {item} 不是整数，已忽略")
+    return delays
+
+class RecheckQueue:
+    """不一致工单的延迟复查队列
+    
+    同步程序通常只落后几秒到几分钟，检查前刚在MySQL中更新过的工单常被误报。
+    最近变更时间在lag_seconds以内的不一致工单不立即告警，而是按delays依次延迟复查；
+    复查一致则移出队列，复查次数用完或最近变更时间已超过lag_seconds仍不一致时才确认上报。
+    队列保存在状态目录中（调用方在一轮检查或复查结束后调用save），单次运行模式下到期的复查在下次运行时执行。
+    """
+    
+    def __init__(self, path, delays=(30, 120, 600), lag_seconds=300):
+        """初始化复查队列
+        
+        Args:
+            path: 队列状态文件路径
+            delays: 第1、2、…次复查距上次比较的间隔（秒），次数即最大复查次数
+            lag_seconds: 同步延迟阈值，最近变更早于该时间仍不一致的工单直接上报
+        """
+        self.path = path
+        self.delays = list(delays)
+        self.lag_seconds = lag_seconds
+        # 工单ID -> {'attempts': 已复查次数, 'next_due': 下次复查的Unix时间, 'first_seen': 首次发现时间}
+        self.entries = self.load()
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return {entry['order_id']: entry for entry in json.load(f).get('entries', [])}
+        except Exception as e:
+            logger.warning(f"读取复查队列文件失败，队列已清空: {str(e)}")
+            return {}
+    
+    def save(self):
+        """写入队列（先写临时文件再替换，避免中途退出损坏文件）"""
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'entries': list(self.entries.values())}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"写入复查队列文件失败: {str(e)}")
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, order_id):
+        return order_id in self.entries
+    
+    def is_lagging(self, mysql_data):
+        """工单最近变更是否仍在同步延迟阈值内，没有变更时间时按仍在延迟内处理"""
+        changed_at = last_change(mysql_data)
+        if changed_at is None:
+            return True
+        return (datetime.now() - changed_at).total_seconds() < self.lag_seconds
+    
+    def defer(self, order_id, mysql_data):
+        """决定一个不一致工单是否延迟复查
+        
+        Returns:
+            bool: True表示已（或仍）在队列中等待复查，本次不上报；False表示应立即上报并已移出队列
+        """
+        entry = self.entries.get(order_id)
+        attempts = entry['attempts'] if entry else 0
+        if attempts >= len(self.delays) or not self.is_lagging(mysql_data):
+            self.resolve(order_id)
+            return False
+        
+        now = time.time()
+        if entry and entry['next_due'] > now:
+            # 还没到复查时间又被抽到，保持原来的复查时间
+            return True
+        self.entries[order_id] = {
+            'order_id': order_id,
+            'attempts': attempts,
+            'next_due': now + self.delays[attempts],
+            'first_seen': entry['first_seen'] if entry else now,
+        }
+        return True
+    
+    def mark_attempt(self, order_ids):
+        """记录一次复查，之后再次不一致时使用下一个间隔"""
+        for order_id in order_ids:
+            if order_id in self.entries:
+                self.entries[order_id]['attempts'] += 1
+    
+    def resolve(self, order_id):
+        """工单复查一致或已上报，移出队列"""
+        self.entries.pop(order_id, None)
+    
+    def due(self, now=None):
+        """已到复查时间的工单ID"""
+        now = time.time() if now is None else now
+        return [order_id for order_id, entry in self.entries.items() if entry['next_due'] <= now]
+    
+    def next_due(self):
+        """最早一次复查的Unix时间，队列为空时返回None"""
+        return min((entry['next_due'] for entry in self.entries.values()), default=None)
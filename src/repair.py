@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 修复模块：用已获取的MySQL数据按表映射反向生成ES文档，批量重新写入不一致的工单
+
+from datetime import datetime
+from decimal import Decimal
+from elasticsearch import helpers
+from loguru import logger
+from batch_compare import SPECIAL_DATA_KEYS, es_text, es_date_text
+from fingerprint import FingerprintComparator, mapped_digest, table_digest, row_crc
+from paged_compare import paged_tables
+import metrics
+
+# 修复计划中每个动作在日志和消息中显示的最大字段差异数
+MAX_DIFF_LINES = 20
+# 按Id查询现有文档时每个terms查询最多包含的Id数（不超过ES默认的index.max_result_window）
+LOOKUP_SIZE = 10000
+
+def diff_value(value, is_date):
+    """把文档中的值规范化后用于修复前后对比，与逐字段比较的规则一致"""
+    return es_date_text(value) if is_date else es_text(value)
+
+class OrderRepairer:
+    """按MySQL数据修复ES中不一致的工单
+    
+    主文档按table_mappings反向生成：主表字段在根级别，各子表行按es_path生成嵌套数组；
+    operating和custspecialconfig索引每行一个文档。文档按映射中定义的全部字段生成，配置了排除字段时
+    先重新获取这些工单的完整行，写入后不丢失被排除的字段。只重新写入差异涉及的索引：
+    主表或子表有差异时更新主文档（嵌套数组整体替换，每行合并到ES中同Id的现有对象上，
+    映射之外的字段和属性保留），特殊表有差异时更新MySQL中的行并删除ES中多出的文档，
+    ES中缺失主文档时三类文档全部写入。
+    动作按chunk_size个工单一块生成，每块中各索引现有文档的_id和内容用一次terms查询取得；
+    写入通过helpers.streaming_bulk分块提交，同一时间只有一个分块在途，逐条记录失败的文档；
+    dry_run时只输出修复计划和修复前后的字段差异，不写入。
+    """
+    
+    def __init__(self, checker, chunk_size=500, max_chunk_bytes=10 * 1024 * 1024, max_retries=3, dry_run=False):
+        """初始化修复器
+        
+        Args:
+            checker: DataChecker实例，复用其连接与表映射
+            chunk_size: 每个_bulk请求最多包含的文档数
+            max_chunk_bytes: 每个_bulk请求的最大字节数
+            max_retries: 被ES限流（429）时的重试次数
+            dry_run: 只输出修复计划，不写入ES
+        """
+        self.checker = checker
+        self.db_connector = checker.db_connector
+        self.main_table = checker.get_main_table()
+        self.date_fields = set(checker.DATE_FIELDS)
+        self.chunk_size = max(1, chunk_size)
+        self.max_chunk_bytes = max(1024, max_chunk_bytes)
+        self.max_retries = max(0, max_retries)
+        self.dry_run = dry_run
+        # 用于计算ES中预先存储的指纹和校验和字段
+        self.fingerprint = FingerprintComparator(checker)
+        check = checker.settings.check
+        self.fingerprint_field = check.es_fingerprint_field.strip()
+        self.checksum_field = check.es_checksum_field.strip()
+    
+    def es_value(self, field, value):
+        """MySQL值在ES文档中的表示：映射中的日期字段为ISO格式，其余与MySQL文本表示一致"""
+        if isinstance(value, datetime):
+            if field in self.date_fields:
+                return value.strftime('%Y-%m-%dT%H:%M:%S')
+            return str(value)
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, bytes):
+            return value.decode('utf-8', errors='ignore')
+        if isinstance(value, Decimal) or not isinstance(value, (str, int, float, type(None))):
+            return str(value)
+        return value
+    
+    def build_item(self, row, fields):
+        """按字段映射把一行MySQL数据转为ES对象"""
+        return {es_field: self.es_value(mysql_field, row.get(mysql_field)) for mysql_field, es_field in fields}
+    
+    def build_main_doc(self, mysql_data, current=None):
+        """生成主索引文档：主表字段在根级别，子表行按es_path生成嵌套数组
+        
+        _update整体替换嵌套数组，每个子表行合并到current（ES中的现有文档）同Id的对象上。
+        指纹和校验和按映射中定义的全部字段计算，与同步程序写入时的算法一致。
+        """
+        mappings = self.checker.table_mappings
+        defined = self.checker.defined_fields
+        current = current or {}
+        doc = self.build_item(mysql_data['main'], defined[self.main_table])
+        for table_name, mapping in mappings.items():
+            if mapping['es_path'] == "":
+                continue
+            existing = {str(item.get('Id')): item for item in current.get(mapping['es_path']) or []
+                        if isinstance(item, dict)}
+            items = []
+            for row in mysql_data['nested'].get(table_name, []):
+                item = self.build_item(row, defined[table_name])
+                items.append({**existing.get(str(item.get('Id')), {}), **item})
+            doc[mapping['es_path']] = items
+        
+        if self.fingerprint_field:
+            digests = {}
+            for table_name, mapping in mappings.items():
+                items = [doc] if mapping['es_path'] == "" else doc[mapping['es_path']]
+                digests[table_name] = table_digest(self.fingerprint.es_row_hashes(items, defined[table_name]))
+            doc[self.fingerprint_field] = mapped_digest(digests, self.fingerprint.mapped_tables())
+        if self.checksum_field:
+            checksum = 0
+            for table_name, mapping in mappings.items():
+                items = [doc] if mapping['es_path'] == "" else doc[mapping['es_path']]
+                fields = self.fingerprint.checksum_fields(defined[table_name])
+                checksum += sum(row_crc(self.fingerprint.es_row_values(item, fields)) for item in items)
+            doc[self.checksum_field] = checksum
+        return doc
+    
+    def build_special_docs(self, table_name, rows):
+        """生成特殊表对应索引的文档，每行一个"""
+        fields = self.checker.defined_fields[table_name]
+        return [self.build_item(row, fields) for row in rows]
+    
+    def repair_targets(self, es_data, discrepancies):
+        """根据差异涉及的表决定需要重新写入的部分：主文档和/或特殊表"""
+        if not es_data or not discrepancies:
+            return True, set(self.checker.special_tables)
+        tables = {disc['table'] for disc in discrepancies}
+        main = any(table_name in self.checker.table_mappings for table_name in tables)
+        return main, tables & set(self.checker.special_tables)
+    
+    def lookup_docs(self, es_client, index, ids, source):
+        """按文档中的Id字段批量查询ES中的现有文档，返回 str(Id) -> (_id, _source)"""
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for start in range(0, len(ids), LOOKUP_SIZE):
+            chunk = ids[start:start + LOOKUP_SIZE]
+            response = es_client.search(index=index, body={
+                "query": {"terms": {"Id": chunk}},
+                "size": len(chunk),
+                "_source": source
+            })
+            for hit in response.get('hits', {}).get('hits', []):
+                found.setdefault(str(hit['_source'].get('Id')), (hit['_id'], hit['_source']))
+        return found
+    
+    def plan_chunk(self, es_client, chunk, stats):
+        """为一块工单生成修复动作，返回 [(工单ID, 动作列表)]
+        
+        配置了排除字段时先重新获取这些工单在映射中定义的全部字段；
+        需要修复的各索引中现有文档的_id和内容按索引各用一次terms查询取得。
+        """
+        checker = self.checker
+        orders = []
+        for order_id, (mysql_data, es_data, discrepancies) in chunk:
+            if not mysql_data:
+                logger.warning(f"工单 {order_id} 在MySQL中不存在，不修复（不自动删除ES文档）")
+                stats['skipped'] += 1
+                continue
+            orders.append((order_id, mysql_data, es_data or {}, discrepancies))
+        
+        if checker.excluded_fields and orders:
+            full = checker.get_mysql_data_batch([order_id for order_id, _, _, _ in orders], checker.defined_columns)
+            stats['skipped'] += sum(1 for order_id, _, _, _ in orders if order_id not in full)
+            orders = [(order_id, full[order_id], es_data, discrepancies)
+                      for order_id, _, es_data, discrepancies in orders if order_id in full]
+        
+        # 收集各索引需要查询的Id：主文档按工单Id，特殊表按MySQL中的行和ES中现有的行
+        main_ids = []
+        special_ids = {table_name: [] for table_name in checker.special_tables}
+        for order_id, mysql_data, es_data, discrepancies in orders:
+            main, special_tables = self.repair_targets(es_data, discrepancies)
+            if main:
+                main_ids.append(order_id)
+            for table_name in special_tables - paged_tables(mysql_data, es_data):
+                special_ids[table_name].extend(row.get('Id') for row in mysql_data['special'].get(table_name, []))
+                special_ids[table_name].extend(item.get('Id') for item in es_data.get(SPECIAL_DATA_KEYS[table_name]) or [])
+        
+        defined = checker.defined_fields
+        main_source = ['Id'] + [es_field for _, es_field in defined[self.main_table]] + [
+            mapping['es_path'] for mapping in checker.table_mappings.values() if mapping['es_path']
+        ]
+        current = {checker.main_index_name: self.lookup_docs(es_client, checker.main_index_name, main_ids, main_source)}
+        for table_name, ids in special_ids.items():
+            index = checker.special_tables[table_name]['es_index']
+            current[index] = self.lookup_docs(es_client, index, ids, [es_field for _, es_field in defined[table_name]])
+        
+        return [(order_id, self.plan_order(order_id, mysql_data, es_data, discrepancies, current))
+                for order_id, mysql_data, es_data, discrepancies in orders]
+    
+    def plan_order(self, order_id, mysql_data, es_data, discrepancies, current):
+        """生成一个工单的修复动作列表 [(动作, 索引, _id, 文档, 修复前文档)]
+        
+        current为 索引名 -> {str(Id): (_id, 现有文档)}，由plan_chunk按块查询。
+        """
+        checker = self.checker
+        main, special_tables = self.repair_targets(es_data, discrepancies)
+        actions = []
+        
+        if main:
+            doc_id, existing = current[checker.main_index_name].get(str(order_id), (str(order_id), None))
+            actions.append(('update', checker.main_index_name, doc_id, self.build_main_doc(mysql_data, existing),
+                            existing))
+        
+        for table_name in special_tables:
+            if table_name in paged_tables(mysql_data, es_data):
+                logger.warning(f"工单 {order_id} 的 {table_name} 行数超过分页大小，不自动修复")
+                continue
+            index = checker.special_tables[table_name]['es_index']
+            docs = self.build_special_docs(table_name, mysql_data['special'].get(table_name, []))
+            mysql_ids = {str(doc.get('Id')) for doc in docs}
+            stale = [str(item.get('Id')) for item in es_data.get(SPECIAL_DATA_KEYS[table_name]) or []
+                     if str(item.get('Id')) not in mysql_ids]
+            for doc in docs:
+                key = str(doc.get('Id'))
+                doc_id, existing = current[index].get(key, (key, None))
+                # 与ES中现有文档一致的行不再写入
+                if existing is not None and not self.diff_lines(doc, existing):
+                    continue
+                actions.append(('update', index, doc_id, doc, existing))
+            for key in stale:
+                doc_id, existing = current[index].get(key, (key, None))
+                actions.append(('delete', index, doc_id, None, existing))
+        return actions
+    
+    def diff_lines(self, doc, current):
+        """修复前后的字段差异，嵌套数组按Id对应"""
+        lines = []
+        current = current or {}
+        for field, value in doc.items():
+            old = current.get(field)
+            if isinstance(value, list):
+                old_items = {str(item.get('Id')): item for item in old or [] if isinstance(item, dict)}
+                new_ids = {str(item.get('Id')) for item in value}
+                for item in value:
+                    key = str(item.get('Id'))
+                    if key not in old_items:
+                        lines.append(f"{field}[Id={key}]: 新增")
+                        continue
+                    lines.extend(f"{field}[Id={key}].{line}" for line in self.diff_lines(item, old_items[key]))
+                lines.extend(f"{field}[Id={key}]: 删除" for key in old_items if key not in new_ids)
+            elif field in self.checker.json_fields:
+                if not self.checker.json_comparator.equal(value, old):
+                    lines.append(f"{field}: {str(old)[:50]} -> {str(value)[:50]}")
+            elif diff_value(value, field in self.date_fields) != diff_value(old, field in self.date_fields):
+                lines.append(f"{field}: {str(old)[:50]} -> {str(value)[:50]}")
+        return lines
+    
+    def describe(self, order_id, actions):
+        """修复计划的文字描述，dry_run时输出"""
+        lines = [f"工单 {order_id}:"]
+        for action, index, doc_id, doc, current in actions:
+            if action == 'delete':
+                lines.append(f"  删除 {index}/{doc_id}")
+                continue
+            if not current:
+                lines.append(f"  写入 {index}/{doc_id}（ES中没有该文档或未获取到）")
+                continue
+            changes = self.diff_lines(doc, current)
+            if not changes:
+                continue
+            lines.append(f"  更新 {index}/{doc_id}，{len(changes)} 处变化")
+            lines.extend(f"    {line}" for line in changes[:MAX_DIFF_LINES])
+            if len(changes) > MAX_DIFF_LINES:
+                lines.append(f"    还有 {len(changes) - MAX_DIFF_LINES} 处变化未显示...")
+        return lines
+    
+    def iter_actions(self, es_client, orders, stats):
+        """按块为工单生成_bulk动作，streaming_bulk按分块取用"""
+        items = list(orders.items())
+        for start in range(0, len(items), self.chunk_size):
+            chunk = items[start:start + self.chunk_size]
+            skipped = stats['skipped']
+            try:
+                planned = self.plan_chunk(es_client, chunk, stats)
+            except Exception as e:
+                logger.error(f"生成 {len(chunk)} 条工单的修复动作失败: {str(e)}")
+                stats['skipped'] = skipped + len(chunk)
+                continue
+            
+            for order_id, actions in planned:
+                stats['orders'] += 1
+                if self.dry_run:
+                    logger.info("\n".join(self.describe(order_id, actions)))
+                for action, index, doc_id, doc, _ in actions:
+                    stats['actions'] += 1
+                    if action == 'delete':
+                        yield {'_op_type': 'delete', '_index': index, '_id': doc_id}
+                    else:
+                        yield {'_op_type': 'update', '_index': index, '_id': doc_id, 'doc': doc, 'doc_as_upsert': True}
+    
+    @metrics.timed('repair')
+    def repair(self, orders):
+        """修复不一致的工单
+        
+        Args:
+            orders: 工单ID -> (MySQL数据, ES数据, 差异列表)
+        
+        Returns:
+            dict: 统计 {'orders', 'actions', 'ok', 'failed', 'skipped'}
+        """
+        stats = {'orders': 0, 'actions': 0, 'ok': 0, 'failed': 0, 'skipped': 0}
+        if not orders:
+            return stats
+        
+        es_client = self.db_connector.get_es_client()
+        actions = self.iter_actions(es_client, orders, stats)
+        if self.dry_run:
+            for _ in actions:
+                pass
+            logger.info(f"修复预演：{stats['orders']} 条工单，计划 {stats['actions']} 个写入/删除动作，未写入ES")
+            return stats
+        
+        try:
+            for ok, item in helpers.streaming_bulk(
+                es_client, actions,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                max_retries=self.max_retries,
+                raise_on_error=False,
+                raise_on_exception=False,
+                # 删除ES中已不存在的文档不算失败
+                ignore_status=(404,)
+            ):
+                (op_type, result), = item.items()
+                if ok or (op_type == 'delete' and result.get('status') == 404):
+                    stats['ok'] += 1
+                    metrics.REPAIRS.inc(result='ok')
+                    continue
+                stats['failed'] += 1
+                metrics.REPAIRS.inc(result='failed')
+                logger.error(f"修复写入失败 {op_type} {result.get('_index')}/{result.get('_id')}: "
+                             f"status={result.get('status')} {result.get('error') or result.get('exception')}")
+        except Exception as e:
+            logger.error(f"批量修复写入ES时发生错误: {str(e)}")
+        
+        logger.info(f"修复完成：{stats['orders']} 条工单，写入/删除成功 {stats['ok']} 个文档，"
+                    f"失败 {stats['failed']} 个，跳过 {stats['skipped']} 条工单")
+        return stats
+    
+    def format_message(self, stats):
+        """格式化修复结果，附加到企业微信汇总消息中"""
+        if self.dry_run:
+            return f"修复预演：{stats['orders']} 条工单，计划 {stats['actions']} 个写入/删除动作（未写入ES，详见日志）\n"
+        message = f"已从MySQL重新写入 {stats['orders']} 条不一致工单：成功 {stats['ok']} 个文档，失败 {stats['failed']} 个"
+        if stats['skipped']:
+            message += f"，{stats['skipped']} 条工单MySQL中不存在或无法生成文档，未修复"
+        return message + "\n"
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# 工单抽样模块，提供多种不依赖 ORDER BY RAND() 的随机抽样策略
+
+import os
+import json
+import math
+import time
+import random
+import pymysql
+from datetime import datetime, timedelta
+from loguru import logger
+from config import STATE_DIR
+
+class BaseSampler:
+    """抽样策略基类
+    
+    所有策略都在 [最小Id, 最大Id] 范围内工作，随机数发生器可指定种子以便复现；
+    随机过程取不满时用补齐扫描兜底，保证返回 min(n, 窗口内工单数) 个不重复ID。
+    """
+    
+    name = None
+    
+    # 抽样条件：未删除且在时间窗口内
+    WHERE_CLAUSE = "Deleted = 0 AND CreatedAt > DATE_SUB(NOW(), INTERVAL %s MONTH)"
+    
+    def __init__(self, db_connector, table="tb_workorder", window_months=3, seed=None):
+        """初始化抽样器
+        
+        Args:
+            db_connector: 数据库连接器
+            table: 抽样的工单表
+            window_months: 时间窗口（月）
+            seed: 随机种子，为None时不固定
+        """
+        self.db_connector = db_connector
+        self.table = table
+        self.window_months = window_months
+        self.rng = random.Random(seed)
+    
+    def get_id_range(self, cursor):
+        """获取时间窗口内的Id范围，返回 (min_id, max_id)，无数据时返回 (None, None)"""
+        # 按CreatedAt索引取窗口内第一条，MAX(Id)直接走主键，两者都不随表大小增长
+        cursor.execute(
+            f"SELECT Id FROM {self.table} WHERE {self.WHERE_CLAUSE} ORDER BY CreatedAt, Id LIMIT 1",
+            (self.window_months,)
+        )
+        first = cursor.fetchone()
+        if not first:
+            return None, None
+        
+        cursor.execute(f"SELECT MAX(Id) AS max_id FROM {self.table}")
+        return first['Id'], cursor.fetchone()['max_id']
+    
+    def fill(self, cursor, chosen, n, min_id, max_id):
+        """从随机起点顺序扫描补齐样本（必要时回绕），保证样本数量"""
+        start = self.rng.randint(min_id, max_id)
+        # 先扫描起点之后，再回绕扫描起点之前；每次取n行，即使含有已选ID也足够补齐
+        scans = (
+            (f"SELECT Id FROM {self.table} WHERE Id >= %s AND {self.WHERE_CLAUSE} ORDER BY Id LIMIT %s",
+             (start,)),
+            (f"SELECT Id FROM {self.table} WHERE Id >= %s AND Id < %s AND {self.WHERE_CLAUSE} ORDER BY Id LIMIT %s",
+             (min_id, start)),
+        )
+        for sql, bounds in scans:
+            if len(chosen) >= n:
+                break
+            cursor.execute(sql, bounds + (self.window_months, n))
+            for row in cursor.fetchall():
+                if len(chosen) >= n:
+                    break
+                chosen.setdefault(row['Id'], None)
+    
+    def sample(self, n):
+        """抽取n个工单ID"""
+        if n <= 0:
+            return []
+        
+        with self.db_connector.mysql_cursor() as cursor:
+            min_id, max_id = self.get_id_range(cursor)
+            if min_id is None:
+                return []
+            
+            # 使用dict保持插入顺序，便于在固定种子下复现结果顺序
+            chosen = {}
+            self.collect(cursor, chosen, n, min_id, max_id)
+            if len(chosen) < n:
+                logger.debug(f"{self.name}抽样得到 {len(chosen)}/{n} 条，使用顺序扫描补齐")
+                self.fill(cursor, chosen, n, min_id, max_id)
+        
+        return list(chosen)[:n]
+    
+    def collect(self, cursor, chosen, n, min_id, max_id):
+        """由子类实现具体的随机抽样过程"""
+        raise NotImplementedError
+    
+    def record_results(self, outcomes):
+        """检查结束后回传各工单的比较结果（工单ID -> 是否一致），自适应策略据此调整下次抽样"""
+
+class PrimaryKeySeekSampler(BaseSampler):
+    """主键随机定位抽样：在Id范围内取随机点，取每个点之后第一条符合条件的工单
+    
+    每轮把所有随机点合并为一条UNION ALL查询，每个子查询都是一次主键索引定位。
+    """
+    
+    name = "pk_seek"
+    
+    def __init__(self, db_connector, max_rounds=5, **kwargs):
+        super().__init__(db_connector, **kwargs)
+        self.max_rounds = max_rounds
+    
+    def collect(self, cursor, chosen, n, min_id, max_id):
+        seek_sql = f"(SELECT Id FROM {self.table} WHERE Id >= %s AND {self.WHERE_CLAUSE} ORDER BY Id LIMIT 1)"
+        
+        for _ in range(self.max_rounds):
+            remaining = n - len(chosen)
+            if remaining <= 0:
+                break
+            
+            # 多取一些随机点，抵消重复命中和空洞
+            points = [self.rng.randint(min_id, max_id) for _ in range(math.ceil(remaining * 1.2) + 1)]
+            params = []
+            for point in points:
+                params.extend((point, self.window_months))
+            cursor.execute(" UNION ALL ".join([seek_sql] * len(points)), tuple(params))
+            
+            for row in cursor.fetchall():
+                if len(chosen) >= n:
+                    break
+                chosen.setdefault(row['Id'], None)
+
+class BlockSampler(BaseSampler):
+    """按Id区间分块抽样（类似TABLESAMPLE SYSTEM）
+    
+    随机选取若干宽度为block_size的Id区间，每个区间内只读取区间内的行，
+    再从中随机取若干条，查询代价只与区间宽度有关。
+    """
+    
+    name = "block"
+    
+    def __init__(self, db_connector, block_size=1000, max_rounds=5, **kwargs):
+        super().__init__(db_connector, **kwargs)
+        self.block_size = max(1, block_size)
+        self.max_rounds = max_rounds
+    
+    def collect(self, cursor, chosen, n, min_id, max_id):
+        block_sql = f"SELECT Id FROM {self.table} WHERE Id >= %s AND Id < %s AND {self.WHERE_CLAUSE}"
+        block_count = max(1, (max_id - min_id) // self.block_size + 1)
+        # 每块取的条数，兼顾样本分散程度与查询次数
+        per_block = max(1, math.isqrt(n))
+        visited = set()
+        
+        for _ in range(self.max_rounds):
+            remaining = n - len(chosen)
+            if remaining <= 0 or len(visited) >= block_count:
+                break
+            
+            for block in self.pick_blocks(block_count, math.ceil(remaining / per_block), visited):
+                visited.add(block)
+                start = min_id + block * self.block_size
+                cursor.execute(block_sql, (start, start + self.block_size, self.window_months))
+                ids = [row['Id'] for row in cursor.fetchall() if row['Id'] not in chosen]
+                for order_id in self.rng.sample(ids, min(per_block, len(ids), n - len(chosen))):
+                    chosen[order_id] = None
+                if len(chosen) >= n:
+                    break
+    
+    def pick_blocks(self, block_count, k, visited):
+        """随机选取k个未访问过的区块"""
+        available = block_count - len(visited)
+        k = min(k, available)
+        picked = []
+        while len(picked) < k:
+            block = self.rng.randrange(block_count)
+            if block not in visited and block not in picked:
+                picked.append(block)
+        return picked
+
+class ReservoirSampler(BaseSampler):
+    """蓄水池抽样：流式读取窗口内全部Id，内存中只保留n条
+    
+    需要扫描整个时间窗口，但结果是严格的均匀随机样本，适合窗口不大或需要无偏样本的场景。
+    """
+    
+    name = "reservoir"
+    
+    def __init__(self, db_connector, fetch_size=5000, **kwargs):
+        super().__init__(db_connector, **kwargs)
+        self.fetch_size = fetch_size
+    
+    def sample(self, n):
+        if n <= 0:
+            return []
+        
+        reservoir = []
+        seen = 0
+        with self.db_connector.mysql_cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(f"SELECT Id FROM {self.table} WHERE {self.WHERE_CLAUSE}", (self.window_months,))
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    seen += 1
+                    if len(reservoir) < n:
+                        reservoir.append(row['Id'])
+                    else:
+                        j = self.rng.randrange(seen)
+                        if j < n:
+                            reservoir[j] = row['Id']
+        
+        logger.debug(f"蓄水池抽样扫描了 {seen} 条工单")
+        return reservoir
+
+def stratum_key(day, app_code, work_status):
+    """分层键：日期|AppCode|WorkStatus，NULL记为空字符串"""
+    return '|'.join('' if value is None else str(value) for value in (str(day)[:10], app_code, work_status))
+
+class StratumStatsStore:
+    """本地状态文件，保存各分层历史检查数、不一致数（按周期衰减）和最近一次被抽到的时间"""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('strata', {})
+        except Exception as e:
+            logger.warning(f"读取分层抽样状态文件失败，将重新统计: {str(e)}")
+            return {}
+    
+    def save(self, strata):
+        """写入状态（先写临时文件再替换，避免中途退出损坏文件）"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'strata': strata, 'saved_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, f)
+        os.replace(tmp_path, self.path)
+
+class StratifiedSampler(BaseSampler):
+    """按 创建日期 × AppCode × WorkStatus 分层的自适应抽样
+    
+    先用一条GROUP BY查询得到各分层的工单数和最近写入数（结果缓存strata_ttl秒，不必每个周期都扫描整个窗口），样本分两部分：
+    floor_share比例的样本按最久未被抽到的顺序每层分一条，保证每个分层都会轮流被覆盖；
+    其余样本按 工单数 × 历史不一致率 × (1 + recent_boost × 最近写入占比) 加权分配给各分层。
+    历史检查数与不一致数按周期衰减，保存在状态目录中，跨进程和重启保留。
+    分层内按随机偏移取工单，每个偏移是一个 LIMIT 1 OFFSET 子查询，合并为一条UNION ALL查询。
+    """
+    
+    name = "stratified"
+    
+    # 没有任何历史记录时假定的不一致率，也是全局不一致率的下限：
+    # 历史检查全部一致时各分层权重不会都变成0，样本仍按工单数和最近写入量分层分配
+    DEFAULT_RATE = 0.01
+    # 平滑不一致率时按上一级不一致率计入的虚拟检查数，样本很少的分层不会被一两次结果带偏
+    PRIOR_WEIGHT = 5
+    
+    def __init__(self, db_connector, table="tb_workorderinfo", state_file=None, floor_share=0.2,
+                 recent_hours=24, recent_boost=4, decay=0.9, strata_ttl=3600, **kwargs):
+        """初始化分层抽样器
+        
+        Args:
+            db_connector: 数据库连接器
+            table: 抽样的工单主表（需有AppCode、WorkStatus、UpdatedAt字段）
+            state_file: 分层统计状态文件路径
+            floor_share: 用于轮流覆盖各分层的样本比例
+            recent_hours: 最近多少小时内更新过的工单算作最近写入
+            recent_boost: 最近写入的工单相对其他工单的额外权重
+            decay: 每个检查周期历史统计的衰减系数
+            strata_ttl: 分层工单数的缓存秒数，0为每次抽样都重新查询
+        """
+        super().__init__(db_connector, table=table, **kwargs)
+        self.store = StratumStatsStore(state_file or os.path.join(STATE_DIR, 'stratified_sampler.json'))
+        self.floor_share = min(1.0, max(0.0, floor_share))
+        self.recent_hours = max(0, recent_hours)
+        self.recent_boost = max(0, recent_boost)
+        self.decay = min(1.0, max(0.0, decay))
+        self.strata_ttl = max(0, strata_ttl)
+        self.stats = self.store.load()
+        # 缓存的分层列表及查询时间
+        self.strata = None
+        self.strata_loaded_at = 0
+        # 本次样本中各工单所属的分层，回传结果时使用
+        self.last_strata = {}
+    
+    def get_strata(self, cursor):
+        """查询窗口内各分层的工单数和最近写入数，返回 [(分层键, 取值, 工单数, 最近写入数)]"""
+        cursor.execute(
+            f"SELECT DATE(CreatedAt) AS day, AppCode, WorkStatus, COUNT(*) AS cnt, "
+            f"SUM(CASE WHEN UpdatedAt >= NOW() - INTERVAL %s SECOND THEN 1 ELSE 0 END) AS recent "
+            f"FROM {self.table} WHERE {self.WHERE_CLAUSE} GROUP BY DATE(CreatedAt), AppCode, WorkStatus",
+            (self.recent_hours * 3600, self.window_months)
+        )
+        return [
+            (stratum_key(row['day'], row['AppCode'], row['WorkStatus']),
+             (str(row['day'])[:10], row['AppCode'], row['WorkStatus']),
+             int(row['cnt']), int(row['recent'] or 0))
+            for row in cursor.fetchall()
+        ]
+    
+    def get_cached_strata(self, cursor):
+        """返回各分层，缓存未过期时不重新查询；缓存期内新增的分层和工单由补齐扫描兜底"""
+        now = time.monotonic()
+        if self.strata is None or now - self.strata_loaded_at >= self.strata_ttl:
+            self.strata = self.get_strata(cursor)
+            self.strata_loaded_at = now
+        return self.strata
+    
+    def estimate_rates(self, keys):
+        """估计各分层的不一致率
+        
+        分层样本很少，按 全局 -> 同一AppCode×WorkStatus的全部日期 -> 分层 逐级平滑，
+        某类工单持续出现差异时，它在新日期上的分层也会得到较高的权重。
+        """
+        totals = [0.0, 0.0]
+        groups = {}
+        for key, item in self.stats.items():
+            group = groups.setdefault(key.split('|', 1)[1], [0.0, 0.0])
+            for counts in (totals, group):
+                counts[0] += item.get('inconsistent', 0)
+                counts[1] += item.get('checked', 0)
+        global_rate = max(totals[0] / totals[1], self.DEFAULT_RATE) if totals[1] >= 1 else self.DEFAULT_RATE
+        
+        def smooth(counts, prior):
+            return (counts[0] + prior * self.PRIOR_WEIGHT) / (counts[1] + self.PRIOR_WEIGHT)
+        
+        rates = {}
+        for key in keys:
+            group_rate = smooth(groups.get(key.split('|', 1)[1], (0, 0)), global_rate)
+            item = self.stats.get(key, {})
+            rates[key] = smooth((item.get('inconsistent', 0), item.get('checked', 0)), group_rate)
+        return rates
+    
+    def allocate(self, strata, n):
+        """把n个样本分配给各分层，返回 {分层下标: 样本数}"""
+        allocation = {}
+        capacity = [count for _, _, count, _ in strata]
+        
+        # 覆盖下限：从未抽到或最久未抽到的分层优先，每层一条
+        floor_n = min(len(strata), math.ceil(n * self.floor_share)) if self.floor_share > 0 else 0
+        order = sorted(range(len(strata)),
+                       key=lambda i: (self.stats.get(strata[i][0], {}).get('last_sampled', 0), self.rng.random()))
+        for i in order[:floor_n]:
+            allocation[i] = 1
+        
+        # 其余样本按 工单数 × 不一致率 × 最近写入加成 加权抽取，超出分层容量的部分重新抽取
+        rates = self.estimate_rates([key for key, _, _, _ in strata])
+        weights = []
+        for key, _, count, recent in strata:
+            boost = 1 + self.recent_boost * recent / count if count else 1
+            weights.append(count * rates[key] * boost)
+        remaining = n - sum(allocation.values())
+        while remaining > 0:
+            open_strata = [i for i in range(len(strata)) if allocation.get(i, 0) < capacity[i] and weights[i] > 0]
+            if not open_strata:
+                break
+            for i in self.rng.choices(open_strata, weights=[weights[i] for i in open_strata], k=remaining):
+                if allocation.get(i, 0) < capacity[i]:
+                    allocation[i] = allocation.get(i, 0) + 1
+                    remaining -= 1
+        return allocation
+    
+    def collect(self, cursor, chosen, n, min_id, max_id):
+        self.last_strata = {}
+        strata = self.get_cached_strata(cursor)
+        if not strata:
+            return
+        
+        parts = []
+        params = []
+        for i, k in self.allocate(strata, n).items():
+            key, (day, app_code, work_status), count, _ = strata[i]
+            next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+            conditions = ["CreatedAt >= %s", "CreatedAt < %s"]
+            values = [day, next_day]
+            for field, value in (('AppCode', app_code), ('WorkStatus', work_status)):
+                if value is None:
+                    conditions.append(f"{field} IS NULL")
+                else:
+                    conditions.append(f"{field} = %s")
+                    values.append(value)
+            # 分层键作为常量列返回，用于回传结果时对应到分层
+            sql = (f"(SELECT Id, %s AS stratum FROM {self.table} WHERE {' AND '.join(conditions)} "
+                   f"AND {self.WHERE_CLAUSE} ORDER BY Id LIMIT 1 OFFSET %s)")
+            for offset in self.rng.sample(range(count), min(k, count)):
+                parts.append(sql)
+                params.extend([key] + values + [self.window_months, offset])
+        if not parts:
+            return
+        
+        cursor.execute(" UNION ALL ".join(parts), tuple(params))
+        for row in cursor.fetchall():
+            if len(chosen) >= n:
+                break
+            if row['Id'] not in chosen:
+                chosen[row['Id']] = None
+                self.last_strata[row['Id']] = row['stratum']
+    
+    def record_results(self, outcomes):
+        """按分层累计本次检查结果，历史统计先按decay衰减，再写入状态文件"""
+        if not self.last_strata:
+            return
+        now = time.time()
+        for item in self.stats.values():
+            item['checked'] = item.get('checked', 0) * self.decay
+            item['inconsistent'] = item.get('inconsistent', 0) * self.decay
+        for order_id, is_consistent in outcomes.items():
+            key = self.last_strata.get(order_id)
+            if key is None:
+                continue
+            item = self.stats.setdefault(key, {})
+            item['checked'] = item.get('checked', 0) + 1
+            item['inconsistent'] = item.get('inconsistent', 0) + (0 if is_consistent else 1)
+            item['last_sampled'] = now
+        
+        # 只保留时间窗口内的分层
+        oldest = (datetime.now() - timedelta(days=31 * self.window_months)).strftime('%Y-%m-%d')
+        self.stats = {key: item for key, item in self.stats.items() if key[:10] >= oldest}
+        try:
+            self.store.save(self.stats)
+        except OSError as e:
+            logger.warning(f"写入分层抽样状态文件失败: {str(e)}")
+
+SAMPLERS = {
+    PrimaryKeySeekSampler.name: PrimaryKeySeekSampler,
+    BlockSampler.name: BlockSampler,
+    ReservoirSampler.name: ReservoirSampler,
+    StratifiedSampler.name: StratifiedSampler,
+}
+
+def create_sampler(check, db_connector, main_table=None):
+    """根据配置创建抽样器
+    
+    Args:
+        check: CheckSettings
+        db_connector: 数据库连接器
+        main_table: 表映射中的工单主表，stratified策略按其AppCode、WorkStatus分层
+    """
+    strategy = check.sample_strategy
+    if strategy not in SAMPLERS:
+        logger.warning(f"未知的抽样策略 {strategy}，使用 pk_seek")
+        strategy = PrimaryKeySeekSampler.name
+    
+    kwargs = {
+        'window_months': check.sample_window_months,
+        'seed': int(check.sample_seed) if check.sample_seed.strip() else None,
+    }
+    if strategy == BlockSampler.name:
+        kwargs['block_size'] = check.sample_block_size
+    if strategy == StratifiedSampler.name:
+        state_file = check.stratified_state_file.strip()
+        kwargs.update({
+            'state_file': os.path.join(STATE_DIR, state_file) if state_file else None,
+            'floor_share': check.stratified_floor_share,
+            'recent_hours': check.stratified_recent_hours,
+            'recent_boost': check.stratified_recent_boost,
+            'decay': check.stratified_decay,
+            'strata_ttl': check.stratified_strata_ttl,
+        })
+        if main_table:
+            kwargs['table'] = main_table
+    
+    return SAMPLERS[strategy](db_connector, **kwargs)
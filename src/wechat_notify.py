@@ -2,62 +2,250 @@
 # -*- coding:utf-8 -*-
 # 企业微信通知模块 - 群机器人webhook方式
 
+import time
+import queue
+import threading
 import requests
-import json
+from requests.adapters import HTTPAdapter
 from loguru import logger
-from config import load_config
+from config import get_settings
+import metrics
+
+# 群机器人markdown消息内容的最大字节数
+MAX_MESSAGE_BYTES = 4096
+# 群机器人接口频率超限的错误码
+ERRCODE_RATE_LIMITED = 45009
+
+def truncate_bytes(text, limit):
+    """按UTF-8字节数截断文本，不截断多字节字符"""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= limit:
+        return text
+    return encoded[:limit].decode('utf-8', errors='ignore')
+
+def split_markdown(title, sections, limit=MAX_MESSAGE_BYTES):
+    """把多段内容按字节上限拆分为多条markdown消息
+    
+    每条消息以标题开头，各段落尽量完整地放在同一条消息中，单段超出上限时截断。
+    拆分为多条时在标题后标注序号。
+    """
+    # 为序号标注预留空间，如 " (12/15)"
+    header_reserve = len(f"## {title} (99/99)\n\n".encode('utf-8'))
+    body_limit = max(1, limit - header_reserve)
+    
+    bodies = []
+    current = ""
+    for section in sections:
+        section = truncate_bytes(section.rstrip() + "\n\n", body_limit)
+        if current and len((current + section).encode('utf-8')) > body_limit:
+            bodies.append(current)
+            current = ""
+        current += section
+    if current or not bodies:
+        bodies.append(current)
+    
+    if len(bodies) == 1:
+        return [f"## {title}\n\n{bodies[0]}".rstrip()]
+    return [f"## {title} ({i}/{len(bodies)})\n\n{body}".rstrip() for i, body in enumerate(bodies, 1)]
+
+class TokenBucket:
+    """令牌桶限流：按每分钟rate_per_minute个令牌匀速补充，最多积攒capacity个
+    
+    capacity为1时任意一分钟内发出的消息不超过rate_per_minute条。
+    """
+    
+    def __init__(self, rate_per_minute=20, capacity=1):
+        self.rate_per_minute = rate_per_minute
+        self.rate = max(1, rate_per_minute) / 60.0
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """取一个令牌，不足时等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
 class WechatNotifier:
-    """企业微信通知类 - 使用群机器人webhook"""
+    """企业微信通知类 - 使用群机器人webhook
     
-    def __init__(self):
-        """初始化企业微信通知"""
-        self.config = load_config()
-        if not self.config:
+    默认异步发送：send_message只把消息放入队列，由后台线程通过复用连接的Session发送，
+    按令牌桶限流（群机器人每分钟20条），失败时按指数退避重试。检查流程不会等待告警发送。
+    close()会等待队列中的消息发送完毕。
+    """
+    
+    def __init__(self, settings=None):
+        """初始化企业微信通知
+        
+        Args:
+            settings: 已解析的配置，为空时使用当前全局配置
+        """
+        settings = settings or get_settings()
+        if not settings:
             logger.error("配置加载失败，请检查配置文件")
             raise ValueError("配置加载失败")
         
-        # 获取企业微信配置
-        self.to_group_key = self.config.get("wechat", "to_group_key")
-        self.to_user = self.config.get("wechat", "to_user")
-        self.to_user = self.to_user.split(',') if self.to_user else []
+        self.rate_limiter = None
+        self.apply_settings(settings.wechat)
+        
+        # 复用连接的Session
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.headers.update({'Content-Type': 'application/json'})
+        
+        # 后台发送队列
+        self.queue = queue.Queue(maxsize=settings.wechat.queue_size)
+        self.worker = None
+        self.worker_lock = threading.Lock()
+    
+    def apply_settings(self, wechat):
+        """应用企业微信配置（初始化和服务模式热加载时调用）
+        
+        Args:
+            wechat: WechatSettings
+        """
+        self.to_group_key = wechat.to_group_key
+        self.to_user = wechat.to_user.split(',') if wechat.to_user else []
         self.to_url = f"https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key={self.to_group_key}"
+        
+        # 发送配置
+        self.timeout = wechat.timeout
+        self.max_retries = max(0, wechat.max_retries)
+        self.retry_backoff = wechat.retry_backoff
+        self.async_send = wechat.async_send
+        if self.rate_limiter is None or self.rate_limiter.rate_per_minute != wechat.rate_per_minute:
+            self.rate_limiter = TokenBucket(wechat.rate_per_minute)
     
     def send_message(self, title, content):
-        """发送企业微信消息
+        """发送企业微信消息（超过长度上限时拆分为多条）
         
         Args:
             title: 消息标题
             content: 消息内容
         
         Returns:
-            bool: 是否发送成功
+            bool: 异步模式下表示是否已放入发送队列，同步模式下表示是否发送成功
+        """
+        return self.send_digest(title, [content])
+    
+    def send_digest(self, title, sections):
+        """把多段内容汇总发送，按4096字节上限拆分为尽量少的消息
+        
+        Args:
+            title: 消息标题
+            sections: 内容段落列表，每段尽量不被拆到两条消息中
+        
+        Returns:
+            bool: 异步模式下表示是否已全部放入发送队列，同步模式下表示是否全部发送成功
         """
-        # 格式化消息
-        message = f"## {title}\n\n{content}"
-        return self.send_wechat_alert(message)
+        messages = split_markdown(title, sections)
+        if not self.async_send:
+            return all([self.send_wechat_alert(message) for message in messages])
+        
+        self.ensure_worker()
+        for message in messages:
+            try:
+                self.queue.put_nowait(message)
+            except queue.Full:
+                metrics.ALERT_MESSAGES.inc(result='dropped')
+                logger.error(f"企业微信发送队列已满，丢弃消息: {title}")
+                return False
+        return True
     
+    def ensure_worker(self):
+        """按需启动后台发送线程"""
+        with self.worker_lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run_worker, name="wechat-sender", daemon=True)
+                self.worker.start()
+    
+    def run_worker(self):
+        """后台发送线程：逐条取出消息发送，收到None时退出"""
+        while True:
+            message = self.queue.get()
+            try:
+                if message is None:
+                    return
+                self.send_wechat_alert(message)
+            finally:
+                self.queue.task_done()
+    
+    @metrics.timed('alert')
     def send_wechat_alert(self, message):
-        """发送企业微信告警"""
-        try:
-            response = requests.post(
-                self.to_url, 
-                json={"msgtype": "markdown",
-                      "markdown": {
-                          "content": message,
-                          "mentioned_mobile_list": self.to_user
-                      }
-                },
-                headers = {'Content-Type':'application/json'}
-            )
-            if response.status_code == 200:
+        """发送企业微信告警，限流并在失败时退避重试"""
+        sent = self.deliver(message)
+        metrics.ALERT_MESSAGES.inc(result='sent' if sent else 'failed')
+        return sent
+    
+    def deliver(self, message):
+        """调用群机器人接口发送一条消息，返回是否成功"""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.post(
+                    self.to_url,
+                    json={"msgtype": "markdown",
+                          "markdown": {
+                              "content": message,
+                              "mentioned_mobile_list": self.to_user
+                          }
+                    },
+                    timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                logger.warning(f"发送企业微信消息时发生错误（第 {attempt + 1} 次）: {str(e)}")
+                continue
+            
+            if response.status_code >= 500 or response.status_code == 429:
+                logger.warning(f"企业微信接口返回 {response.status_code}（第 {attempt + 1} 次）")
+                continue
+            if response.status_code != 200:
+                logger.error(f"企业微信消息发送失败，HTTP状态码: {response.status_code}")
+                return False
+            
+            try:
                 result = response.json()
-                if result.get("errcode") == 0:
-                    logger.info("企业微信消息发送成功")
-                    return True
-                else:
-                    logger.error(f"企业微信消息发送失败: {result.get('errmsg')}")
-            return False
-        except Exception as e:
-            logger.error(f"发送企业微信消息时发生错误: {str(e)}")
+            except ValueError:
+                logger.warning(f"企业微信接口返回了无法解析的内容（第 {attempt + 1} 次）")
+                continue
+            if result.get("errcode") == 0:
+                logger.info("企业微信消息发送成功")
+                return True
+            if result.get("errcode") == ERRCODE_RATE_LIMITED:
+                logger.warning(f"企业微信接口频率超限（第 {attempt + 1} 次）: {result.get('errmsg')}")
+                continue
+            logger.error(f"企业微信消息发送失败: {result.get('errmsg')}")
             return False
+        
+        logger.error(f"企业微信消息重试 {self.max_retries} 次后仍发送失败")
+        return False
+    
+    def close(self, timeout=60):
+        """等待队列中的消息发送完毕并关闭连接
+        
+        Args:
+            timeout: 最多等待的秒数
+        """
+        worker = self.worker
+        if worker is not None and worker.is_alive():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning("企业微信发送队列已满，未能等待剩余消息发送")
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.warning(f"企业微信发送队列在 {timeout} 秒内未发送完毕，剩余 {self.queue.qsize()} 条消息")
+        self.worker = None
+        self.session.close()